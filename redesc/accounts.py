@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from typing import TYPE_CHECKING
+
+from redesc.common import (
+    credential_manager_var,
+    current_account_var,
+    youtube_api_var,
+    youtube_oauth2_var,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from redesc.api import YouTubeAPI
+    from redesc.credentials import CredentialManager
+    from redesc.setup import YouTubeOAuth2
+
+_LOGGER = logging.getLogger("redesc.accounts")
+
+# The account configured at the top level of config.yml.
+DEFAULT_ACCOUNT = ""
+DEFAULT_ACCOUNT_LABEL = "główny"
+
+
+class UnknownAccountError(LookupError):
+    pass
+
+
+@dataclasses.dataclass
+class Account:
+    """A YouTube channel with its own API client, credentials and quota."""
+
+    name: str
+    default_playlist_id: str
+    api: YouTubeAPI
+    credentials: CredentialManager
+    oauth2: YouTubeOAuth2
+    quota_budget: int
+
+    @property
+    def label(self) -> str:
+        return self.name or DEFAULT_ACCOUNT_LABEL
+
+    def activate(self) -> None:
+        """
+        Make the account the one used by the current task.
+
+        Only affects the task that calls it, e.g. a single command invocation,
+        and the tasks it starts afterwards.
+        """
+        current_account_var.set(self)
+        youtube_api_var.set(self.api)
+        credential_manager_var.set(self.credentials)
+        youtube_oauth2_var.set(self.oauth2)
+
+
+class AccountRegistry:
+    def __init__(self, accounts: Iterable[Account]) -> None:
+        self.accounts = {account.name: account for account in accounts}
+
+    def __iter__(self) -> Iterator[Account]:
+        return iter(self.accounts.values())
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def get(self, name: str | None = None) -> Account:
+        """Return the account of the name, or the default one for None."""
+        if name is None or name.casefold() == DEFAULT_ACCOUNT_LABEL:
+            name = DEFAULT_ACCOUNT
+        account = self.accounts.get(name)
+        if account is None:
+            msg = f"Unknown account {name!r}"
+            raise UnknownAccountError(msg)
+        return account
+
+    @property
+    def labels(self) -> list[str]:
+        return [account.label for account in self]
+
+    @property
+    def quota_budgets(self) -> dict[str, int]:
+        return {account.name: account.quota_budget for account in self}
@@ -1,15 +1,63 @@
 from __future__ import annotations
 
+import dataclasses
+import itertools
 import logging
-from typing import Any, cast
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, cast
 
-import googleapiclient.discovery
 import googleapiclient.errors
 
-from redesc.common import youtube_oauth2
+from redesc import metrics
+from redesc.cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL, ResponseCache
 
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator
+
+    import google.oauth2.credentials
+    from googleapiclient.discovery import Resource
+    from googleapiclient.http import HttpRequest
+
+    from redesc.credentials import CredentialManager
 _LOGGER = logging.getLogger("redesc.api")
 DEFAULT_LIMIT: int = 1000000
+MAX_IDS_PER_REQUEST: int = 50
+RETRY_STATUSES: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+MAX_RETRIES: int = 3
+
+
+def is_quota_exceeded(exc: googleapiclient.errors.HttpError) -> bool:
+    return exc.resp.status == 403 and b"quotaExceeded" in (exc.content or b"")
+
+
+@dataclasses.dataclass(frozen=True)
+class VideoRecord:
+    """The parts of a video resource that redesc works with."""
+
+    __slots__ = ("video_id", "title", "description", "tags", "category_id", "etag")
+
+    video_id: str
+    title: str
+    description: str
+    tags: tuple[str, ...]
+    category_id: str | None
+    etag: str | None
+
+    @classmethod
+    def from_resource(cls, resource: dict[str, Any]) -> VideoRecord:
+        snippet = resource["snippet"]
+        category_id = snippet.get("categoryId")
+        return cls(
+            video_id=resource["id"],
+            title=snippet["title"],
+            description=snippet["description"],
+            # Tags and categories repeat a lot across a channel.
+            tags=tuple(map(sys.intern, snippet.get("tags", ()))),
+            category_id=category_id and sys.intern(category_id),
+            etag=resource.get("etag"),
+        )
 
 
 def fix_tags(tags: list[str]) -> list[str]:
@@ -29,16 +77,109 @@ class YouTubeAPI:
         self,
         *,
         api_key: str,
+        credential_manager: CredentialManager,
+        cache_ttl: float = DEFAULT_TTL,
+        cache_size: int = DEFAULT_MAX_ENTRIES,
+        http_factory: Callable[[google.oauth2.credentials.Credentials], Any]
+        | None = None,
     ) -> None:
         self.api_key = api_key
+        self.credential_manager = credential_manager
+        # Builds the transport of a client, e.g. to record or replay its requests.
+        self.http_factory = http_factory
+        self.cache = ResponseCache(ttl=cache_ttl, max_entries=cache_size)
+        self._local = threading.local()
+        self._cached_for: google.oauth2.credentials.Credentials | None = None
 
     @property
-    def client(self) -> googleapiclient.discovery.Resource:
-        return googleapiclient.discovery.build(
-            "youtube",
-            "v3",
-            developerKey=self.api_key,
-            credentials=youtube_oauth2.get_credentials(),
+    def client(self) -> Resource:
+        """
+        The API client of the current thread.
+
+        Built once per thread, as the underlying httplib2 connections
+        are not thread-safe, and again only after a new authorization.
+        """
+        credentials = self.credential_manager.credentials
+        cached = getattr(self._local, "client", None)
+        if cached is not None and cached[0] is credentials:
+            return cached[1]
+        # Imported on first use, as it pulls in most of the Google stack.
+        import googleapiclient.discovery
+
+        with metrics.span("api.build"):
+            if self.http_factory is None:
+                transport: dict[str, Any] = {"credentials": credentials}
+            else:
+                transport = {"http": self.http_factory(credentials)}
+            client = googleapiclient.discovery.build(
+                "youtube",
+                "v3",
+                developerKey=self.api_key,
+                **transport,
+            )
+        self._local.client = (credentials, client)
+        return client
+
+    def _execute(
+        self,
+        request: HttpRequest,
+        endpoint: str,
+    ) -> dict[str, Any]:
+        attempt = 0
+        while True:
+            metrics.record_api_call(endpoint)
+            try:
+                with metrics.span(f"api.{endpoint}"):
+                    return cast(dict[str, Any], request.execute())
+            except googleapiclient.errors.HttpError as exc:
+                if exc.resp.status not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                    raise
+                delay = 2**attempt
+                attempt += 1
+                _LOGGER.warning(
+                    "%s failed with HTTP %s, retrying in %ds",
+                    endpoint,
+                    exc.resp.status,
+                    delay,
+                )
+                metrics.record_retry(endpoint)
+                with metrics.span("api.retry_sleep"):
+                    time.sleep(delay)
+
+    def _list(
+        self,
+        endpoint: str,
+        *,
+        tags: Iterable[str] = (),
+        fresh: bool = False,
+        **params: Any,
+    ) -> dict[str, Any]:
+        """
+        Execute a read-only call, such as `videos.list`, through the cache.
+
+        Tag the response with the IDs of the videos it contains, so that
+        updating them drops it from the cache.
+        """
+        credentials = self.credential_manager.credentials
+        if credentials is not self._cached_for:
+            # Responses cached for another authorization may not be valid anymore.
+            self.cache.clear()
+            self._cached_for = credentials
+        resource, method = endpoint.split(".")
+
+        def call() -> dict[str, Any]:
+            request = getattr(getattr(self.client, resource)(), method)(**params)
+            return self._execute(request, endpoint)
+
+        return cast(
+            dict[str, Any],
+            self.cache.get(
+                (endpoint, tuple(sorted(params.items()))),
+                call,
+                name=endpoint,
+                tags=tags,
+                fresh=fresh,
+            ),
         )
 
     def get_playlist_items(
@@ -47,20 +188,52 @@ class YouTubeAPI:
         *,
         limit: int = 10,
         empty_on_404: bool = True,
-    ) -> list[dict[str, Any]]:
+    ) -> list[VideoRecord]:
+        return [
+            item
+            for page in self.iter_playlist_pages(
+                playlist_id,
+                limit=limit,
+                empty_on_404=empty_on_404,
+            )
+            for item in page
+        ]
+
+    def iter_playlist_pages(
+        self,
+        playlist_id: str,
+        *,
+        limit: int = 10,
+        empty_on_404: bool = True,
+    ) -> Iterator[list[VideoRecord]]:
+        """Yield videos of a playlist page by page."""
+        for video_ids in self.iter_playlist_video_ids(
+            playlist_id,
+            limit=limit,
+            empty_on_404=empty_on_404,
+        ):
+            # Private and deleted videos are absent from the result.
+            yield self.get_videos(video_ids)
+
+    def iter_playlist_video_ids(
+        self,
+        playlist_id: str,
+        *,
+        limit: int = 10,
+        empty_on_404: bool = True,
+    ) -> Iterator[list[str]]:
         current_page = None
-        items = []
-        item_map = {}
+        fetched = 0
         pages_to_fetch, last_page_limit = divmod(limit, 50)
         for page_idx in range(pages_to_fetch + 1):
-            request = self.client.playlistItems().list(
-                part="snippet",
-                maxResults=limit,
-                playlistId=playlist_id,
-                pageToken=current_page,
-            )
             try:
-                resp = request.execute()
+                resp = self._list(
+                    "playlistItems.list",
+                    part="contentDetails",
+                    maxResults=limit,
+                    playlistId=playlist_id,
+                    pageToken=current_page,
+                )
             except googleapiclient.errors.HttpError as exc:
                 if exc.resp.status == 404:
                     if empty_on_404:
@@ -71,31 +244,86 @@ class YouTubeAPI:
             page_items = resp.get("items", [])
             if page_idx == pages_to_fetch:
                 page_items = page_items[:last_page_limit]
-            items.extend(page_items)
-            for item in items:
-                item["id"] = item["snippet"]["resourceId"]["videoId"]
-                item_map[item["id"]] = item
-            item_ids = ",".join(item["id"] for item in page_items)
-            items_with_tags = (
-                self.client.videos()
-                .list(
-                    part="snippet",
-                    id=item_ids,
-                )
-                .execute()
-            )
-            for item_with_tags in items_with_tags["items"]:
-                item_snippet = item_with_tags["snippet"]
-                item_map[item_with_tags["id"]]["snippet"][
-                    "tags"
-                ] = item_snippet.setdefault("tags", [])
-
-            if len(items) >= limit:
+            if not page_items:
+                break
+            yield [item["contentDetails"]["videoId"] for item in page_items]
+            fetched += len(page_items)
+            if fetched >= limit:
                 break
             current_page = resp.get("nextPageToken")
             if not current_page:
                 break
-        return items
+
+    def get_newest_playlist_video_ids(
+        self,
+        playlist_id: str,
+        *,
+        etag: str | None = None,
+    ) -> tuple[str | None, list[str]] | None:
+        """
+        Return the etag and the video IDs of the first page of a playlist.
+
+        Return None if the page has not changed since it had the given etag.
+        """
+        request = self.client.playlistItems().list(
+            part="contentDetails",
+            maxResults=MAX_IDS_PER_REQUEST,
+            playlistId=playlist_id,
+        )
+        if etag is not None:
+            request.headers["If-None-Match"] = etag
+        try:
+            resp = self._execute(request, "playlistItems.list")
+        except googleapiclient.errors.HttpError as exc:
+            if exc.resp.status == 304:
+                return None
+            raise
+        return resp.get("etag"), [
+            item["contentDetails"]["videoId"] for item in resp.get("items", [])
+        ]
+
+    def get_channel_playlist_ids(self) -> list[str]:
+        """Return IDs of all playlists of the authorized channel."""
+        playlist_ids: list[str] = []
+        current_page = None
+        while True:
+            resp = self._list(
+                "playlists.list",
+                part="id",
+                mine=True,
+                maxResults=MAX_IDS_PER_REQUEST,
+                pageToken=current_page,
+            )
+            playlist_ids.extend(item["id"] for item in resp.get("items", []))
+            current_page = resp.get("nextPageToken")
+            if not current_page:
+                return playlist_ids
+
+    def get_videos(
+        self,
+        video_ids: Iterable[str],
+        *,
+        fresh: bool = False,
+    ) -> list[VideoRecord]:
+        """
+        Fetch videos, up to 50 IDs per request.
+
+        If `fresh` is true, bypass the cache, e.g. to check that a video
+        has not changed right before updating it.
+        """
+        videos: list[VideoRecord] = []
+        video_ids = iter(video_ids)
+        while chunk := list(itertools.islice(video_ids, MAX_IDS_PER_REQUEST)):
+            resp = self._list(
+                "videos.list",
+                tags=chunk,
+                fresh=fresh,
+                part="snippet",
+                id=",".join(chunk),
+                maxResults=MAX_IDS_PER_REQUEST,
+            )
+            videos.extend(map(VideoRecord.from_resource, resp.get("items", [])))
+        return videos
 
     def update_video_description(
         self,
@@ -112,13 +340,11 @@ class YouTubeAPI:
             description,
         )
         if video_title is None or video_category_id is None:
-            data = (
-                self.client.videos()
-                .list(
-                    part="snippet",
-                    id=video_id,
-                )
-                .execute()
+            data = self._list(
+                "videos.list",
+                tags=[video_id],
+                part="snippet",
+                id=video_id,
             )
             item = data["items"][0]
             if video_title is None:
@@ -139,4 +365,8 @@ class YouTubeAPI:
                 },
             },
         )
-        return cast(dict[str, Any], request.execute())
+        try:
+            return self._execute(request, "videos.update")
+        finally:
+            # Even a failed update might have gone through.
+            self.cache.invalidate([video_id])
@@ -1,10 +1,34 @@
+from __future__ import annotations
+
+import asyncio
 import logging
+import operator
+from typing import TYPE_CHECKING, Any
 
 import crescent
 import hikari
 import miru
 
-from redesc.common import app, app_config, app_var, client, client_var, running_app_var
+from redesc import control, jobs, metrics, shards, standing
+from redesc.common import (
+    accounts,
+    app,
+    app_config,
+    app_var,
+    client,
+    client_var,
+    job_queue,
+    journal,
+    running_app_var,
+    sessions,
+    shard_store,
+    snapshot,
+    store,
+    youtube_api,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Coroutine
 
 _LOGGER = logging.getLogger("redesc.main")
 
@@ -17,6 +41,8 @@ miru.install(app)
 client_var.set(crescent.Client(app))
 client.plugins.load("redesc.main")
 
+background_tasks: set[asyncio.Task[None]] = set()
+
 
 async def interaction_made(event: hikari.InteractionCreateEvent) -> None:
     interaction = event.interaction
@@ -41,10 +67,90 @@ async def interaction_made(event: hikari.InteractionCreateEvent) -> None:
         )
 
 
+def run_in_background(coro: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def notify(content: str) -> None:
+    await app.rest.create_message(app_config.permitted_discord_channel_id, content)
+
+
+async def warm_up() -> None:
+    """Import the Google stack and build the API client while nobody waits for it."""
+    with metrics.span("warm_up"):
+        for account in accounts:
+            await asyncio.to_thread(operator.attrgetter("api.client"), account)
+
+
+async def started(_: hikari.StartedEvent) -> None:
+    run_in_background(warm_up())
+    run_in_background(sessions.reap())
+    if app_config.metrics_log_interval > 0:
+        run_in_background(metrics.log_periodically(app_config.metrics_log_interval))
+    # Accounts have separate quotas, so their queues are drained concurrently.
+    for account in accounts:
+        run_in_background(account.credentials.run())
+        run_in_background(
+            jobs.run_scheduler(
+                job_queue,
+                account.api,
+                notify,
+                journal,
+                account.name,
+            ),
+        )
+    run_in_background(shards.report_finished(shard_store, notify))
+    if app_config.control_api_port:
+        if app_config.control_api_token:
+            run_in_background(
+                control.serve(
+                    app_config.control_api_host,
+                    app_config.control_api_port,
+                    app_config.control_api_token,
+                ),
+            )
+        else:
+            _LOGGER.warning("Not starting the control API without a token")
+    standing_rules = standing.compile_rules(
+        [
+            (
+                rule.name,
+                jobs.Rule(
+                    expression=rule.expression,
+                    replacement=rule.replacement,
+                    with_title=rule.titles,
+                    with_description=rule.descriptions,
+                ),
+            )
+            for rule in app_config.standing_rules
+        ],
+        max_risk=app_config.max_pattern_risk,
+    )
+    if standing_rules:
+        run_in_background(
+            standing.run_standing_rules(
+                standing.StandingRules(
+                    store,
+                    youtube_api,
+                    standing_rules,
+                    app_config.default_playlist_id,
+                    max_updates=app_config.standing_rules_max_updates,
+                    snapshot=snapshot,
+                    journal=journal,
+                ),
+                notify,
+                app_config.standing_rules_interval,
+            ),
+        )
+
+
 if __name__ == "__main__":
     activity = hikari.Activity(
         name="opisy do podmiany",
         type=hikari.ActivityType.WATCHING,
     )
     app.event_manager.subscribe(hikari.InteractionCreateEvent, interaction_made)
+    app.event_manager.subscribe(hikari.StartedEvent, started)
     app.run(activity=activity)
@@ -0,0 +1,487 @@
+"""
+Compact, memory-mapped archives of video metadata for offline analysis.
+
+An archive holds the same fields for every video, e.g. a snapshot of the
+channel or the entries of `tags.json`. Records are grouped into blocks,
+each compressed on its own and laid out as a string table with fixed-width
+offsets, so a single video costs decompressing one block and a full scan
+holds one block in memory at a time.
+
+Layout (all integers little-endian):
+    header
+    blocks
+    block table: (offset, compressed length, record count) per block
+    index: (video ID, block, position in block) per video, sorted by ID
+    metadata: JSON with the fields and the codec
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import importlib
+import json
+import logging
+import mmap
+import pathlib
+import struct
+import time
+import zlib
+from typing import TYPE_CHECKING, Any, Callable, Union, cast
+
+from redesc.api import VideoRecord
+
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Iterable, Iterator, Mapping, Sequence
+    from types import ModuleType
+
+    from typing_extensions import Self
+
+    from redesc.snapshot import Snapshot
+
+zstandard: ModuleType | None
+try:
+    zstandard = importlib.import_module("zstandard")
+except ImportError:  # optional, the archives are just larger without it
+    zstandard = None
+
+_LOGGER = logging.getLogger("redesc.archive")
+
+MAGIC = b"REDESCA\x00"
+VERSION = 1
+# magic, version, codec, record count, block count,
+# block table offset, index offset, metadata offset, metadata length
+HEADER = struct.Struct("<8sHHIIQQQI")
+BLOCK_ENTRY = struct.Struct("<QII")
+# Video IDs are 11 characters long, the rest is padding.
+INDEX_ENTRY = struct.Struct("<16sII")
+MAX_ID_LENGTH = 16
+# record count, string count
+BLOCK_HEADER = struct.Struct("<II")
+# Each field of a record is a run of strings: first string, string count.
+SPAN = struct.Struct("<II")
+
+# Enough to compress well, small enough to decompress for a single video.
+BLOCK_SIZE: int = 256
+
+TEXT = "text"
+LIST = "list"
+
+ZLIB = 1
+ZSTD = 2
+CODEC_NAMES = {ZLIB: "zlib", ZSTD: "zstd"}
+
+SNAPSHOT_FIELDS = {
+    "title": TEXT,
+    "description": TEXT,
+    "tags": LIST,
+    "category_id": TEXT,
+    "etag": TEXT,
+}
+TAGS_JSON_FIELDS = {
+    "title": TEXT,
+    "lemmas": TEXT,
+    "hashtags": LIST,
+    "tags": LIST,
+}
+
+Value = Union[str, "list[str]", None]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def default_codec() -> int:
+    return ZLIB if zstandard is None else ZSTD
+
+
+def _compressor(codec: int) -> Callable[[bytes], bytes]:
+    if codec == ZLIB:
+        return zlib.compress
+    if codec == ZSTD and zstandard is not None:
+        compress: Callable[[bytes], bytes] = zstandard.ZstdCompressor(level=10).compress
+        return compress
+    msg = f"Codec {CODEC_NAMES.get(codec, codec)} is not available"
+    raise ArchiveError(msg)
+
+
+def _decompressor(codec: int) -> Callable[[bytes], bytes]:
+    if codec == ZLIB:
+        return zlib.decompress
+    if codec == ZSTD and zstandard is not None:
+        decompress: Callable[[bytes], bytes] = zstandard.ZstdDecompressor().decompress
+        return decompress
+    msg = f"Codec {CODEC_NAMES.get(codec, codec)} is not available"
+    raise ArchiveError(msg)
+
+
+def _encode_block(
+    fields: Mapping[str, str],
+    rows: Sequence[tuple[str, Mapping[str, Any]]],
+) -> bytes:
+    spans: list[int] = []
+    strings: list[bytes] = []
+    for video_id, row in rows:
+        spans += (len(strings), 1)
+        strings.append(video_id.encode())
+        for name, kind in fields.items():
+            value = row.get(name)
+            if value is None:
+                items: Iterable[str] = ()
+            elif kind == TEXT:
+                items = (value,)
+            else:
+                items = value
+            first = len(strings)
+            strings.extend(item.encode() for item in items)
+            spans += (first, len(strings) - first)
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return b"".join(
+        (
+            BLOCK_HEADER.pack(len(rows), len(strings)),
+            struct.pack(f"<{len(spans)}I", *spans),
+            struct.pack(f"<{len(offsets)}I", *offsets),
+            *strings,
+        ),
+    )
+
+
+def write(
+    path: str | os.PathLike[str],
+    fields: Mapping[str, str],
+    rows: Iterable[tuple[str, Mapping[str, Any]]],
+    *,
+    codec: int | None = None,
+    block_size: int = BLOCK_SIZE,
+) -> int:
+    """
+    Write (video ID, fields) pairs to an archive, holding one block at a time.
+
+    Return the number of records written.
+    """
+    if codec is None:
+        codec = default_codec()
+    compress = _compressor(codec)
+    block_table: list[tuple[int, int, int]] = []
+    index: list[tuple[bytes, int, int]] = []
+    seen: set[str] = set()
+    with pathlib.Path(path).open("wb") as file:
+        file.write(b"\x00" * HEADER.size)
+        block: list[tuple[str, Mapping[str, Any]]] = []
+
+        def flush() -> None:
+            data = compress(_encode_block(fields, block))
+            block_table.append((file.tell(), len(data), len(block)))
+            file.write(data)
+            block.clear()
+
+        for video_id, row in rows:
+            key = video_id.encode()
+            if len(key) > MAX_ID_LENGTH or video_id in seen:
+                msg = f"Invalid or duplicate video ID {video_id!r}"
+                raise ArchiveError(msg)
+            seen.add(video_id)
+            index.append((key, len(block_table), len(block)))
+            block.append((video_id, row))
+            if len(block) >= block_size:
+                flush()
+        if block:
+            flush()
+        block_table_offset = file.tell()
+        for block_entry in block_table:
+            file.write(BLOCK_ENTRY.pack(*block_entry))
+        index_offset = file.tell()
+        for index_entry in sorted(index):
+            file.write(INDEX_ENTRY.pack(*index_entry))
+        metadata_offset = file.tell()
+        metadata = json.dumps(
+            {"fields": dict(fields), "created_at": time.time()},
+        ).encode()
+        file.write(metadata)
+        file.seek(0)
+        file.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                codec,
+                len(index),
+                len(block_table),
+                block_table_offset,
+                index_offset,
+                metadata_offset,
+                len(metadata),
+            ),
+        )
+    _LOGGER.info(
+        "Wrote %d records in %d blocks (%s) to %s",
+        len(index),
+        len(block_table),
+        CODEC_NAMES[codec],
+        path,
+    )
+    return len(index)
+
+
+class _Keys:
+    """Sorted video IDs of the index, read from the mapping on demand."""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int) -> None:
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position: int) -> bytes:
+        return self.entry(position)[0]
+
+    def entry(self, position: int) -> tuple[bytes, int, int]:
+        key, block, position_in_block = INDEX_ENTRY.unpack_from(
+            self.buffer,
+            self.offset + position * INDEX_ENTRY.size,
+        )
+        return key.rstrip(b"\x00"), block, position_in_block
+
+
+class _Block:
+    def __init__(self, data: bytes, field_count: int) -> None:
+        self.data = data
+        self.record_count, string_count = BLOCK_HEADER.unpack_from(data)
+        # The video ID comes first, as an extra text field.
+        self.width = field_count + 1
+        spans_size = self.record_count * self.width * SPAN.size
+        self.offsets_at = BLOCK_HEADER.size + spans_size
+        self.strings_at = self.offsets_at + (string_count + 1) * 4
+
+    def strings(self, first: int, count: int) -> list[str]:
+        offsets = struct.unpack_from(
+            f"<{count + 1}I",
+            self.data,
+            self.offsets_at + first * 4,
+        )
+        return [
+            self.data[self.strings_at + start : self.strings_at + end].decode()
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def spans(self, position: int) -> Iterator[tuple[int, int]]:
+        start = BLOCK_HEADER.size + position * self.width * SPAN.size
+        for field in range(self.width):
+            yield SPAN.unpack_from(self.data, start + field * SPAN.size)
+
+
+class Archive:
+    """Read-only view of an archive file, mapped into memory."""
+
+    codec: int
+    record_count: int
+    block_count: int
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = path
+        with pathlib.Path(path).open("rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < HEADER.size:
+            self._buffer.close()
+            msg = f"{path} is not an archive"
+            raise ArchiveError(msg)
+        (
+            magic,
+            version,
+            self.codec,
+            self.record_count,
+            self.block_count,
+            self._block_table_offset,
+            index_offset,
+            metadata_offset,
+            metadata_length,
+        ) = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            self._buffer.close()
+            msg = f"{path} is not an archive of version {VERSION}"
+            raise ArchiveError(msg)
+        metadata = json.loads(
+            self._buffer[metadata_offset : metadata_offset + metadata_length],
+        )
+        self.fields: dict[str, str] = metadata["fields"]
+        self.created_at: float = metadata["created_at"]
+        self._decompress = _decompressor(self.codec)
+        self._keys = _Keys(self._buffer, index_offset, self.record_count)
+        # Consecutive lookups tend to hit the same block.
+        self._cached: tuple[int, _Block] | None = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._cached = None
+        self._buffer.close()
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def __contains__(self, video_id: object) -> bool:
+        return isinstance(video_id, str) and self._find(video_id) is not None
+
+    def _find(self, video_id: str) -> tuple[int, int] | None:
+        key = video_id.encode()
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys):
+            found, block, position_in_block = self._keys.entry(position)
+            if found == key:
+                return block, position_in_block
+        return None
+
+    def _block(self, number: int) -> _Block:
+        if self._cached is not None and self._cached[0] == number:
+            return self._cached[1]
+        offset, length, _ = BLOCK_ENTRY.unpack_from(
+            self._buffer,
+            self._block_table_offset + number * BLOCK_ENTRY.size,
+        )
+        block = _Block(
+            self._decompress(self._buffer[offset : offset + length]),
+            len(self.fields),
+        )
+        self._cached = (number, block)
+        return block
+
+    def _record(self, block: _Block, position: int) -> tuple[str, dict[str, Value]]:
+        spans = block.spans(position)
+        (video_id,) = block.strings(*next(spans))
+        record: dict[str, Value] = {}
+        for (name, kind), span in zip(self.fields.items(), spans):
+            strings = block.strings(*span)
+            if kind == LIST:
+                record[name] = strings
+            else:
+                record[name] = strings[0] if strings else None
+        return video_id, record
+
+    def get(self, video_id: str) -> dict[str, Value] | None:
+        """Return the fields of a video, or None if it is not in the archive."""
+        found = self._find(video_id)
+        if found is None:
+            return None
+        block, position = found
+        return self._record(self._block(block), position)[1]
+
+    def __iter__(self) -> Iterator[tuple[str, dict[str, Value]]]:
+        """Yield all (video ID, fields) pairs, in the order they were written."""
+        for number in range(self.block_count):
+            block = self._block(number)
+            for position in range(block.record_count):
+                yield self._record(block, position)
+
+    def values(self, field: str) -> Iterator[tuple[str, Value]]:
+        """Yield (video ID, value) pairs of a single field, e.g. descriptions."""
+        if field not in self.fields:
+            msg = f"No field {field!r} in {self.path}"
+            raise ArchiveError(msg)
+        skip = list(self.fields).index(field) + 1
+        is_list = self.fields[field] == LIST
+        for number in range(self.block_count):
+            block = self._block(number)
+            for position in range(block.record_count):
+                spans = list(block.spans(position))
+                (video_id,) = block.strings(*spans[0])
+                strings = block.strings(*spans[skip])
+                if is_list:
+                    yield video_id, strings
+                else:
+                    yield video_id, strings[0] if strings else None
+
+    def video_records(self) -> Iterator[VideoRecord]:
+        """Yield the videos of an archive exported from the snapshot."""
+        missing = SNAPSHOT_FIELDS.keys() - self.fields.keys()
+        if missing:
+            msg = f"{self.path} is not a snapshot, it lacks {sorted(missing)}"
+            raise ArchiveError(msg)
+        for video_id, record in self:
+            yield VideoRecord(
+                video_id=video_id,
+                title=cast(str, record["title"]),
+                description=cast(str, record["description"]),
+                tags=tuple(cast("list[str]", record["tags"])),
+                category_id=cast("str | None", record["category_id"]),
+                etag=cast("str | None", record["etag"]),
+            )
+
+
+def tags_json_rows(
+    path: str | os.PathLike[str],
+) -> Iterator[tuple[str, Mapping[str, Any]]]:
+    entries = json.loads(pathlib.Path(path).read_text())
+    yield from entries.items()
+
+
+def snapshot_rows(snapshot: Snapshot) -> Iterator[tuple[str, Mapping[str, Any]]]:
+    for record in snapshot.iter_records():
+        yield record.video_id, {
+            "title": record.title,
+            "description": record.description,
+            "tags": record.tags,
+            "category_id": record.category_id,
+            "etag": record.etag,
+        }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m redesc.archive")
+    parser.add_argument(
+        "--codec",
+        choices=list(CODEC_NAMES.values()),
+        help="compression of new archives, zstd if zstandard is installed",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    tags = commands.add_parser("tags", help="convert tags.json to an archive")
+    tags.add_argument("archive")
+    tags.add_argument("--source", default="tags.json")
+    export = commands.add_parser("snapshot", help="export the snapshot of videos")
+    export.add_argument("archive")
+    export.add_argument("--database", default="redesc.db")
+    show = commands.add_parser("show", help="describe an archive or print a video")
+    show.add_argument("archive")
+    show.add_argument("video_id", nargs="?")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    codec = {name: codec for codec, name in CODEC_NAMES.items()}.get(args.codec)
+
+    if args.command == "tags":
+        rows = tags_json_rows(args.source)
+        write(args.archive, TAGS_JSON_FIELDS, rows, codec=codec)
+    elif args.command == "snapshot":
+        from redesc.snapshot import Snapshot
+        from redesc.store import Store
+
+        store = Store(args.database)
+        try:
+            rows = snapshot_rows(Snapshot(store))
+            write(args.archive, SNAPSHOT_FIELDS, rows, codec=codec)
+        finally:
+            store.close()
+    else:
+        with Archive(args.archive) as archive:
+            if args.video_id is None:
+                fields = ", ".join(
+                    f"{name} ({kind})" for name, kind in archive.fields.items()
+                )
+                print(  # noqa: T201
+                    f"{len(archive)} videos, {archive.block_count} blocks "
+                    f"({CODEC_NAMES[archive.codec]}), fields: {fields}",
+                )
+            else:
+                record = archive.get(args.video_id)
+                print(json.dumps(record, ensure_ascii=False, indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
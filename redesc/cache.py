@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from redesc import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable, Iterable
+
+_LOGGER = logging.getLogger("redesc.cache")
+
+DEFAULT_TTL: float = 60
+DEFAULT_MAX_ENTRIES: int = 512
+
+
+@dataclasses.dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    tags: frozenset[str]
+
+
+@dataclasses.dataclass
+class _Call:
+    tags: frozenset[str]
+    done: threading.Event = dataclasses.field(default_factory=threading.Event)
+    value: Any = None
+    error: BaseException | None = None
+
+
+class ResponseCache:
+    """
+    Responses of read-only API calls, shared between threads.
+
+    Identical calls made at the same time wait for the first one instead of
+    being sent again, and their result is kept for a short while. Entries are
+    tagged, e.g. with the IDs of the videos they contain, so that they can be
+    dropped as soon as these videos change. Cached values must not be mutated.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict[Hashable, _Entry] = (
+            collections.OrderedDict()
+        )
+        self._in_flight: dict[Hashable, _Call] = {}
+        # Bumped on every invalidation, so that responses that were on their way
+        # while the data changed are not cached.
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self,
+        key: Hashable,
+        call: Callable[[], Any],
+        *,
+        name: str,
+        tags: Iterable[str] = (),
+        fresh: bool = False,
+    ) -> Any:
+        """
+        Return the cached result of `call`, or make it.
+
+        If `fresh` is true, the call is made regardless of the cache,
+        and its result replaces the cached one.
+        """
+        with self._lock:
+            found = None if fresh else self._lookup(key)
+            if found is None:
+                own = _Call(frozenset(tags))
+                if not fresh:
+                    self._in_flight[key] = own
+                generation = self._generation
+        if isinstance(found, _Entry):
+            metrics.record_cache_lookup(name, "hit")
+            return found.value
+        if found is not None:
+            metrics.record_cache_lookup(name, "shared")
+            found.done.wait()
+            if found.error is not None:
+                raise found.error
+            return found.value
+        metrics.record_cache_lookup(name, "miss")
+        return self._make(key, call, own, generation)
+
+    def _lookup(self, key: Hashable) -> _Entry | _Call | None:
+        """Return the live entry or the call in flight for the key. Needs the lock."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry
+        return self._in_flight.get(key)
+
+    def _make(
+        self,
+        key: Hashable,
+        call: Callable[[], Any],
+        own: _Call,
+        generation: int,
+    ) -> Any:
+        try:
+            own.value = call()
+        except BaseException as exc:
+            own.error = exc
+            raise
+        else:
+            self._store(key, own, generation)
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is own:
+                    del self._in_flight[key]
+            own.done.set()
+        return own.value
+
+    def _store(self, key: Hashable, call: _Call, generation: int) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = _Entry(
+                call.value,
+                time.monotonic() + self.ttl,
+                call.tags,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        """Drop the responses tagged with any of the tags."""
+        tags = frozenset(tags)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if entry.tags & tags]
+            for key in stale:
+                del self._entries[key]
+            # Calls already on their way may miss the change, so later calls
+            # should not wait for them.
+            for key, call in list(self._in_flight.items()):
+                if call.tags & tags:
+                    del self._in_flight[key]
+        if stale:
+            _LOGGER.debug("Invalidated %d cached responses", len(stale))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._in_flight.clear()
@@ -0,0 +1,259 @@
+"""
+Recording and replaying of YouTube API traffic at the httplib2 layer.
+
+`YouTubeAPI(http_factory=...)` builds its clients on top of the returned
+HTTP object, so a recorded session goes through exactly the same code as
+a live one, paging and retries included, without any network access.
+"""
+
+from __future__ import annotations
+
+import collections
+import dataclasses
+import json
+import logging
+import pathlib
+import threading
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import os
+
+    from google.oauth2.credentials import Credentials
+
+_LOGGER = logging.getLogger("redesc.cassette")
+
+VERSION = 1
+# Only requests of the YouTube Data API are recorded, not e.g. token refreshes.
+RECORDED_PATH = "/youtube/"
+# Query parameters that carry secrets. They are neither saved nor matched.
+SCRUBBED_PARAMS = frozenset({"key", "access_token", "oauth_token"})
+# Request headers that change the response, and so are matched.
+MATCHED_HEADERS = ("if-none-match",)
+SAVED_RESPONSE_HEADERS = ("content-type", "etag")
+
+
+class CassetteMismatchError(LookupError):
+    pass
+
+
+def _normalize_uri(uri: str) -> str:
+    """Drop secrets and sort the query, so that equal requests look the same."""
+    parts = urllib.parse.urlsplit(uri)
+    query = sorted(
+        (name, value)
+        for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if name not in SCRUBBED_PARAMS
+    )
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query), fragment=""),
+    )
+
+
+def _matched_headers(headers: dict[str, str] | None) -> dict[str, str]:
+    lowered = {name.lower(): value for name, value in (headers or {}).items()}
+    return {name: lowered[name] for name in MATCHED_HEADERS if name in lowered}
+
+
+def _text(body: bytes | str | None) -> str | None:
+    if isinstance(body, bytes):
+        # Lossless for whatever is not UTF-8, and still valid JSON.
+        return body.decode(errors="surrogateescape")
+    return body
+
+
+@dataclasses.dataclass
+class Interaction:
+    method: str
+    uri: str
+    body: str | None
+    headers: dict[str, str]
+    status: int
+    reason: str
+    response_headers: dict[str, str]
+    content: str
+    elapsed: float
+
+    @property
+    def key(self) -> tuple[str, str, str | None, tuple[tuple[str, str], ...]]:
+        return self.method, self.uri, self.body, tuple(sorted(self.headers.items()))
+
+
+class Cassette:
+    """Request/response pairs of a session, saved as a JSON file."""
+
+    def __init__(
+        self,
+        interactions: list[Interaction] | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> None:
+        self.interactions = interactions or []
+        self.metadata = metadata or {}
+        self._lock = threading.Lock()
+
+    def add(self, interaction: Interaction) -> None:
+        with self._lock:
+            self.interactions.append(interaction)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike[str]) -> Cassette:
+        data = json.loads(pathlib.Path(path).read_text())
+        if data.get("version") != VERSION:
+            msg = f"{path} is not a cassette of version {VERSION}"
+            raise ValueError(msg)
+        return cls(
+            [Interaction(**interaction) for interaction in data["interactions"]],
+            data["metadata"],
+        )
+
+    def save(self, path: str | os.PathLike[str]) -> None:
+        with self._lock:
+            interactions = list(map(dataclasses.asdict, self.interactions))
+        data = {
+            "version": VERSION,
+            "metadata": self.metadata,
+            "interactions": interactions,
+        }
+        pathlib.Path(path).write_text(json.dumps(data, indent=2, ensure_ascii=False))
+        _LOGGER.info("Saved %d interactions to %s", len(interactions), path)
+
+
+class RecordingHttp:
+    """Wraps an httplib2.Http, adding the API requests it makes to a cassette."""
+
+    def __init__(self, http: Any, cassette: Cassette) -> None:
+        self.http = http
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        # timeout, redirect_codes, close() etc. that the clients use.
+        return getattr(self.http, name)
+
+    def request(
+        self,
+        uri: str,
+        method: str = "GET",
+        body: bytes | str | None = None,
+        headers: dict[str, str] | None = None,
+        **kwargs: Any,
+    ) -> tuple[Any, bytes]:
+        started_at = time.perf_counter()
+        response, content = self.http.request(
+            uri,
+            method=method,
+            body=body,
+            headers=headers,
+            **kwargs,
+        )
+        elapsed = time.perf_counter() - started_at
+        if RECORDED_PATH in urllib.parse.urlsplit(uri).path:
+            self.cassette.add(
+                Interaction(
+                    method=method,
+                    uri=_normalize_uri(uri),
+                    body=_text(body),
+                    headers=_matched_headers(headers),
+                    status=response.status,
+                    reason=response.reason,
+                    response_headers={
+                        name: response[name]
+                        for name in SAVED_RESPONSE_HEADERS
+                        if name in response
+                    },
+                    content=_text(content) or "",
+                    elapsed=elapsed,
+                ),
+            )
+        return response, content
+
+
+def recording_http_factory(cassette: Cassette) -> Any:
+    """Return an `http_factory` making authorized requests that are recorded."""
+
+    def factory(credentials: Credentials) -> Any:
+        # Imported on first use, like the rest of the Google stack.
+        import google_auth_httplib2
+        import httplib2
+
+        return google_auth_httplib2.AuthorizedHttp(
+            credentials,
+            http=RecordingHttp(httplib2.Http(), cassette),
+        )
+
+    return factory
+
+
+class ReplayHttp:
+    """
+    Answers requests with the responses recorded for them, in the same order.
+
+    With `speed`, every response takes as long as it took when recorded,
+    divided by it; with 0, responses are immediate.
+    """
+
+    def __init__(self, cassette: Cassette, *, speed: float = 1.0) -> None:
+        self.speed = speed
+        self.timeout: float | None = None
+        self.redirect_codes: frozenset[int] = frozenset()
+        self._lock = threading.Lock()
+        self._queues: dict[Any, collections.deque[Interaction]] = (
+            collections.defaultdict(collections.deque)
+        )
+        for interaction in cassette.interactions:
+            self._queues[interaction.key].append(interaction)
+
+    @property
+    def unused(self) -> list[Interaction]:
+        """Recorded interactions no request has asked for."""
+        with self._lock:
+            return [
+                interaction
+                for queue in self._queues.values()
+                for interaction in queue
+            ]
+
+    def close(self) -> None:
+        pass
+
+    def request(
+        self,
+        uri: str,
+        method: str = "GET",
+        body: bytes | str | None = None,
+        headers: dict[str, str] | None = None,
+        **_: Any,
+    ) -> tuple[Any, bytes]:
+        import httplib2
+
+        key = (
+            method,
+            _normalize_uri(uri),
+            _text(body),
+            tuple(sorted(_matched_headers(headers).items())),
+        )
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                msg = f"No recorded response left for {method} {key[1]}"
+                raise CassetteMismatchError(msg)
+            interaction = queue.popleft()
+        if self.speed:
+            time.sleep(interaction.elapsed / self.speed)
+        response = httplib2.Response(
+            {"status": str(interaction.status), **interaction.response_headers},
+        )
+        response.reason = interaction.reason
+        return response, interaction.content.encode(errors="surrogateescape")
+
+
+def replay_http_factory(replay: ReplayHttp) -> Any:
+    """Return an `http_factory` serving every client from the same replay."""
+    return lambda _credentials: replay
+
+
+class ReplayCredentialManager:
+    """Stands in for a CredentialManager, as replayed requests need no token."""
+
+    credentials: Any = None
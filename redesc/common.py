@@ -9,14 +9,35 @@ if TYPE_CHECKING:
     import hikari
     from crescent import Client
 
+    from redesc.accounts import Account, AccountRegistry
     from redesc.api import YouTubeAPI
+    from redesc.credentials import CredentialManager
+    from redesc.jobs import JobQueue
+    from redesc.journal import Journal
+    from redesc.search import SearchIndex
+    from redesc.sessions import SessionRegistry
     from redesc.setup import AppConfig, YouTubeOAuth2
+    from redesc.shards import ShardStore
+    from redesc.snapshot import Snapshot
+    from redesc.store import Store
 
 app_config_var: ContextVar[AppConfig] = ContextVar("app_config_var")
 app_var: ContextVar[hikari.GatewayBot] = ContextVar("app_var")
 client_var: ContextVar[Client] = ContextVar("client_var")
 youtube_oauth2_var: ContextVar[YouTubeOAuth2] = ContextVar("youtube_oauth2_var")
 youtube_api_var: ContextVar[YouTubeAPI] = ContextVar("youtube_api_var")
+credential_manager_var: ContextVar[CredentialManager] = ContextVar(
+    "credential_manager_var",
+)
+accounts_var: ContextVar[AccountRegistry] = ContextVar("accounts_var")
+current_account_var: ContextVar[Account] = ContextVar("current_account_var")
+store_var: ContextVar[Store] = ContextVar("store_var")
+job_queue_var: ContextVar[JobQueue] = ContextVar("job_queue_var")
+journal_var: ContextVar[Journal] = ContextVar("journal_var")
+snapshot_var: ContextVar[Snapshot] = ContextVar("snapshot_var")
+search_index_var: ContextVar[SearchIndex] = ContextVar("search_index_var")
+sessions_var: ContextVar[SessionRegistry] = ContextVar("sessions_var")
+shard_store_var: ContextVar[ShardStore] = ContextVar("shard_store_var")
 running_app_var: ContextVar[bool] = ContextVar("running_app_var", default=False)
 
 running_app: bool = lookup_proxy(running_app_var, bool)
@@ -25,3 +46,13 @@ app: hikari.GatewayBot = lookup_proxy(app_var)
 client: Client = lookup_proxy(client_var)
 youtube_oauth2: YouTubeOAuth2 = lookup_proxy(youtube_oauth2_var)
 youtube_api: YouTubeAPI = lookup_proxy(youtube_api_var)
+credential_manager: CredentialManager = lookup_proxy(credential_manager_var)
+accounts: AccountRegistry = lookup_proxy(accounts_var)
+current_account: Account = lookup_proxy(current_account_var)
+store: Store = lookup_proxy(store_var)
+job_queue: JobQueue = lookup_proxy(job_queue_var)
+journal: Journal = lookup_proxy(journal_var)
+snapshot: Snapshot = lookup_proxy(snapshot_var)
+search_index: SearchIndex = lookup_proxy(search_index_var)
+sessions: SessionRegistry = lookup_proxy(sessions_var)
+shard_store: ShardStore = lookup_proxy(shard_store_var)
@@ -0,0 +1,621 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import pathlib
+from typing import TYPE_CHECKING, Any, ClassVar, Protocol
+
+import googleapiclient.errors
+from aiohttp import web
+
+from redesc import engine, metrics, patterns, tagging
+from redesc.accounts import UnknownAccountError
+from redesc.api import MAX_IDS_PER_REQUEST, VideoRecord, is_quota_exceeded
+from redesc.common import (
+    accounts,
+    app_config,
+    job_queue,
+    journal,
+    sessions,
+    snapshot,
+    store,
+)
+from redesc.jobs import Rule
+from redesc.journal import JournalRun
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable, Collection
+
+    from redesc.accounts import Account
+    from redesc.engine import VideoDiff
+
+_LOGGER = logging.getLogger("redesc.control")
+
+FETCHING = "fetching"
+READY = "ready"
+APPLYING = "applying"
+DONE = "done"
+FAILED = "failed"
+
+MAX_PREVIEW = 200
+# The same as the default limit of /podmien.
+DEFAULT_APPLY_LIMIT = 100
+# Finished jobs are forgotten when there are more of them than this.
+MAX_FINISHED_JOBS = 20
+PROGRESS_INTERVAL = 1
+INVOKED_BY = "api"
+
+
+class RequestError(Exception):
+    """Raised for invalid requests; its message is returned to the client."""
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def diff_json(diff: VideoDiff) -> dict[str, Any]:
+    return {
+        "video_id": diff.video_id,
+        "url": f"https://www.youtube.com/watch?v={diff.video_id}",
+        "old_title": diff.old_title,
+        "new_title": diff.new_title,
+        "old_description": diff.old_description,
+        "new_description": diff.new_description,
+        "old_tags": list(diff.record.tags),
+        "new_tags": diff.tags,
+    }
+
+
+def _playlist_ids(body: dict[str, Any], account: Account) -> list[str]:
+    playlist_ids = body.get("playlists") or [account.default_playlist_id]
+    if not isinstance(playlist_ids, list) or not all(
+        isinstance(playlist_id, str) for playlist_id in playlist_ids
+    ):
+        msg = "playlists must be a list of playlist IDs"
+        raise RequestError(msg)
+    return list(dict.fromkeys(playlist_ids))
+
+
+class Job(abc.ABC):
+    """A run started through the control API, followed with server-sent events."""
+
+    kind: ClassVar[str]
+
+    def __init__(self, job_id: int, account: Account) -> None:
+        self.id = job_id
+        self.account = account
+        self.state = FETCHING
+        self.error: str | None = None
+        self.applied = 0
+        self.failed = 0
+        self.queued = 0
+        self.events: list[tuple[str, dict[str, Any]]] = []
+        self.invocation = metrics.Invocation(f"api.{self.kind}")
+        self.run = JournalRun(self.kind, INVOKED_BY, account=account.name)
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def settled(self) -> bool:
+        """Whether nothing runs in the job until it is applied (or ever)."""
+        return self._task is None and self.state in (READY, DONE, FAILED)
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "account": self.account.label,
+            "state": self.state,
+            "error": self.error,
+            "applied": self.applied,
+            "failed": self.failed,
+            "queued": self.queued,
+        }
+
+    def emit(self, event: str, **data: Any) -> None:
+        self.events.append((event, data))
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self, since: int = 0) -> AsyncIterator[tuple[int, str, Any]]:
+        """Yield the events from the given one on, until the job settles."""
+        for index in itertools.count(since):
+            while index >= len(self.events):
+                if self.settled:
+                    return
+                await self._changed.wait()
+            event, data = self.events[index]
+            yield index, event, data
+
+    def start(self, coro: Awaitable[None]) -> None:
+        async def run() -> None:
+            try:
+                with metrics.track(self.invocation):
+                    await coro
+            except asyncio.CancelledError:
+                self.state, self.error = FAILED, "cancelled"
+                raise
+            except Exception as exc:
+                _LOGGER.exception("Control API job %d failed", self.id)
+                self.state, self.error = FAILED, str(exc)
+            finally:
+                self._task = None
+                if self.state != READY:
+                    self.invocation.finish()
+                self.emit("status", **self.status())
+
+        self._task = asyncio.create_task(run())
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    @abc.abstractmethod
+    async def fetch(self) -> None:
+        """Find what the job is going to change."""
+
+    @abc.abstractmethod
+    async def preview(self, offset: int, limit: int) -> tuple[list[VideoDiff], int]:
+        """Return a page of the diffs and how many there are in total."""
+
+    @abc.abstractmethod
+    async def apply(self, video_ids: Collection[str] | None, limit: int) -> None:
+        """Apply the given diffs, or all of them, up to the limit."""
+
+    async def _update(self, diff: VideoDiff) -> bool:
+        """Apply a diff. Return False if the quota has run out."""
+        try:
+            with metrics.span("update"):
+                updated = await asyncio.to_thread(
+                    self.account.api.update_video_description,
+                    video_id=diff.video_id,
+                    video_title=diff.new_title,
+                    video_category_id=diff.video_category_id,
+                    description=diff.new_description,
+                    tags=diff.tags,
+                )
+        except googleapiclient.errors.HttpError as exc:
+            if is_quota_exceeded(exc):
+                return False
+            _LOGGER.exception("Failed to update %s", diff.video_id)
+            self.failed += 1
+            self.emit("failed", video_id=diff.video_id, error=str(exc))
+            return True
+        new_record = VideoRecord.from_resource(updated)
+        snapshot.save([new_record])
+        journal.record(self.run, diff.record, new_record)
+        self.applied += 1
+        self.emit("applied", video_id=diff.video_id)
+        return True
+
+
+class SubstitutionJob(Job):
+    kind = "podmien"
+
+    def __init__(self, job_id: int, account: Account, body: dict[str, Any]) -> None:
+        super().__init__(job_id, account)
+        try:
+            self.rule = Rule(
+                expression=str(body["expression"]),
+                replacement=str(body.get("replacement", "")),
+                with_title=bool(body.get("titles", True)),
+                with_description=bool(body.get("descriptions", True)),
+            )
+        except KeyError as exc:
+            msg = f"Missing field: {exc}"
+            raise RequestError(msg) from exc
+        try:
+            patterns.check_pattern(
+                self.rule.expression,
+                self.rule.replacement,
+                max_risk=app_config.max_pattern_risk,
+            )
+        except patterns.PatternError as exc:
+            msg = f"Invalid pattern: {exc}"
+            raise RequestError(msg) from exc
+        self.run.summary = f"{self.rule.expression} → {self.rule.replacement}"
+        playlist_ids = _playlist_ids(body, account)
+        self.source = engine.DiffSource(
+            account.api,
+            playlist_ids,
+            self.rule,
+            snapshot=snapshot,
+            pages=sessions.playlist_pages(account, playlist_ids, snapshot),
+        )
+
+    def status(self) -> dict[str, Any]:
+        return {
+            **super().status(),
+            "scanned": self.source.scanned,
+            "matches": len(self.source),
+        }
+
+    async def fetch(self) -> None:
+        self.source.start()
+        while not self.source.done:
+            self.emit("progress", scanned=self.source.scanned, matches=len(self.source))
+            await asyncio.sleep(PROGRESS_INTERVAL)
+        await self.source.wait_for()
+        self.state = READY
+
+    async def preview(self, offset: int, limit: int) -> tuple[list[VideoDiff], int]:
+        refs = self.source.refs[offset : offset + limit]
+        with metrics.span("materialize"):
+            diffs, dropped = await asyncio.to_thread(self.source.materialize, refs)
+        self.source.discard(dropped)
+        return diffs, len(self.source)
+
+    async def apply(self, video_ids: Collection[str] | None, limit: int) -> None:
+        pending = [
+            ref
+            for ref in self.source.refs
+            if video_ids is None or ref.video_id in video_ids
+        ]
+        ok = True
+        while ok and limit > 0 and pending:
+            # Materializing a batch fetches the videos anew,
+            # which doubles as a check that the diffs are up to date.
+            batch = pending[: min(MAX_IDS_PER_REQUEST, limit)]
+            del pending[: len(batch)]
+            try:
+                with metrics.span("materialize"):
+                    diffs, dropped = await asyncio.to_thread(
+                        self.source.materialize,
+                        batch,
+                        fresh=True,
+                    )
+            except googleapiclient.errors.HttpError as exc:
+                if not is_quota_exceeded(exc):
+                    raise
+                self.emit("quota_exceeded")
+                break
+            self.source.discard(dropped)
+            for diff in diffs:
+                ok = await self._update(diff)
+                if not ok:
+                    self.emit("quota_exceeded")
+                    break
+                limit -= 1
+                self.source.discard([diff.video_id])
+        # The queue rebuilds the diffs from fresh data when applying them.
+        left_over = [
+            ref.video_id
+            for ref in self.source.refs
+            if video_ids is None or ref.video_id in video_ids
+        ]
+        self.queued += job_queue.enqueue_refs(
+            left_over,
+            self.rule,
+            invoked_by=INVOKED_BY,
+            account=self.account.name,
+        )
+        self.source.discard(left_over)
+        self.state = DONE
+
+
+class TagJob(Job):
+    kind = "dodajtagi"
+
+    def __init__(self, job_id: int, account: Account, body: dict[str, Any]) -> None:
+        super().__init__(job_id, account)
+        self.playlist_ids = _playlist_ids(body, account)
+        self.mode = body.get("mode", tagging.UNION)
+        if self.mode not in tagging.MERGE_MODES:
+            msg = f"mode must be one of {', '.join(tagging.MERGE_MODES)}"
+            raise RequestError(msg)
+        self.generate = bool(body.get("generate", False))
+        self.remove = [str(tag) for tag in body.get("remove", ()) if str(tag).strip()]
+        if self.mode == tagging.REMOVE and not self.remove:
+            msg = "remove must list the tags to remove"
+            raise RequestError(msg)
+        self.refresh = bool(body.get("refresh", False))
+        self.run.summary = self.mode
+        self.diffs: list[VideoDiff] = []
+        self.entries: dict[str, Any] = {}
+        self.model: tagging.TagModel | None = None
+
+    def status(self) -> dict[str, Any]:
+        return {**super().status(), "matches": len(self.diffs)}
+
+    def planned_tags(self, record: VideoRecord) -> list[str] | None:
+        return tagging.planned_tags(
+            record,
+            self.entries,
+            self.mode,
+            model=self.model,
+            remove=self.remove,
+        )
+
+    async def fetch(self) -> None:
+        self.entries = json.loads(
+            await asyncio.to_thread(
+                pathlib.Path("tags.json").read_text,
+                encoding="utf-8",
+            ),
+        )
+        records = None
+        if not self.refresh and snapshot.scanned_at(self.playlist_ids) is not None:
+            records = await asyncio.to_thread(
+                snapshot.playlist_records,
+                self.playlist_ids,
+            )
+        if records is None:
+            records = []
+            async for page in sessions.playlist_pages(
+                self.account,
+                self.playlist_ids,
+                snapshot,
+            ):
+                records.extend(page)
+                self.emit("progress", scanned=len(records))
+        if self.generate and self.mode != tagging.REMOVE:
+            with metrics.span("tagging.model"):
+                self.model = await asyncio.to_thread(
+                    tagging.load_model,
+                    store,
+                    self.entries,
+                )
+        for record in records:
+            new_tags = self.planned_tags(record)
+            if new_tags is not None:
+                self.diffs.append(
+                    engine.VideoDiff(
+                        record=record,
+                        new_title=record.title,
+                        new_description=record.description,
+                        tags=new_tags,
+                    ),
+                )
+        self.state = READY
+
+    async def preview(self, offset: int, limit: int) -> tuple[list[VideoDiff], int]:
+        return self.diffs[offset : offset + limit], len(self.diffs)
+
+    async def apply(self, video_ids: Collection[str] | None, limit: int) -> None:
+        diffs = [
+            diff
+            for diff in self.diffs
+            if video_ids is None or diff.video_id in video_ids
+        ][:limit]
+        with metrics.span("validate"):
+            result = await asyncio.to_thread(engine.rebase, self.account.api, diffs)
+        dropped = set(result.dropped)
+        for diff in diffs:
+            if diff.video_id in dropped:
+                continue
+            new_tags = self.planned_tags(diff.record)
+            if new_tags is None:
+                dropped.add(diff.video_id)
+                continue
+            diff.tags = new_tags
+            if not await self._update(diff):
+                # Tag changes cannot wait in the queue; run the job again later.
+                self.emit("quota_exceeded")
+                break
+            dropped.add(diff.video_id)
+        self.diffs = [diff for diff in self.diffs if diff.video_id not in dropped]
+        self.state = DONE
+
+
+class JobFactory(Protocol):
+    def __call__(self, job_id: int, account: Account, body: dict[str, Any]) -> Job:
+        ...
+
+
+JOB_KINDS: dict[str, JobFactory] = {
+    SubstitutionJob.kind: SubstitutionJob,
+    TagJob.kind: TagJob,
+}
+
+
+class ControlAPI:
+    """
+    HTTP/JSON API for running substitutions and tag changes without Discord.
+
+    Every request needs the `Authorization: Bearer <token>` header.
+    """
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self.jobs: dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.add_routes(
+            [
+                web.get("/status", self.get_status),
+                web.get("/metrics", self.get_metrics),
+                web.get("/jobs", self.list_jobs),
+                web.post("/jobs", self.create_job),
+                web.get("/jobs/{id:\\d+}", self.get_job),
+                web.delete("/jobs/{id:\\d+}", self.delete_job),
+                web.get("/jobs/{id:\\d+}/diffs", self.get_diffs),
+                web.post("/jobs/{id:\\d+}/apply", self.apply_job),
+                web.get("/jobs/{id:\\d+}/events", self.stream_events),
+            ],
+        )
+
+    @web.middleware
+    async def _middleware(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization, f"Bearer {self.token}"):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        try:
+            return await handler(request)
+        except RequestError as exc:
+            return web.json_response({"error": str(exc)}, status=exc.status)
+        except googleapiclient.errors.HttpError as exc:
+            return web.json_response({"error": str(exc)}, status=502)
+
+    def _job(self, request: web.Request) -> Job:
+        job = self.jobs.get(int(request.match_info["id"]))
+        if job is None:
+            msg = "job not found"
+            raise RequestError(msg, 404)
+        return job
+
+    async def _body(self, request: web.Request) -> dict[str, Any]:
+        if not request.can_read_body:
+            return {}
+        try:
+            body = await request.json()
+        except json.JSONDecodeError as exc:
+            msg = f"invalid JSON: {exc}"
+            raise RequestError(msg) from exc
+        if not isinstance(body, dict):
+            msg = "the body must be a JSON object"
+            raise RequestError(msg)
+        return body
+
+    def _account(self, body: dict[str, Any]) -> Account:
+        try:
+            return accounts.get(body.get("account"))
+        except UnknownAccountError as exc:
+            msg = f"account must be one of {', '.join(accounts.labels)}"
+            raise RequestError(msg) from exc
+
+    async def _ensure_credentials(self, account: Account) -> None:
+        if not await account.credentials.ensure_valid():
+            msg = "the Google account needs to be authorized again with /uwierzytelnij"
+            raise RequestError(msg, 503)
+
+    def _forget_finished(self) -> None:
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.settled and job.state != READY
+        ]
+        for job_id in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job_id]
+
+    async def get_status(self, _: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "accounts": {
+                    account.label: {
+                        "credentials_valid": account.credentials.valid,
+                        "queue": {
+                            "pending": job_queue.count(account.name),
+                            "next_due": job_queue.next_due(account.name),
+                        },
+                    }
+                    for account in accounts
+                },
+                "sessions": len(sessions.sessions),
+                "jobs": [job.status() for job in self.jobs.values()],
+            },
+        )
+
+    async def get_metrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            text=metrics.registry.render_prometheus(),
+            content_type="text/plain",
+        )
+
+    async def list_jobs(self, _: web.Request) -> web.Response:
+        return web.json_response([job.status() for job in self.jobs.values()])
+
+    async def create_job(self, request: web.Request) -> web.Response:
+        body = await self._body(request)
+        job_class = JOB_KINDS.get(body.get("kind", ""))
+        if job_class is None:
+            msg = f"kind must be one of {', '.join(JOB_KINDS)}"
+            raise RequestError(msg)
+        account = self._account(body)
+        await self._ensure_credentials(account)
+        self._forget_finished()
+        job = job_class(next(self._ids), account, body)
+        self.jobs[job.id] = job
+        job.start(job.fetch())
+        _LOGGER.info("Started control API job %d (%s)", job.id, job.kind)
+        return web.json_response(job.status(), status=201)
+
+    async def get_job(self, request: web.Request) -> web.Response:
+        return web.json_response(self._job(request).status())
+
+    async def delete_job(self, request: web.Request) -> web.Response:
+        job = self.jobs.pop(int(request.match_info["id"]), None)
+        if job is None:
+            msg = "job not found"
+            raise RequestError(msg, 404)
+        job.cancel()
+        if isinstance(job, SubstitutionJob):
+            job.source.cancel()
+        return web.json_response(job.status())
+
+    async def get_diffs(self, request: web.Request) -> web.Response:
+        job = self._job(request)
+        try:
+            offset = max(int(request.query.get("offset", 0)), 0)
+            limit = min(max(int(request.query.get("limit", 50)), 1), MAX_PREVIEW)
+        except ValueError as exc:
+            msg = "offset and limit must be integers"
+            raise RequestError(msg) from exc
+        await self._ensure_credentials(job.account)
+        with metrics.track(job.invocation):
+            diffs, total = await job.preview(offset, limit)
+        return web.json_response(
+            {
+                "state": job.state,
+                "offset": offset,
+                "total": total,
+                "diffs": [diff_json(diff) for diff in diffs],
+            },
+        )
+
+    async def apply_job(self, request: web.Request) -> web.Response:
+        job = self._job(request)
+        if job.state != READY:
+            msg = f"the job is {job.state}, it can only be applied when ready"
+            raise RequestError(msg, 409)
+        body = await self._body(request)
+        video_ids = body.get("video_ids")
+        if video_ids is not None and not isinstance(video_ids, list):
+            msg = "video_ids must be a list"
+            raise RequestError(msg)
+        limit = body.get("limit", DEFAULT_APPLY_LIMIT)
+        if not isinstance(limit, int) or limit < 0:
+            msg = "limit must be a non-negative integer"
+            raise RequestError(msg)
+        await self._ensure_credentials(job.account)
+        job.state = APPLYING
+        job.emit("status", **job.status())
+        job.start(job.apply(None if video_ids is None else set(video_ids), limit))
+        return web.json_response(job.status(), status=202)
+
+    async def stream_events(self, request: web.Request) -> web.StreamResponse:
+        job = self._job(request)
+        try:
+            since = int(request.headers.get("Last-Event-ID", -1)) + 1
+        except ValueError:
+            since = 0
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"},
+        )
+        await response.prepare(request)
+        async for index, event, data in job.follow(since):
+            await response.write(
+                f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode(),
+            )
+        return response
+
+
+async def serve(host: str, port: int, token: str) -> None:
+    """Run the control API until cancelled."""
+    runner = web.AppRunner(ControlAPI(token).app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    _LOGGER.info("Control API listening on %s:%d", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
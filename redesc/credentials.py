@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from redesc import metrics
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+    from redesc.setup import YouTubeOAuth2
+
+_LOGGER = logging.getLogger("redesc.credentials")
+
+# Refresh this long before the token expires, so that no command ever has to.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+RETRY_INTERVAL = datetime.timedelta(minutes=1)
+
+
+class CredentialManager:
+    """
+    The one set of Google credentials the bot uses, kept fresh in the background.
+
+    The same `Credentials` instance is handed out until the account is
+    authorized again, and refreshing updates it in place, so API clients built
+    with it never need to be rebuilt because of an expired token.
+    """
+
+    def __init__(self, oauth2: YouTubeOAuth2) -> None:
+        self.oauth2 = oauth2
+        self._credentials: Credentials | None = None
+        self._lock = threading.Lock()
+        self._changed: asyncio.Event | None = None
+
+    @property
+    def changed(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    @property
+    def credentials(self) -> Credentials:
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self.oauth2.get_credentials()
+            return self._credentials
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.credentials.valid)
+
+    def reset(self) -> None:
+        """Forget the credentials after the account has been authorized again."""
+        with self._lock:
+            self._credentials = None
+        if self._changed is not None:
+            self._changed.set()
+
+    def refresh(self) -> None:
+        """Refresh the token now. Blocking."""
+        from google.auth.transport.requests import Request
+
+        credentials = self.credentials
+        with self._lock, metrics.span("credentials.refresh"):
+            credentials.refresh(Request())
+        self.oauth2.update(dict(json.loads(credentials.to_json())))
+        _LOGGER.info("Refreshed the OAuth2 token, valid until %s", credentials.expiry)
+
+    async def ensure_valid(self) -> bool:
+        """Make sure the credentials are valid, refreshing them if possible."""
+        if self.valid:
+            return True
+        if not self.credentials.refresh_token:
+            return False
+        from google.auth.exceptions import RefreshError
+
+        try:
+            await asyncio.to_thread(self.refresh)
+        except RefreshError:
+            _LOGGER.exception("Failed to refresh the OAuth2 token")
+            return False
+        await self.oauth2.save_async()
+        return True
+
+    def seconds_until_refresh(self) -> float | None:
+        credentials = self.credentials
+        if not credentials.refresh_token:
+            return None
+        if credentials.expiry is None:
+            return 0
+        # google-auth keeps expiry as naive UTC.
+        refresh_at = credentials.expiry - REFRESH_MARGIN
+        now = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        seconds: float = (refresh_at - now).total_seconds()
+        return max(seconds, 0)
+
+    async def run(self) -> None:
+        """Refresh the token shortly before it expires, forever."""
+        from google.auth.exceptions import RefreshError
+
+        while True:
+            self.changed.clear()
+            delay = self.seconds_until_refresh()
+            if delay == 0:
+                try:
+                    await asyncio.to_thread(self.refresh)
+                except RefreshError:
+                    _LOGGER.exception("Failed to refresh the OAuth2 token")
+                    # Only a new authorization can help now.
+                    delay = None
+                except Exception:
+                    _LOGGER.exception("Failed to refresh the OAuth2 token, retrying")
+                    delay = RETRY_INTERVAL.total_seconds()
+                else:
+                    await self.oauth2.save_async()
+                    continue
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.changed.wait(), delay)
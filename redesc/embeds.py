@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+_LOGGER = logging.getLogger("redesc.embeds")
+
+# https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+EMBED_DESCRIPTION_LIMIT = 4096
+MESSAGE_EMBEDS_LIMIT = 6000
+MESSAGE_EMBED_COUNT_LIMIT = 10
+
+CODE_BLOCK_OPEN = "```diff\n"
+CODE_BLOCK_CLOSE = "\n```"
+CODE_BLOCK_OVERHEAD = len(CODE_BLOCK_OPEN) + len(CODE_BLOCK_CLOSE)
+BLOCK_SEPARATOR = "\n\n"
+
+
+def escape_code(text: str) -> str:
+    """Escape backticks, so that the text cannot close the code block."""
+    return text.replace("`", "\\`")
+
+
+def split_block(block: str, limit: int) -> list[str]:
+    """Split an escaped block into pieces of at most `limit` characters."""
+    pieces: list[str] = []
+    while len(block) > limit:
+        cut = block.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+            # Do not separate an escape from the backtick it escapes.
+            if block[cut - 1] == "\\":
+                cut -= 1
+        pieces.append(block[:cut])
+        block = block[cut:].lstrip("\n")
+    if block:
+        pieces.append(block)
+    return pieces
+
+
+def pack(
+    blocks: Iterable[str],
+    *,
+    head: str = "",
+    reserved: int = 0,
+) -> list[list[str]]:
+    """
+    Pack diff blocks into pages of embed descriptions, in one pass.
+
+    Every embed is a single code block of whole blocks, escaped up front.
+    A page fits into one message: up to 10 embeds of up to 4096 characters,
+    6000 in total, less `reserved` characters of every page that are used
+    elsewhere, e.g. by the title. `head` goes before the first code block.
+    Blocks too long for any embed are split, so nothing is ever cut off.
+    """
+    page_limit = MESSAGE_EMBEDS_LIMIT - reserved
+    embed_limit = min(EMBED_DESCRIPTION_LIMIT, page_limit) - CODE_BLOCK_OVERHEAD
+    pages: list[list[str]] = [[]]
+    page_size = 0
+    prefix = head
+    parts: list[str] = []
+    size = 0
+
+    def close_embed() -> None:
+        nonlocal page_size, prefix, parts, size
+        description = (
+            prefix + CODE_BLOCK_OPEN + BLOCK_SEPARATOR.join(parts) + CODE_BLOCK_CLOSE
+        )
+        pages[-1].append(description)
+        page_size += len(description)
+        prefix, parts, size = "", [], 0
+
+    def capacity() -> int:
+        """How long the code block of the current embed may get."""
+        return min(
+            embed_limit - len(prefix),
+            page_limit - page_size - len(prefix) - CODE_BLOCK_OVERHEAD,
+        )
+
+    def next_page() -> None:
+        nonlocal page_size
+        pages.append([])
+        page_size = 0
+
+    pending = [escape_code(block) for block in reversed(list(blocks))]
+    while pending:
+        block = pending.pop()
+        cost = len(block) + (len(BLOCK_SEPARATOR) if parts else 0)
+        if size + cost <= capacity():
+            parts.append(block)
+            size += cost
+            continue
+        if parts:
+            close_embed()
+            if len(pages[-1]) == MESSAGE_EMBED_COUNT_LIMIT:
+                next_page()
+            pending.append(block)
+            continue
+        if capacity() < min(len(block), embed_limit - len(prefix)):
+            # Whatever is left of the page is too little for this block.
+            next_page()
+            pending.append(block)
+            continue
+        pieces = split_block(block, capacity())
+        _LOGGER.debug("Split a block of %d characters in %d", len(block), len(pieces))
+        pending.extend(reversed(pieces))
+    if parts or prefix or not pages[-1]:
+        close_embed()
+    return pages
@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import logging
+from typing import TYPE_CHECKING
+
+from redesc import metrics, patterns
+from redesc.api import DEFAULT_LIMIT, MAX_IDS_PER_REQUEST
+
+if TYPE_CHECKING:
+    import re
+    from collections.abc import AsyncIterator, Iterable, Sequence
+
+    from redesc.api import VideoRecord, YouTubeAPI
+    from redesc.jobs import Rule
+    from redesc.snapshot import Snapshot
+
+_LOGGER = logging.getLogger("redesc.engine")
+
+
+@dataclasses.dataclass
+class VideoDiff:
+    """A change to a video, on top of the record it was computed from."""
+
+    record: VideoRecord
+    new_title: str
+    new_description: str
+    tags: list[str]
+
+    def __post_init__(self) -> None:
+        total = 0
+        all_tags = []
+        for tag in self.tags:
+            total += len(tag) + (2 * (" " in tag))
+            if total >= 400:
+                break
+            total += 1
+            all_tags.append(tag)
+        self.tags = all_tags
+
+    @property
+    def video_id(self) -> str:
+        return self.record.video_id
+
+    @property
+    def old_title(self) -> str:
+        return self.record.title
+
+    @property
+    def old_description(self) -> str:
+        return self.record.description
+
+    @property
+    def video_category_id(self) -> str | None:
+        return self.record.category_id
+
+    @property
+    def etag(self) -> str | None:
+        return self.record.etag
+
+    @property
+    def content_hash(self) -> str:
+        return record_hash(self.record)
+
+
+Span = tuple[int, int]
+
+
+@dataclasses.dataclass(frozen=True)
+class DiffRef:
+    """A matched video, remembered without any of its text."""
+
+    __slots__ = ("video_id", "title_spans", "description_spans")
+
+    video_id: str
+    title_spans: tuple[Span, ...]
+    description_spans: tuple[Span, ...]
+
+
+def content_hash(title: str, description: str, tags: Sequence[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (title, description, *tags):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def record_hash(record: VideoRecord) -> str:
+    return content_hash(record.title, record.description, record.tags)
+
+
+def apply_rule(rule: Rule, title: str, description: str) -> tuple[str, str]:
+    pattern = patterns.compile_pattern(rule.expression, rule.replacement)
+    new_title = pattern.sub(title) if rule.with_title else title
+    new_description = pattern.sub(description) if rule.with_description else description
+    return new_title, new_description
+
+
+def changed_spans(
+    regex: re.Pattern[str],
+    replacement: str,
+    text: str,
+) -> tuple[Span, ...]:
+    """Return spans of matches that `regex.sub(replacement, text)` would change."""
+    return tuple(
+        match.span()
+        for match in regex.finditer(text)
+        if match.expand(replacement) != match.group()
+    )
+
+
+def match_excerpts(
+    regex: re.Pattern[str],
+    replacement: str,
+    text: str,
+    *,
+    context: int = 40,
+) -> list[tuple[str, str]]:
+    """
+    Return the text around every change `regex.sub(replacement, text)` makes.
+
+    Each excerpt is a pair of the old and the new text, with up to `context`
+    characters on both sides. Changes closer than that to each other share
+    an excerpt. Apart from finding the matches, the cost depends only on
+    their number, not on the length of the text.
+    """
+    excerpts: list[tuple[str, str]] = []
+    cluster: list[tuple[int, int, str]] = []
+
+    def flush() -> None:
+        start = max(cluster[0][0] - context, 0)
+        end = min(cluster[-1][1] + context, len(text))
+        new_parts = []
+        position = start
+        for match_start, match_end, expanded in cluster:
+            new_parts.append(text[position:match_start])
+            new_parts.append(expanded)
+            position = match_end
+        new_parts.append(text[position:end])
+        ellipsis_before = "…" if start > 0 else ""
+        ellipsis_after = "…" if end < len(text) else ""
+        excerpts.append(
+            (
+                ellipsis_before + text[start:end] + ellipsis_after,
+                ellipsis_before + "".join(new_parts) + ellipsis_after,
+            ),
+        )
+        cluster.clear()
+
+    for match in regex.finditer(text):
+        expanded = match.expand(replacement)
+        if expanded == match.group():
+            continue
+        if cluster and match.start() - cluster[-1][1] > 2 * context:
+            flush()
+        cluster.append((*match.span(), expanded))
+    if cluster:
+        flush()
+    return excerpts
+
+
+def diff_from_record(record: VideoRecord, rule: Rule) -> VideoDiff | None:
+    new_title, new_description = apply_rule(rule, record.title, record.description)
+    if (record.title, record.description) == (new_title, new_description):
+        return None
+    return VideoDiff(
+        record=record,
+        new_title=new_title,
+        new_description=new_description,
+        tags=list(record.tags),
+    )
+
+
+async def _collect_video_ids(
+    api: YouTubeAPI,
+    playlist_id: str,
+    id_pages: asyncio.Queue[list[str] | None],
+    limit: int,
+    snapshot: Snapshot | None,
+) -> None:
+    """Put pages of the playlist's video IDs to the queue, then None."""
+    pages = api.iter_playlist_video_ids(playlist_id, limit=limit)
+    collected: list[str] = []
+    try:
+        while (video_ids := await asyncio.to_thread(next, pages, None)) is not None:
+            collected.extend(video_ids)
+            await id_pages.put(video_ids)
+        if snapshot is not None:
+            snapshot.save_playlist(playlist_id, collected)
+    finally:
+        await id_pages.put(None)
+
+
+async def iter_videos(
+    api: YouTubeAPI,
+    playlist_ids: Sequence[str],
+    *,
+    limit: int = DEFAULT_LIMIT,
+    snapshot: Snapshot | None = None,
+) -> AsyncIterator[list[VideoRecord]]:
+    """
+    Yield videos of all the given playlists in pages of up to 50, each video once.
+
+    Playlists are paged concurrently and only the videos that have not been
+    seen yet are fetched, so the cost depends on the number of unique videos
+    rather than on how many playlists they belong to.
+    Everything fetched is saved to the snapshot, if one is given.
+    """
+    id_pages: asyncio.Queue[list[str] | None] = asyncio.Queue()
+    producers = [
+        asyncio.create_task(
+            _collect_video_ids(api, playlist_id, id_pages, limit, snapshot),
+        )
+        for playlist_id in dict.fromkeys(playlist_ids)
+    ]
+    running = len(producers)
+    seen: set[str] = set()
+    pending: list[str] = []
+    try:
+        while running:
+            video_ids = await id_pages.get()
+            if video_ids is None:
+                running -= 1
+            else:
+                unseen = [
+                    video_id
+                    for video_id in dict.fromkeys(video_ids)
+                    if video_id not in seen
+                ]
+                seen.update(unseen)
+                pending.extend(unseen)
+            while len(pending) >= MAX_IDS_PER_REQUEST or (pending and not running):
+                chunk = pending[:MAX_IDS_PER_REQUEST]
+                del pending[:MAX_IDS_PER_REQUEST]
+                records = await asyncio.to_thread(api.get_videos, chunk)
+                if snapshot is not None:
+                    snapshot.save(records)
+                yield records
+    finally:
+        for producer in producers:
+            producer.cancel()
+    for producer in producers:
+        if not producer.cancelled() and (exc := producer.exception()) is not None:
+            raise exc
+
+
+async def iter_videos_by_id(
+    api: YouTubeAPI,
+    video_ids: Sequence[str],
+    *,
+    snapshot: Snapshot | None = None,
+) -> AsyncIterator[list[VideoRecord]]:
+    """Yield the given videos in pages of up to 50, fetched anew."""
+    for start in range(0, len(video_ids), MAX_IDS_PER_REQUEST):
+        records = await asyncio.to_thread(
+            api.get_videos,
+            video_ids[start : start + MAX_IDS_PER_REQUEST],
+        )
+        if snapshot is not None:
+            snapshot.save(records)
+        yield records
+
+
+class DiffSource:
+    """
+    Diffs of playlists, computed in the background and materialized on demand.
+
+    Only references to the matched videos are kept. Full texts are fetched
+    again and the rule is reapplied when a diff is about to be shown
+    or submitted, so what the user sees is always up to date.
+
+    If candidate video IDs are given, only they are fetched instead of
+    the whole playlists. If pages are given, they are scanned instead,
+    which lets several sources share a single fetch.
+    """
+
+    def __init__(
+        self,
+        api: YouTubeAPI,
+        playlist_ids: Sequence[str],
+        rule: Rule,
+        *,
+        limit: int = DEFAULT_LIMIT,
+        candidates: Sequence[str] | None = None,
+        snapshot: Snapshot | None = None,
+        pages: AsyncIterator[list[VideoRecord]] | None = None,
+    ) -> None:
+        self.api = api
+        self.playlist_ids = playlist_ids
+        self.rule = rule
+        self.limit = limit
+        self.candidates = candidates
+        self.snapshot = snapshot
+        self.pages = pages
+        self.refs: list[DiffRef] = []
+        self.scanned = 0
+        self.done = False
+        self.error: BaseException | None = None
+        self._condition = asyncio.Condition()
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def match(self, regex: re.Pattern[str], record: VideoRecord) -> DiffRef | None:
+        title_spans = (
+            changed_spans(regex, self.rule.replacement, record.title)
+            if self.rule.with_title
+            else ()
+        )
+        description_spans = (
+            changed_spans(regex, self.rule.replacement, record.description)
+            if self.rule.with_description
+            else ()
+        )
+        if not (title_spans or description_spans):
+            return None
+        return DiffRef(record.video_id, title_spans, description_spans)
+
+    async def _run(self) -> None:
+        regex = patterns.compile_pattern(self.rule.expression).regex
+        if self.candidates is not None:
+            pages = iter_videos_by_id(self.api, self.candidates, snapshot=self.snapshot)
+        elif self.pages is not None:
+            pages = self.pages
+        else:
+            pages = iter_videos(
+                self.api,
+                self.playlist_ids,
+                limit=self.limit,
+                snapshot=self.snapshot,
+            )
+        try:
+            async for page in pages:
+                with metrics.span("diff"):
+                    for record in page:
+                        ref = self.match(regex, record)
+                        if ref is not None:
+                            self.refs.append(ref)
+                self.scanned += len(page)
+                async with self._condition:
+                    self._condition.notify_all()
+        except Exception as exc:  # noqa: BLE001
+            self.error = exc
+        finally:
+            self.done = True
+            async with self._condition:
+                self._condition.notify_all()
+
+    async def wait_for(self, count: int | None = None) -> None:
+        """
+        Wait until there are at least `count` matches or the scan is over.
+
+        Re-raise the error that stopped the scan, if any.
+        """
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.done or (count is not None and len(self.refs) >= count),
+            )
+        if self.error is not None:
+            raise self.error
+
+    def materialize(
+        self,
+        refs: Sequence[DiffRef],
+        *,
+        fresh: bool = False,
+    ) -> tuple[list[VideoDiff], list[str]]:
+        """
+        Rebuild full diffs of the given references from fresh video data.
+
+        Return the diffs and the IDs of videos that no longer match.
+        Blocking, up to one API call per 50 references. If `fresh` is true,
+        bypass the API cache, e.g. when the diffs are about to be applied.
+        """
+        records = {
+            record.video_id: record
+            for record in self.api.get_videos(
+                (ref.video_id for ref in refs),
+                fresh=fresh,
+            )
+        }
+        diffs: list[VideoDiff] = []
+        dropped: list[str] = []
+        for ref in refs:
+            record = records.get(ref.video_id)
+            diff = None if record is None else diff_from_record(record, self.rule)
+            if diff is None:
+                dropped.append(ref.video_id)
+            else:
+                diffs.append(diff)
+        return diffs, dropped
+
+    def discard(self, video_ids: Iterable[str]) -> None:
+        discarded = set(video_ids)
+        if discarded:
+            self.refs[:] = [ref for ref in self.refs if ref.video_id not in discarded]
+
+
+@dataclasses.dataclass
+class RebaseResult:
+    unchanged: int = 0
+    rebased: int = 0
+    dropped: list[str] = dataclasses.field(default_factory=list)
+
+
+def rebase(
+    api: YouTubeAPI,
+    diffs: Sequence[VideoDiff],
+    rule: Rule | None = None,
+    *,
+    drop_changed: bool = False,
+) -> RebaseResult:
+    """
+    Bring diffs up to date with the videos as they are now on YouTube.
+
+    Diffs of videos edited since they were fetched are recomputed from
+    the fresh text with the given rule (or keep their own tags if there is
+    no rule, which is how tag-only diffs are handled), or dropped if
+    `drop_changed` is true.
+    Diffs of deleted videos or ones that no longer change anything are
+    dropped; their IDs are returned in the result and it is up to the caller
+    to discard them.
+    """
+    result = RebaseResult()
+    fresh = {
+        record.video_id: record
+        for record in api.get_videos((diff.video_id for diff in diffs), fresh=True)
+    }
+    for diff in diffs:
+        record = fresh.get(diff.video_id)
+        if record is None:
+            result.dropped.append(diff.video_id)
+            continue
+        unchanged = (
+            diff.etag is not None and record.etag == diff.etag
+        ) or record_hash(record) == diff.content_hash
+        diff.record = record
+        if unchanged:
+            result.unchanged += 1
+            continue
+        _LOGGER.info("Video %s has changed since it was fetched", diff.video_id)
+        if drop_changed:
+            result.dropped.append(diff.video_id)
+            continue
+        if rule is None:
+            diff.new_title, diff.new_description = record.title, record.description
+        else:
+            diff.new_title, diff.new_description = apply_rule(
+                rule,
+                record.title,
+                record.description,
+            )
+            diff.tags = list(record.tags)
+            if (diff.new_title, diff.new_description) == (
+                record.title,
+                record.description,
+            ):
+                result.dropped.append(diff.video_id)
+                continue
+        result.rebased += 1
+    return result
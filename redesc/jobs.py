@@ -0,0 +1,519 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import json
+import logging
+import time
+from typing import TYPE_CHECKING
+
+import googleapiclient.errors
+
+from redesc import engine
+from redesc.accounts import DEFAULT_ACCOUNT
+from redesc.api import VideoRecord, is_quota_exceeded
+from redesc.engine import VideoDiff
+from redesc.journal import JournalRun
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Iterable
+
+    from redesc.api import YouTubeAPI
+    from redesc.journal import Journal
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.jobs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT NOT NULL,
+    old_title TEXT NOT NULL,
+    new_title TEXT NOT NULL,
+    old_description TEXT NOT NULL,
+    new_description TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    video_category_id TEXT,
+    etag TEXT,
+    with_title INTEGER NOT NULL,
+    with_description INTEGER NOT NULL,
+    expression TEXT NOT NULL,
+    replacement TEXT NOT NULL,
+    invoked_by TEXT,
+    created_at TEXT NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    account TEXT NOT NULL DEFAULT '',
+    reverts INTEGER
+);
+CREATE INDEX IF NOT EXISTS pending_updates_state
+    ON pending_updates (state, not_before, id);
+"""
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+STALE = "stale"
+# Seconds before the scheduler tries again after an unexpected error.
+RETRY_DELAY = 300
+
+try:
+    from zoneinfo import ZoneInfo
+
+    QUOTA_TIMEZONE: datetime.tzinfo = ZoneInfo("America/Los_Angeles")
+except (ImportError, KeyError):  # no tz database available
+    QUOTA_TIMEZONE = datetime.timezone(datetime.timedelta(hours=-8))
+
+
+def next_quota_reset(now: datetime.datetime | None = None) -> datetime.datetime:
+    """YouTube Data API quotas reset at midnight Pacific Time."""
+    if now is None:
+        now = datetime.datetime.now(tz=QUOTA_TIMEZONE)
+    local = now.astimezone(QUOTA_TIMEZONE)
+    tomorrow = local.date() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time(), tzinfo=QUOTA_TIMEZONE)
+
+
+@dataclasses.dataclass(frozen=True)
+class Rule:
+    expression: str
+    replacement: str
+    with_title: bool = True
+    with_description: bool = True
+
+
+# Not a substitution: the update restores the texts it was created with.
+REVERT = Rule("", "")
+
+
+@dataclasses.dataclass
+class PendingUpdate:
+    id: int
+    diff: VideoDiff
+    rule: Rule
+    invoked_by: str | None
+    account: str = DEFAULT_ACCOUNT
+    # The journal run a revert undoes.
+    reverts: int | None = None
+
+    @property
+    def title(self) -> str:
+        return self.diff.new_title if self.rule.with_title else self.diff.old_title
+
+    @property
+    def description(self) -> str:
+        if self.rule.with_description:
+            return self.diff.new_description
+        return self.diff.old_description
+
+
+class JobQueue:
+    """Durable queue of video updates that did not fit into the daily quota."""
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+        self.store.ensure_schema(SCHEMA)
+        self.store.ensure_columns(
+            "pending_updates",
+            {
+                "etag": "TEXT",
+                "account": f"TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'",
+                "reverts": "INTEGER",
+            },
+        )
+        self._wakeup: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        return self._wakeup
+
+    def _wake_up(self) -> None:
+        """Wake the scheduler up, from its event loop or from any thread."""
+        if self._wakeup is None or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def enqueue(
+        self,
+        diffs: Iterable[VideoDiff],
+        rule: Rule,
+        *,
+        invoked_by: str | None = None,
+        not_before: datetime.datetime | None = None,
+        account: str = DEFAULT_ACCOUNT,
+        reverts: int | None = None,
+    ) -> int:
+        """
+        Store diffs to be applied by the scheduler of the account.
+
+        By default they are postponed until the next quota reset, as they usually
+        are leftovers from a run that reached its limit.
+        """
+        created_at = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+        if not_before is None:
+            not_before = next_quota_reset()
+        rows = [
+            (
+                diff.video_id,
+                diff.old_title,
+                diff.new_title,
+                diff.old_description,
+                diff.new_description,
+                json.dumps(diff.tags),
+                diff.video_category_id,
+                diff.etag,
+                rule.with_title,
+                rule.with_description,
+                rule.expression,
+                rule.replacement,
+                invoked_by,
+                created_at,
+                not_before.timestamp(),
+                account,
+                reverts,
+            )
+            for diff in diffs
+        ]
+        with self.store.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO pending_updates (video_id, old_title, new_title, "
+                "old_description, new_description, tags, video_category_id, etag, "
+                "with_title, with_description, expression, replacement, invoked_by, "
+                "created_at, not_before, account, reverts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        if rows:
+            _LOGGER.info("Enqueued %d pending updates", len(rows))
+            self._wake_up()
+        return len(rows)
+
+    def enqueue_reverts(
+        self,
+        diffs: Iterable[VideoDiff],
+        run_id: int,
+        *,
+        invoked_by: str | None = None,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> int:
+        """
+        Store diffs undoing a journal run, to be applied by the scheduler right away.
+
+        They are applied as they are, or dropped if the video changes first.
+        """
+        return self.enqueue(
+            diffs,
+            REVERT,
+            invoked_by=invoked_by,
+            not_before=datetime.datetime.now(tz=datetime.timezone.utc),
+            account=account,
+            reverts=run_id,
+        )
+
+    def enqueue_refs(
+        self,
+        video_ids: Iterable[str],
+        rule: Rule,
+        *,
+        invoked_by: str | None = None,
+        not_before: datetime.datetime | None = None,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> int:
+        """
+        Store bare video IDs to be matched against the rule when they are applied.
+
+        Without any content they never look up to date to `engine.rebase()`,
+        so they are always rebuilt from fresh data before being applied.
+        """
+        return self.enqueue(
+            (
+                VideoDiff(VideoRecord(video_id, "", "", (), None, None), "", "", [])
+                for video_id in video_ids
+            ),
+            rule,
+            invoked_by=invoked_by,
+            not_before=not_before,
+            account=account,
+        )
+
+    def pending(
+        self,
+        limit: int = 50,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> list[PendingUpdate]:
+        """Return the oldest updates of the account that are due now."""
+        rows = self.store.execute(
+            "SELECT * FROM pending_updates WHERE state = ? AND not_before <= ? "
+            "AND account = ? ORDER BY id LIMIT ?",
+            (PENDING, time.time(), account, limit),
+        )
+        return [
+            PendingUpdate(
+                id=row["id"],
+                diff=VideoDiff(
+                    record=VideoRecord(
+                        video_id=row["video_id"],
+                        title=row["old_title"],
+                        description=row["old_description"],
+                        tags=tuple(json.loads(row["tags"])),
+                        category_id=row["video_category_id"],
+                        etag=row["etag"],
+                    ),
+                    new_title=row["new_title"],
+                    new_description=row["new_description"],
+                    tags=json.loads(row["tags"]),
+                ),
+                rule=Rule(
+                    expression=row["expression"],
+                    replacement=row["replacement"],
+                    with_title=bool(row["with_title"]),
+                    with_description=bool(row["with_description"]),
+                ),
+                invoked_by=row["invoked_by"],
+                account=row["account"],
+                reverts=row["reverts"],
+            )
+            for row in rows
+        ]
+
+    def count(self, account: str | None = None) -> int:
+        """Count pending updates of the account, or of all of them."""
+        (row,) = self.store.execute(
+            "SELECT COUNT(*) FROM pending_updates WHERE state = ? "
+            "AND (? IS NULL OR account = ?)",
+            (PENDING, account, account),
+        )
+        return int(row[0])
+
+    def next_due(self, account: str | None = None) -> float | None:
+        (row,) = self.store.execute(
+            "SELECT MIN(not_before) FROM pending_updates WHERE state = ? "
+            "AND (? IS NULL OR account = ?)",
+            (PENDING, account, account),
+        )
+        return None if row[0] is None else float(row[0])
+
+    def mark(self, update_id: int, state: str, error: str | None = None) -> None:
+        self.store.execute(
+            "UPDATE pending_updates SET state = ?, error = ? WHERE id = ?",
+            (state, error, update_id),
+        )
+
+
+class QuotaExhaustedError(Exception):
+    """Raised out of a pending update to stop draining until the quota resets."""
+
+
+@dataclasses.dataclass
+class DrainResult:
+    applied: int = 0
+    # Reverts queued by /cofnij, applied as they are.
+    reverted: int = 0
+    failed: int = 0
+    exhausted: bool = False
+
+    def render(self, account: str = DEFAULT_ACCOUNT, left: int = 0) -> str:
+        where = f" (kanał {account})" if account != DEFAULT_ACCOUNT else ""
+        counts = {
+            "podmieniono": self.applied,
+            "cofnięto": self.reverted,
+            "nieudane": self.failed,
+            "pozostało": left,
+        }
+        return f"Kolejka{where}: " + ", ".join(
+            f"{label}: **{count}**" for label, count in counts.items() if count
+        ) + "."
+
+
+async def _rebase(
+    queue: JobQueue,
+    api: YouTubeAPI,
+    rule: Rule,
+    updates: list[PendingUpdate],
+) -> set[str] | None:
+    """
+    Rebase the updates of one rule and return the IDs of stale videos.
+
+    If that fails for any other reason than the quota, the updates are marked
+    as failed and None is returned.
+    """
+    try:
+        result = await asyncio.to_thread(
+            engine.rebase,
+            api,
+            [update.diff for update in updates],
+            rule,
+            drop_changed=rule == REVERT,
+        )
+    except googleapiclient.errors.HttpError as exc:
+        if is_quota_exceeded(exc):
+            raise QuotaExhaustedError from exc
+        error: Exception = exc
+    except Exception as exc:  # noqa: BLE001
+        error = exc
+    else:
+        return set(result.dropped)
+    _LOGGER.error("Failed to rebase %d pending updates", len(updates), exc_info=error)
+    for update in updates:
+        queue.mark(update.id, FAILED, str(error))
+    return None
+
+
+async def _apply(
+    queue: JobQueue,
+    api: YouTubeAPI,
+    update: PendingUpdate,
+    journal: Journal | None,
+    run: JournalRun,
+) -> bool:
+    """Apply a pending update, return whether it succeeded."""
+    try:
+        updated = await asyncio.to_thread(
+            api.update_video_description,
+            video_id=update.diff.video_id,
+            video_title=update.title,
+            video_category_id=update.diff.video_category_id,
+            description=update.description,
+            tags=update.diff.tags,
+        )
+        if journal is not None:
+            journal.record(
+                run,
+                update.diff.record,
+                VideoRecord.from_resource(updated),
+                invoked_by=update.invoked_by,
+            )
+    except googleapiclient.errors.HttpError as exc:
+        if is_quota_exceeded(exc):
+            raise QuotaExhaustedError from exc
+        error: Exception = exc
+    except Exception as exc:  # noqa: BLE001
+        error = exc
+    else:
+        queue.mark(update.id, DONE)
+        return True
+    _LOGGER.error("Failed to apply pending update %d", update.id, exc_info=error)
+    queue.mark(update.id, FAILED, str(error))
+    return False
+
+
+def _revert_run(
+    runs: dict[tuple[int | None, str | None], JournalRun],
+    update: PendingUpdate,
+) -> JournalRun:
+    key = update.reverts, update.invoked_by
+    if key not in runs:
+        runs[key] = JournalRun(
+            "cofnij",
+            update.invoked_by,
+            "" if update.reverts is None else f"przebieg {update.reverts}",
+            account=update.account,
+        )
+    return runs[key]
+
+
+async def drain(
+    queue: JobQueue,
+    api: YouTubeAPI,
+    journal: Journal | None = None,
+    account: str = DEFAULT_ACCOUNT,
+) -> DrainResult:
+    """
+    Apply pending updates of the account until none are left or the quota runs out.
+
+    An update that cannot be applied is marked as failed and the rest go on.
+    """
+    result = DrainResult()
+    run = JournalRun("kolejka", account=account)
+    # Every undone run gets a revert run of its own, as with /cofnij.
+    revert_runs: dict[tuple[int | None, str | None], JournalRun] = {}
+    while batch := queue.pending(account=account):
+        rules: dict[Rule, list[PendingUpdate]] = {}
+        for update in batch:
+            rules.setdefault(update.rule, []).append(update)
+        try:
+            for rule, updates in rules.items():
+                stale = await _rebase(queue, api, rule, updates)
+                if stale is None:
+                    result.failed += len(updates)
+                    continue
+                for update in updates:
+                    if update.diff.video_id in stale:
+                        _LOGGER.info(
+                            "Pending update %d is no longer applicable",
+                            update.id,
+                        )
+                        queue.mark(update.id, STALE)
+                    elif await _apply(
+                        queue,
+                        api,
+                        update,
+                        journal,
+                        _revert_run(revert_runs, update) if rule == REVERT else run,
+                    ):
+                        if rule == REVERT:
+                            result.reverted += 1
+                        else:
+                            result.applied += 1
+                    else:
+                        result.failed += 1
+        except QuotaExhaustedError:
+            result.exhausted = True
+            return result
+    return result
+
+
+async def run_scheduler(
+    queue: JobQueue,
+    api: YouTubeAPI,
+    notify: Callable[[str], Awaitable[object]],
+    journal: Journal | None = None,
+    account: str = DEFAULT_ACCOUNT,
+) -> None:
+    """
+    Apply due updates of the account as soon as they are due, forever.
+
+    Every account has a scheduler of its own, as each has its own quota.
+    """
+    while True:
+        queue.wakeup.clear()
+        try:
+            result = await drain(queue, api, journal, account)
+        except Exception:
+            _LOGGER.exception("Failed to drain the queue of account %r", account)
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+        if result.applied or result.reverted or result.failed:
+            content = result.render(account, queue.count(account))
+            try:
+                await notify(content)
+            except Exception:
+                # The updates are applied already, only the message is lost.
+                _LOGGER.exception("Failed to report the queue of account %r", account)
+        if result.exhausted:
+            reset_at = next_quota_reset()
+            _LOGGER.info(
+                "Quota of account %r exhausted, resuming queue at %s",
+                account,
+                reset_at,
+            )
+            await asyncio.sleep(max(reset_at.timestamp() - time.time(), 0) + 60)
+            continue
+        due = queue.next_due(account)
+        timeout = None if due is None else max(due - time.time(), 0) + 1
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.wakeup.wait(), timeout)
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import dataclasses
+import itertools
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, cast
+
+import googleapiclient.errors
+
+from redesc import engine
+from redesc.accounts import DEFAULT_ACCOUNT
+from redesc.api import MAX_IDS_PER_REQUEST, VideoRecord, is_quota_exceeded
+
+if TYPE_CHECKING:
+    import sqlite3
+
+    from redesc.api import YouTubeAPI
+    from redesc.jobs import JobQueue
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.journal")
+
+# Append-only: a revert is a run of its own, so it can be reverted too.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    invoked_by TEXT,
+    summary TEXT NOT NULL DEFAULT '',
+    started_at REAL NOT NULL,
+    account TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS journal_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES journal_runs (id),
+    video_id TEXT NOT NULL,
+    old_title TEXT NOT NULL,
+    new_title TEXT NOT NULL,
+    old_description TEXT NOT NULL,
+    new_description TEXT NOT NULL,
+    old_tags TEXT NOT NULL,
+    new_tags TEXT NOT NULL,
+    category_id TEXT,
+    invoked_by TEXT,
+    applied_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_entries_run ON journal_entries (run_id, id);
+"""
+
+REPORT_LIMIT = 2000
+
+
+@dataclasses.dataclass
+class JournalRun:
+    """A single invocation that updates videos, saved once it updates the first."""
+
+    command: str
+    invoked_by: str | None = None
+    summary: str = ""
+    id: int | None = None
+    account: str = DEFAULT_ACCOUNT
+
+
+@dataclasses.dataclass
+class JournalEntry:
+    run_id: int
+    before: VideoRecord
+    after: VideoRecord
+    invoked_by: str | None
+    applied_at: float
+
+
+@dataclasses.dataclass
+class RevertReport:
+    run_id: int
+    queued: int = 0
+    changed: list[str] = dataclasses.field(default_factory=list)
+    already_reverted: int = 0
+    left: int = 0
+    quota_exceeded: bool = False
+
+    def render(self) -> str:
+        lines = [
+            f"Zakolejkowano cofnięcie zmian z przebiegu `{self.run_id}` "
+            f"w filmach: **{self.queued}**.",
+        ]
+        if self.queued:
+            lines.append(
+                "Zmiany zostaną cofnięte w ramach limitu API, "
+                "kolejka da znać, gdy to nastąpi.",
+            )
+        if self.already_reverted:
+            lines.append(f"Już wcześniej cofnięte: **{self.already_reverted}**.")
+        if self.changed:
+            lines.append(
+                "Pominięto filmy zmienione od tamtej pory lub usunięte: "
+                f"**{len(self.changed)}**.",
+            )
+            lines.extend(
+                f"- <https://www.youtube.com/watch?v={video_id}>"
+                for video_id in self.changed
+            )
+        if self.quota_exceeded:
+            lines.append(
+                "Wyczerpano limit API przy sprawdzaniu filmów, "
+                f"nie sprawdzono: **{self.left}**. "
+                "Uruchom komendę ponownie po odnowieniu limitu.",
+            )
+        content = ""
+        for index, line in enumerate(lines):
+            more = f"…i {len(lines) - index} więcej."
+            if len(content) + len(line) + len(more) + 2 > REPORT_LIMIT:
+                content += more
+                break
+            content += line + "\n"
+        return content
+
+
+def _insert_run(connection: sqlite3.Connection, run: JournalRun, now: float) -> int:
+    return cast(
+        int,
+        connection.execute(
+            "INSERT INTO journal_runs (command, invoked_by, summary, started_at, "
+            "account) VALUES (?, ?, ?, ?, ?)",
+            (run.command, run.invoked_by, run.summary, now, run.account),
+        ).lastrowid,
+    )
+
+
+def _entry(row: sqlite3.Row) -> JournalEntry:
+    return JournalEntry(
+        run_id=row["run_id"],
+        before=VideoRecord(
+            video_id=row["video_id"],
+            title=row["old_title"],
+            description=row["old_description"],
+            tags=tuple(json.loads(row["old_tags"])),
+            category_id=row["category_id"],
+            etag=None,
+        ),
+        after=VideoRecord(
+            video_id=row["video_id"],
+            title=row["new_title"],
+            description=row["new_description"],
+            tags=tuple(json.loads(row["new_tags"])),
+            category_id=row["category_id"],
+            etag=None,
+        ),
+        invoked_by=row["invoked_by"],
+        applied_at=row["applied_at"],
+    )
+
+
+class Journal:
+    """Every update made to a video, with what it looked like before and after."""
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+        self.store.ensure_schema(SCHEMA)
+        self.store.ensure_columns(
+            "journal_runs",
+            {"account": f"TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'"},
+        )
+
+    def record(
+        self,
+        run: JournalRun,
+        before: VideoRecord,
+        after: VideoRecord,
+        *,
+        invoked_by: str | None = None,
+    ) -> None:
+        now = time.time()
+        with self.store.transaction() as connection:
+            if run.id is None:
+                run.id = _insert_run(connection, run, now)
+            connection.execute(
+                "INSERT INTO journal_entries (run_id, video_id, old_title, new_title, "
+                "old_description, new_description, old_tags, new_tags, category_id, "
+                "invoked_by, applied_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run.id,
+                    before.video_id,
+                    before.title,
+                    after.title,
+                    before.description,
+                    after.description,
+                    json.dumps(before.tags),
+                    json.dumps(after.tags),
+                    after.category_id or before.category_id,
+                    invoked_by or run.invoked_by,
+                    now,
+                ),
+            )
+
+    def start(self, run: JournalRun) -> int:
+        """
+        Save the run right away, e.g. to share it between processes.
+
+        Runs without entries are not listed, so nothing shows up if it
+        never updates anything.
+        """
+        if run.id is None:
+            with self.store.transaction() as connection:
+                run.id = _insert_run(connection, run, time.time())
+        return run.id
+
+    def runs(self, limit: int = 10) -> list[sqlite3.Row]:
+        """Return the latest runs with the number of their entries."""
+        return self.store.execute(
+            "SELECT journal_runs.*, COUNT(journal_entries.id) AS entries "
+            "FROM journal_runs JOIN journal_entries "
+            "ON journal_entries.run_id = journal_runs.id "
+            "GROUP BY journal_runs.id ORDER BY journal_runs.id DESC LIMIT ?",
+            (limit,),
+        )
+
+    def run_account(self, run_id: int) -> str | None:
+        """Return the account of the run, or None if there is no such run."""
+        rows = self.store.execute(
+            "SELECT account FROM journal_runs WHERE id = ?",
+            (run_id,),
+        )
+        return rows[0]["account"] if rows else None
+
+    def entries(self, run_id: int) -> list[JournalEntry]:
+        rows = self.store.execute(
+            "SELECT * FROM journal_entries WHERE run_id = ? ORDER BY id",
+            (run_id,),
+        )
+        return [_entry(row) for row in rows]
+
+    def revert(
+        self,
+        api: YouTubeAPI,
+        queue: JobQueue,
+        run_id: int,
+        *,
+        invoked_by: str | None = None,
+    ) -> RevertReport:
+        """
+        Queue restoring the videos updated in a run to what they were before it.
+
+        Pass the API client of the account the run was made on. Videos changed
+        since the run are left alone. Blocking, one API call per 50 videos
+        to check them; the scheduler of the account then applies the reverts
+        within its quota, and drops those of videos changed in the meantime.
+        """
+        entries = self.entries(run_id)
+        if not entries:
+            msg = f"Run {run_id} not found"
+            raise LookupError(msg)
+        # If a video was updated more than once, undo all of it at once.
+        changes: dict[str, tuple[VideoRecord, VideoRecord]] = {}
+        for entry in entries:
+            before, _ = changes.get(entry.before.video_id, (entry.before, None))
+            changes[entry.before.video_id] = (before, entry.after)
+
+        report = RevertReport(run_id)
+        diffs: list[engine.VideoDiff] = []
+        video_ids = iter(changes)
+        while chunk := list(itertools.islice(video_ids, MAX_IDS_PER_REQUEST)):
+            try:
+                records = {
+                    record.video_id: record
+                    for record in api.get_videos(chunk, fresh=True)
+                }
+            except googleapiclient.errors.HttpError as exc:
+                if not is_quota_exceeded(exc):
+                    raise
+                report.quota_exceeded = True
+                report.left = len(chunk) + sum(1 for _ in video_ids)
+                break
+            for video_id in chunk:
+                diff = _revert_diff(report, records.get(video_id), *changes[video_id])
+                if diff is not None:
+                    diffs.append(diff)
+        report.queued = queue.enqueue_reverts(
+            diffs,
+            run_id,
+            invoked_by=invoked_by,
+            account=self.run_account(run_id) or DEFAULT_ACCOUNT,
+        )
+        return report
+
+
+def _revert_diff(
+    report: RevertReport,
+    current: VideoRecord | None,
+    before: VideoRecord,
+    after: VideoRecord,
+) -> engine.VideoDiff | None:
+    """Return the diff restoring a video, if it still is as the run left it."""
+    if current is not None:
+        current_hash = engine.record_hash(current)
+        if current_hash == engine.record_hash(before):
+            report.already_reverted += 1
+            return None
+        if current_hash == engine.record_hash(after):
+            return engine.VideoDiff(
+                current,
+                before.title,
+                before.description,
+                list(before.tags),
+            )
+    report.changed.append(before.video_id)
+    return None
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import asyncio
-import dataclasses
 import datetime
 import functools
 import itertools
@@ -19,32 +18,158 @@ import googleapiclient.errors  # type: ignore[import-untyped]
 import hikari
 import miru
 from google.auth.exceptions import RefreshError  # type: ignore[import-untyped]
-from google_auth_oauthlib.flow import InstalledAppFlow  # type: ignore[import-untyped]
-from oauthlib.oauth2.rfc6749.errors import (
-    AccessDeniedError,  # type: ignore[import-untyped]
-)
 
-from redesc.api import DEFAULT_LIMIT
-from redesc.common import app_config, youtube_api, youtube_oauth2
+from redesc import embeds, engine, metrics, patterns, shards, tagging
+from redesc.accounts import UnknownAccountError
+from redesc.api import MAX_IDS_PER_REQUEST, VideoRecord
+from redesc.common import (
+    accounts,
+    app_config,
+    credential_manager,
+    current_account,
+    job_queue,
+    journal,
+    search_index,
+    sessions,
+    shard_store,
+    snapshot,
+    store,
+)
+from redesc.engine import VideoDiff
+from redesc.jobs import Rule
+from redesc.journal import JournalRun
+from redesc.sessions import SessionLimitError
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Sequence
+
+    from redesc.accounts import Account
 
 _LOGGER = logging.getLogger(__name__)
 
 OLD_MARKER = "-"
 NEW_MARKER = "+"
+NEWLINE_MARKER = "↵"
+# A select menu can have at most 25 options.
+BULK_PAGE_SIZE_LIMIT = 25
+BULK_SNIPPET_CONTEXT = 15
+BULK_SNIPPET_WIDTH = 70
 SKIP_MARKER_RE = r"_?\((\d+) lini[aei] bez zmian\)_?"
 DIFF_SCOPES = ("tytuł", "opis")
 PLAYLIST_PATTERN: str = (
     r"(https?://)?(www\.)?((youtube\.com|youtu\.be)/(playlist|watch\?v=[^&]+))"
-    r"&list=(?P<playlist_id>[^&]+)"
+    r"[?&]list=(?P<playlist_id>[^&]+)"
+)
+LIST_SEPARATOR_RE = r"[\s,]+"
+ALL_PLAYLISTS = "wszystkie"
+PLAYLIST_OPTION_DESCRIPTION = (
+    "ID lub linki playlist, oddzielone spacjami, albo „wszystkie” "
+    "(wszystkie playlisty kanału)."
+)
+ACCOUNT_OPTION_DESCRIPTION = "Nazwa kanału z pliku config.yml. Domyślnie główny."
+DISTRIBUTE_OPTION_DESCRIPTION = (
+    "Rozdziel pracę między procesy robocze i zatwierdź wszystkie zmiany "
+    "bez podglądu."
 )
 
 plugin: crescent.Plugin[hikari.GatewayBot, None] = crescent.Plugin()
 running_oauth2_server = False
 
 
+async def select_account(ctx: crescent.Context, name: str | None) -> Account | None:
+    """
+    Turn the `kanal` option into an account and use it in this command.
+
+    Only the task of the command sees the change, so anything the command
+    runs later in other tasks, e.g. callbacks of its buttons, must use
+    the returned account directly.
+    """
+    try:
+        account = accounts.get(name)
+    except UnknownAccountError:
+        await ctx.respond(
+            f"Nie ma kanału `{name}`. Dostępne kanały: "
+            + ", ".join(f"`{label}`" for label in accounts.labels),
+            ephemeral=True,
+        )
+        return None
+    account.activate()
+    return account
+
+
+def pattern_error_message(error: patterns.PatternError) -> str:
+    if isinstance(error, patterns.InvalidExpressionError):
+        return f"Niepoprawne wyrażenie regularne: {error}"
+    if isinstance(error, patterns.InvalidReplacementError):
+        return f"Niepoprawne wyrażenie zastępujące: {error}"
+    assert isinstance(error, patterns.RiskyPatternError)  # noqa: S101
+    return (
+        "Wyrażenie mogłoby przeszukiwać opisy bardzo długo "
+        f"(ryzyko {error.risk.score}, dopuszczalne "
+        f"{app_config.max_pattern_risk}): " + "; ".join(error.risk.reasons)
+    )
+
+
+async def resolve_playlist_ids(argument: str | None, account: Account) -> list[str]:
+    """Turn the `playlista` option into a list of unique playlist IDs."""
+    if argument is None:
+        return [account.default_playlist_id]
+    playlist_ids: list[str] = []
+    for token in re.split(LIST_SEPARATOR_RE, argument.strip()):
+        if not token:
+            continue
+        if token.lower() == ALL_PLAYLISTS:
+            playlist_ids.extend(
+                await asyncio.to_thread(account.api.get_channel_playlist_ids),
+            )
+        elif match := re.match(PLAYLIST_PATTERN, token):
+            playlist_ids.append(match.group("playlist_id"))
+        else:
+            playlist_ids.append(token)
+    return list(dict.fromkeys(playlist_ids))
+
+
+async def distribute(
+    command_context: crescent.Context,
+    account: Account,
+    kind: str,
+    playlist_ids: Sequence[str],
+    *,
+    summary: str,
+    video_ids: Sequence[str] | None = None,
+    **run: Any,
+) -> None:
+    """Split a run between worker processes instead of running it here."""
+    if video_ids is None:
+        with metrics.span("fetch"):
+            video_ids = await asyncio.to_thread(
+                shards.collect_video_ids,
+                account.api,
+                playlist_ids,
+                snapshot,
+            )
+    invoked_by = str(command_context.user.id)
+    # All workers record their updates in the same run, to be reverted at once.
+    journal_run = JournalRun(kind, invoked_by, summary, account=account.name)
+    journal.start(journal_run)
+    run_id = shard_store.create_run(
+        kind,
+        video_ids,
+        summary=summary,
+        invoked_by=invoked_by,
+        journal_run_id=journal_run.id,
+        account=account.name,
+        shard_size=app_config.worker_shard_size,
+        **run,
+    )
+    await command_context.respond(
+        f"Rozdzielono filmy (**{len(video_ids)}**) między procesy robocze "
+        f"jako przebieg `{run_id}`. Uruchom je poleceniem "
+        "`python -m redesc.worker`, wynik pojawi się tutaj.\n"
+        f"Zmiany będzie można cofnąć komendą `/cofnij przebieg:{journal_run.id}`.",
+    )
+
+
 class AuthURLCapturer(str):
     __slots__ = ("callback",)
 
@@ -74,9 +199,18 @@ async def ensure_proper_channel(ctx: crescent.Context) -> bool:
     description="Uwierzytelnij konto Google do użycia YouTube API.",
     default_member_permissions=hikari.Permissions.ADMINISTRATOR,
 )
-async def authorize(ctx: crescent.Context) -> None:
-    """Authorize the bot to use YouTube API."""
-    await _authorize_impl(ctx)
+class Authorize:
+    account: crescent.ClassCommandOption[str | None] = crescent.option(
+        str,
+        name="kanal",
+        description=ACCOUNT_OPTION_DESCRIPTION,
+        default=None,
+    )
+
+    async def callback(self, ctx: crescent.Context) -> None:
+        """Authorize the bot to use YouTube API."""
+        if await select_account(ctx, self.account) is not None:
+            await _authorize_impl(ctx)
 
 
 @plugin.include
@@ -110,19 +244,29 @@ async def _authorize_impl(ctx: crescent.Context) -> None:
             asyncio.create_task(
                 ctx.respond(
                     "Hej Artur! Uwierzytelnij mnie proszę "
-                    f"za pomocą tego linku:\n{url}",
+                    + (f"(kanał {label}) " if len(accounts) > 1 else "")
+                    + f"za pomocą tego linku:\n{url}",
                     ephemeral=True,
                 ),
             ),
         )
 
+    # The OAuth2 flow is needed rarely and its dependencies take long to import.
+    from google_auth_oauthlib.flow import (  # type: ignore[import-untyped]
+        InstalledAppFlow,
+    )
+    from oauthlib.oauth2.rfc6749.errors import AccessDeniedError
+
     global running_oauth2_server
     if running_oauth2_server:
         return
     running_oauth2_server = True
+    # The account selected by the command, which is the default one otherwise.
+    oauth2 = current_account.oauth2
+    label = current_account.label
     app_flow = InstalledAppFlow.from_client_config(
-        youtube_oauth2.flow,
-        scopes=youtube_oauth2.scopes,
+        oauth2.flow,
+        scopes=oauth2.scopes,
     )
     capturer = AuthURLCapturer(callback)
     loop = asyncio.get_running_loop()
@@ -141,35 +285,14 @@ async def _authorize_impl(ctx: crescent.Context) -> None:
         return
     finally:
         running_oauth2_server = False
-    youtube_oauth2.update(dict(json.loads(credentials.to_json())))
-    await youtube_oauth2.save_async()
+    oauth2.update(dict(json.loads(credentials.to_json())))
+    await oauth2.save_async()
+    current_account.credentials.reset()
     message = await ctx.respond("Uwierzytelniono!", ensure_message=True, ephemeral=True)
     await asyncio.sleep(3.5)
     await message.delete()
 
 
-@dataclasses.dataclass
-class VideoDiff:
-    video_id: str
-    old_title: str
-    new_title: str
-    old_description: str
-    new_description: str
-    tags: list[str]
-    video_category_id: str | None = None
-
-    def __post_init__(self) -> None:
-        total = 0
-        all_tags = []
-        for tag in self.tags:
-            total += len(tag) + (2 * (" " in tag))
-            if total >= 400:
-                break
-            total += 1
-            all_tags.append(tag)
-        self.tags = all_tags
-
-
 def _pronounce_lines(count: int) -> str:
     if count == 1:
         return "linia"
@@ -186,6 +309,16 @@ def highlight_diffs(
     old_marker: str = OLD_MARKER,
     new_marker: str = NEW_MARKER,
 ) -> str:
+    return sep.join(diff_blocks(old_text, new_text, old_marker, new_marker))
+
+
+def diff_blocks(
+    old_text: str,
+    new_text: str,
+    old_marker: str = OLD_MARKER,
+    new_marker: str = NEW_MARKER,
+) -> list[str]:
+    """Return changed line pairs and runs of unchanged lines of the texts."""
     old_lines = old_text.splitlines()
     new_lines = new_text.splitlines()
     diff: list[str] = []
@@ -202,7 +335,21 @@ def highlight_diffs(
         else:
             log = f"({1} linia bez zmian)"
             diff.append(log)
-    return sep.join(diff)
+    return diff
+
+
+def excerpt_blocks(
+    excerpts: list[tuple[str, str]],
+    old_marker: str = OLD_MARKER,
+    new_marker: str = NEW_MARKER,
+) -> list[str]:
+    """Render excerpts of changes as line pairs, keeping each excerpt on one line."""
+    blocks = []
+    for old, new in excerpts:
+        old_line = old.replace("\n", NEWLINE_MARKER)
+        new_line = new.replace("\n", NEWLINE_MARKER)
+        blocks.append(f"{old_marker} {old_line}\n{new_marker} {new_line}")
+    return blocks
 
 
 def argument_unescape(argument: str) -> str:
@@ -226,11 +373,17 @@ def escape(string: str, substring: str, *, use: str = "\\") -> str:
     return string.replace(substring, "".join(map(use.__add__, substring)))
 
 
-def prepend_new_title(old_title: str, new_title: str, initial_description: str) -> str:
+def shorten(string: str, width: int) -> str:
+    if len(string) <= width:
+        return string
+    return string[: width - 1] + "…"
+
+
+def title_change(old_title: str, new_title: str) -> str:
     if old_title == new_title:
-        return initial_description
+        return ""
     diff = f"\n- {old_title}\n+ {new_title}"
-    return f"Zmieniono tytuł: {diffize(diff)}\n{initial_description}"
+    return f"Zmieniono tytuł: {diffize(diff)}\n"
 
 
 @plugin.include
@@ -265,7 +418,7 @@ class SubstituteCommand:
         str,
         name="playlista",
         default=None,
-        description="ID playlisty, z której mają być modfikowane filmy.",
+        description=PLAYLIST_OPTION_DESCRIPTION,
     )
     include_titles: crescent.ClassCommandOption[bool] = crescent.option(
         bool,
@@ -279,15 +432,71 @@ class SubstituteCommand:
         description="Podmień opisy filmów.",
         default=True,
     )
+    narrow: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="zawez",
+        description=(
+            "Pobierz tylko filmy, które według lokalnej kopii kanału zawierają "
+            "wyszukiwany tekst."
+        ),
+        default=False,
+    )
+    full_lines: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="pelne_linie",
+        description="Pokaż całe zmienione linie opisu zamiast samych zmian.",
+        default=False,
+    )
+    bulk: crescent.ClassCommandOption[int | None] = crescent.option(
+        int,
+        name="zbiorczo",
+        description=(
+            "Przeglądaj tyle filmów naraz i zatwierdzaj je z listy, "
+            "zamiast pojedynczo."
+        ),
+        default=None,
+        min_value=10,
+        max_value=BULK_PAGE_SIZE_LIMIT,
+    )
+    distributed: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="rownolegle",
+        description=DISTRIBUTE_OPTION_DESCRIPTION,
+        default=False,
+    )
+    account: crescent.ClassCommandOption[str | None] = crescent.option(
+        str,
+        name="kanal",
+        description=ACCOUNT_OPTION_DESCRIPTION,
+        default=None,
+    )
 
-    async def callback(  # noqa: C901
-        self,
-        command_context: crescent.Context,
-    ) -> None:
+    async def callback(self, command_context: crescent.Context) -> None:
         """Show videos on the YouTube channel."""
         if not await ensure_proper_channel(command_context):
             return
-        if not youtube_oauth2.valid:
+        account = await select_account(command_context, self.account)
+        if account is None:
+            return
+        invocation = metrics.Invocation("podmien")
+        token = metrics.invocation_var.set(invocation)
+        session_started = False
+        try:
+            session_started = await self.start(command_context, account, invocation)
+        finally:
+            metrics.invocation_var.reset(token)
+            # An open session finishes the invocation once it ends.
+            if not session_started:
+                invocation.finish()
+
+    async def start(  # noqa: C901
+        self,
+        command_context: crescent.Context,
+        account: Account,
+        invocation: metrics.Invocation,
+    ) -> bool:
+        """Open a session of the command, return False if it ended right away."""
+        if not await credential_manager.ensure_valid():
             await _authorize_impl(command_context)
         else:
             await command_context.defer()
@@ -297,292 +506,409 @@ class SubstituteCommand:
                 "Nie wybrano żadnych elementów do podmiany.",
                 ephemeral=True,
             )
-            return
+            return False
 
         replacement = argument_unescape(self.replacement)
         expression = argument_unescape(self.expression)
+        try:
+            pattern = patterns.check_pattern(
+                expression,
+                replacement,
+                max_risk=app_config.max_pattern_risk,
+            )
+        except patterns.PatternError as e:
+            await command_context.respond(pattern_error_message(e), ephemeral=True)
+            return False
 
-        playlist_id = self.playlist_id
-
-        if playlist_id is None:
-            playlist_id = app_config.default_playlist_id
-        elif match := re.match(PLAYLIST_PATTERN, playlist_id):
-            playlist_id = match.group("playlist_id")
-            if not playlist_id:
-                await command_context.respond(
-                    "Niepoprawny identyfikator playlisty.",
-                    ephemeral=True,
-                )
-                return
+        playlist_ids = await resolve_playlist_ids(self.playlist_id, account)
+        if not playlist_ids:
+            await command_context.respond(
+                "Niepoprawny identyfikator playlisty.",
+                ephemeral=True,
+            )
+            return False
 
-        _LOGGER.info("Using playlist ID: %s", playlist_id)
+        _LOGGER.info("Using playlist IDs: %s", ", ".join(playlist_ids))
 
         log_ts = datetime.datetime.now(tz=datetime.timezone.utc).timestamp()
         log_filename = f"log-{log_ts}.txt"
         log = pathlib.Path(log_filename)
 
+        rule = Rule(
+            expression=expression,
+            replacement=replacement,
+            with_title=self.include_titles,
+            with_description=self.include_descriptions,
+        )
+        candidates = None
+        scope_note = ""
+        if self.narrow:
+            literals = pattern.literals
+            if literals is not None:
+                candidates = snapshot.candidates(
+                    playlist_ids,
+                    literals,
+                    with_title=self.include_titles,
+                    with_description=self.include_descriptions,
+                )
+            if candidates is None:
+                scope_note = (
+                    "Nie udało się zawęzić wyszukiwania "
+                    + (
+                        "(wyrażenie nie zawiera stałego fragmentu tekstu)"
+                        if literals is None
+                        else "(brak lokalnej kopii playlisty)"
+                    )
+                    + ", przeszukuję całą playlistę.\n"
+                )
+            else:
+                scanned_at = snapshot.scanned_at(playlist_ids) or 0
+                scope_note = (
+                    f"Przeszukuję tylko {len(candidates)} filmów wybranych "
+                    f"według lokalnej kopii kanału z <t:{int(scanned_at)}:R>.\n"
+                )
+        if self.distributed:
+            await distribute(
+                command_context,
+                account,
+                shards.SUBSTITUTE,
+                playlist_ids,
+                summary=f"{expression} → {replacement}",
+                video_ids=candidates,
+                rule=rule,
+            )
+            return False
         try:
-            regex = re.compile(expression)
-        except re.error as e:
+            session = sessions.open(command_context.user.id, "podmien")
+        except SessionLimitError:
+            _LOGGER.info("Refusing /podmien", exc_info=True)
             await command_context.respond(
-                f"Niepoprawne wyrażenie regularne: {e}",
+                "Otwartych jest już zbyt wiele sesji podmiany. "
+                "Zakończ poprzednią lub spróbuj ponownie później.",
                 ephemeral=True,
             )
-            return
-
-        diffs: list[VideoDiff] = []
-
-        for item in youtube_api.get_playlist_items(playlist_id, limit=DEFAULT_LIMIT):
-            snippet = item["snippet"]
-            old_title = snippet["title"]
-            old_description = snippet["description"]
-
-            if self.include_titles:
-                try:
-                    new_title = regex.sub(replacement, old_title)
-                except re.error as e:
-                    await command_context.respond(
-                        f"Niepoprawne wyrażenie zastępujące: {e}",
-                        ephemeral=True,
-                    )
-                    return
-            else:
-                new_title = old_title
-
-            if self.include_descriptions:
-                try:
-                    new_description = regex.sub(replacement, old_description)
-                except re.error as e:
-                    await command_context.respond(
-                        f"Niepoprawne wyrażenie zastępujące: {e}",
-                        ephemeral=True,
-                    )
-                    return
-            else:
-                new_description = old_description
-
-            if (old_title, old_description) != (new_title, new_description):
-                diffs.append(
-                    VideoDiff(
-                        video_id=snippet["resourceId"]["videoId"],
-                        old_title=old_title,
-                        new_title=new_title,
-                        old_description=old_description,
-                        new_description=new_description,
-                        tags=snippet.get("tags") or [],
-                    ),
-                )
+            return False
+        source = engine.DiffSource(
+            account.api,
+            playlist_ids,
+            rule,
+            candidates=candidates,
+            snapshot=snapshot,
+            pages=(
+                None
+                if candidates is not None
+                else sessions.playlist_pages(account, playlist_ids, snapshot)
+            ),
+        )
+        source.start()
+        run = JournalRun(
+            "podmien",
+            str(command_context.user.id),
+            f"{expression} → {replacement}",
+            account=account.name,
+        )
 
-        def create_embeds() -> list[hikari.Embed]:
-            diff = diffs[current_page]
-            highlighted = highlight_diffs(diff.old_description, diff.new_description)
-            tails = [highlighted]
+        @metrics.span("render")
+        def create_parts() -> list[list[hikari.Embed]]:
+            """Render the current diff as embeds, split into messages if needed."""
+            diff = current_diff
+            assert diff is not None  # noqa: S101
             url = f"https://www.youtube.com/watch?v={diff.video_id}"
-
-            while len(tails[-1]) > 2000:
-                msg = tails[-1]
-                if "\n\n" not in msg[:2000]:
-                    break
-                diff_break = msg[:2000].rindex("\n\n")
-                tails[-1] = msg[:diff_break]
-                tails.append(msg[diff_break:])
-            times_repeated = 0
-
-            while len(url) + len(diff.new_title) + sum(map(len, tails)) >= 4500:
-                _LOGGER.warning("Embed too long, truncating")
-                if times_repeated > 0:
-                    tails.pop(-1)
-                tails[-1] = (
-                    f"{DIFFIZE_ABORT} "
-                    "**Nie udało się wyświetlić całego opisu, ponieważ przekroczył "
-                    "on limit długości.**"
+            if self.full_lines:
+                blocks = diff_blocks(diff.old_description, diff.new_description)
+            elif rule.with_description:
+                blocks = excerpt_blocks(
+                    engine.match_excerpts(
+                        pattern.regex,
+                        rule.replacement,
+                        diff.old_description,
+                        context=app_config.diff_context,
+                    ),
                 )
-                times_repeated += 1
-
+            else:
+                blocks = []
+            parts = embeds.pack(
+                blocks,
+                head=title_change(diff.old_title, diff.new_title),
+                reserved=len(diff.old_title),
+            )
             return [
-                hikari.Embed(
-                    title=diff.old_title,
-                    description=prepend_new_title(
-                        old_title=diff.old_title,
-                        new_title=diff.new_title,
-                        initial_description=diffize(tails.pop(0)),
-                    ),
-                    color=0x0000FF,
-                    url=url,
-                ),
-                *(
-                    hikari.Embed(description=tail, color=0x0000FF)
-                    for tail in map(diffize, tails)
-                ),
+                [
+                    hikari.Embed(
+                        title=None if index else diff.old_title,
+                        description=description,
+                        color=0x0000FF,
+                        url=None if index else url,
+                    )
+                    for index, description in enumerate(part)
+                ]
+                for part in parts
             ]
 
         current_page = 0
-        n_diffs = len(diffs)
-        max_page = n_diffs - 1
+        current_part = 0
+        current_diff: VideoDiff | None = None
+        current_view: miru.View | None = None
         left_over = 0
-        current_limit = min((self.limit, n_diffs))
+        current_limit = self.limit
+
+        async def on_session_closed() -> None:
+            """Free the results, notifying the user if the session timed out."""
+            nonlocal current_diff
+            source.cancel()
+            source.refs.clear()
+            if current_view is not None:
+                current_view.stop()
+            if current_diff is not None or bulk_diffs:
+                current_diff = None
+                bulk_diffs.clear()
+                invocation.finish()
+                await command_context.respond(
+                    "Sesja podmiany wygasła z powodu braku aktywności.",
+                )
+
+        session.on_close(on_session_closed)
+
+        async def load_page(page: int) -> None:
+            """Materialize the diff on the given page, skipping stale matches."""
+            nonlocal current_page, current_part, current_diff
+            current_diff = None
+            current_part = 0
+            while True:
+                await source.wait_for(page + 1)
+                if not source.refs:
+                    return
+                page = min(page, len(source) - 1)
+                with metrics.span("materialize"):
+                    materialized, dropped = await asyncio.to_thread(
+                        source.materialize,
+                        source.refs[page : page + 1],
+                    )
+                source.discard(dropped)
+                if materialized:
+                    current_page, (current_diff,) = page, materialized
+                    return
 
         async def on_end(context: miru.ViewContext) -> None:
+            session.touch()
             await context.defer()
-            if not diffs:
+            nonlocal current_diff
+            if current_diff is None:
                 return
-            nonlocal n_diffs
-            diffs.clear()
-            n_diffs = 0
-            await make_message()
+            source.cancel()
+            current_diff = None
+            with metrics.track(invocation):
+                await make_message()
 
         async def on_next_page(context: miru.ViewContext) -> None:
+            session.touch()
             await context.defer()
-            if not diffs:
+            if current_diff is None:
                 return
-            nonlocal current_page
-            current_page += current_page + 1 <= max_page
             message = context.message
-            await make_message(message=message)
+            with metrics.track(invocation):
+                await load_page(current_page + 1)
+                await make_message(message=message)
+
+        async def on_part(context: miru.ViewContext, *, step: int) -> None:
+            nonlocal current_part
+            session.touch()
+            await context.defer()
+            if current_diff is None:
+                return
+            current_part += step
+            with metrics.track(invocation):
+                await make_message(message=context.message)
 
         async def on_previous_page(context: miru.ViewContext) -> None:
+            session.touch()
             await context.defer()
-            if not diffs:
+            if current_diff is None:
                 return
-            nonlocal current_page
-            current_page -= current_page - 1 >= 0
             message = context.message
-            await make_message(message=message)
+            with metrics.track(invocation):
+                await load_page(max(current_page - 1, 0))
+                await make_message(message=message)
 
         async def on_submit(
             context: miru.ViewContext,
             *,
             with_title: bool = self.include_titles,
             with_description: bool = self.include_descriptions,
-            reuse: bool = False,
+        ) -> None:
+            session.touch()
+            await context.defer()
+            diff = current_diff
+            if diff is None:
+                return
+            with metrics.track(invocation):
+                try:
+                    # The diff might have been shown a long time ago.
+                    with metrics.span("validate"):
+                        result = await asyncio.to_thread(
+                            engine.rebase,
+                            account.api,
+                            [diff],
+                            rule,
+                        )
+                except googleapiclient.errors.HttpError as e:
+                    await command_context.respond(
+                        f"Nie udało się sprawdzić aktualności filmu: `{e}`",
+                    )
+                    return
+                if result.dropped:
+                    source.discard(result.dropped)
+                    await command_context.respond(
+                        f"Film <https://www.youtube.com/watch?v={diff.video_id}> "
+                        "został zmieniony od czasu pobrania i nie wymaga już podmiany.",
+                    )
+                elif await apply(
+                    diff,
+                    with_title=with_title,
+                    with_description=with_description,
+                ):
+                    source.discard([diff.video_id])
+                else:
+                    return
+                await load_page(current_page)
+                await make_message(message=context.message)
+
+        async def apply(
+            diff: VideoDiff,
+            *,
+            with_title: bool = self.include_titles,
+            with_description: bool = self.include_descriptions,
         ) -> bool:
-            if not reuse:
-                await context.defer()
-            nonlocal current_page, max_page, current_limit
-            if not diffs:
-                if reuse:
-                    await context.defer()
-                return True
-            diff = diffs[current_page]
+            nonlocal current_limit
+            # Applying many diffs in a row does not make the session idle.
+            session.touch()
             try:
-                youtube_api.update_video_description(
-                    video_id=diff.video_id,
-                    video_title=diff.new_title if with_title else diff.old_title,
-                    video_category_id=diff.video_category_id,
-                    description=(
-                        diff.new_description
-                        if with_description
-                        else diff.old_description
-                    ),
-                    tags=diff.tags,
-                )
+                with metrics.span("update"):
+                    updated = await asyncio.to_thread(
+                        account.api.update_video_description,
+                        video_id=diff.video_id,
+                        video_title=diff.new_title if with_title else diff.old_title,
+                        video_category_id=diff.video_category_id,
+                        description=(
+                            diff.new_description
+                            if with_description
+                            else diff.old_description
+                        ),
+                        tags=diff.tags,
+                    )
             except googleapiclient.errors.HttpError as e:
                 await command_context.respond(
                     f"Nie udało się podmienić opisu filmu: `{e}`",
                 )
                 return False
-            diffs.pop(current_page)
+            journal.record(run, diff.record, VideoRecord.from_resource(updated))
             done_diffs.append(diff)
-            max_page -= 1
             current_limit -= 1
-            if current_page == max_page and max_page != 0:
-                current_page -= 1
-            if not reuse:
-                message = context.message
-                await make_message(message=message)
             return True
 
         async def on_finalize(context: miru.ViewContext) -> None:
-            nonlocal left_over, n_diffs
+            nonlocal left_over, current_diff
+            session.touch()
             await context.defer()
-            await context.message.delete()
-            message = await command_context.respond(
-                f"Podmieniam automatycznie, zostało: {current_limit}",
-                ensure_message=True,
-            )
-            while current_limit > 0:
-                await message.edit(
-                    f"Podmieniam automatycznie, zostało: {current_limit}",
-                )
-                ok = await on_submit(context, reuse=True)
-                if not ok:
-                    await message.edit(
-                        "Wystąpił błąd, którego szczegóły są podane powyżej.\n"
-                        "Zakończono podmianę automatyczną. Spróbuj ponownie później.",
-                    )
-                    break
-            await message.delete()
-            left_over = len(diffs)
-            diffs.clear()
-            n_diffs = 0
-            await make_message()
-
-        async def make_message(**kwargs: Any) -> None:
-            message = kwargs.pop("message", None)
-            if message is not None:
-                await message.delete()
-
-            if not diffs:
-                await command_context.respond(
-                    "Seria podmian zakończona."
-                    + (
-                        f"\nLiczba filmów do podmiany następnego dnia: **{left_over}**."
-                        if left_over > 0
-                        else ""
-                    ),
+            with metrics.track(invocation):
+                await context.message.delete()
+                message = await command_context.respond(
+                    "Podmieniam automatycznie, zostało: "
+                    f"{min(current_limit, len(source))}",
+                    ensure_message=True,
                 )
-
-                if done_diffs:
-                    log.write_text(
-                        "\n\n".join(
-                            (
-                                title := (
-                                    f"{diff.old_title} -> {diff.new_title}"
-                                    if diff.old_title != diff.new_title
-                                    else diff.old_title
-                                )
+                await source.wait_for()
+                ok = True
+                while ok and current_limit > 0 and source.refs:
+                    # Materializing a batch fetches the videos anew,
+                    # which doubles as a check that the diffs are up to date.
+                    batch = source.refs[: min(MAX_IDS_PER_REQUEST, current_limit)]
+                    try:
+                        with metrics.span("materialize"):
+                            materialized, dropped = await asyncio.to_thread(
+                                source.materialize,
+                                batch,
+                                fresh=True,
                             )
-                            + "\n"
-                            + f"https://www.youtube.com/watch?v={diff.video_id}"
-                            + "\n"
-                            + "-" * len(title)
-                            + "\n"
-                            + highlight_diffs(
-                                new_text=diff.new_description,
-                                old_text=diff.old_description,
-                                sep="\n",
+                    except googleapiclient.errors.HttpError as e:
+                        await command_context.respond(
+                            f"Nie udało się sprawdzić aktualności filmów: `{e}`",
+                        )
+                        break
+                    source.discard(dropped)
+                    for diff in materialized:
+                        with metrics.span("discord.edit"):
+                            await message.edit(
+                                "Podmieniam automatycznie, zostało: "
+                                f"{min(current_limit, len(source))}",
                             )
-                            for diff in done_diffs
-                        ),
-                        encoding="utf-8",
-                    )
-                    await command_context.respond("Załączam raport:", attachment=log)
-                else:
-                    await command_context.respond(
-                        "Nie dokonano żadnej podmiany, dlatego nie ma raportu.",
-                    )
-                return
-
-            view = miru.View(timeout=None)
-
-            previous_button = miru.Button(
-                emoji="⬅️",
-                custom_id="previous",
-                disabled=current_page == 0,
-            )
-            previous_button.callback = on_previous_page
-            view.add_item(previous_button)
+                        ok = await apply(diff)
+                        if not ok:
+                            await message.edit(
+                                "Wystąpił błąd, którego szczegóły są podane powyżej.\n"
+                                "Zakończono podmianę automatyczną. "
+                                "Spróbuj ponownie później.",
+                            )
+                            break
+                        source.discard([diff.video_id])
+                await message.delete()
+                # The queue rebuilds the diffs from fresh data when applying them.
+                left_over = job_queue.enqueue_refs(
+                    (ref.video_id for ref in source.refs),
+                    rule,
+                    invoked_by=str(command_context.user.id),
+                    account=account.name,
+                )
+                source.refs.clear()
+                current_diff = None
+                await make_message()
 
-            next_button = miru.Button(
-                emoji="➡️",
-                custom_id="next",
-                disabled=current_page == max_page,
+        async def end_session() -> None:
+            await sessions.close(session)
+            invocation.finish()
+            await command_context.respond(
+                "Seria podmian zakończona."
+                + (
+                    "\nLiczba filmów do podmiany następnego dnia: "
+                    f"**{left_over}**. "
+                    "Zostaną podmienione automatycznie po odnowieniu limitu API."
+                    if left_over > 0
+                    else ""
+                ),
             )
-            next_button.callback = on_next_page
-            view.add_item(next_button)
 
-            diff = diffs[current_page]
+            if done_diffs:
+                log.write_text(
+                    "\n\n".join(
+                        (
+                            title := (
+                                f"{diff.old_title} -> {diff.new_title}"
+                                if diff.old_title != diff.new_title
+                                else diff.old_title
+                            )
+                        )
+                        + "\n"
+                        + f"https://www.youtube.com/watch?v={diff.video_id}"
+                        + "\n"
+                        + "-" * len(title)
+                        + "\n"
+                        + highlight_diffs(
+                            new_text=diff.new_description,
+                            old_text=diff.old_description,
+                            sep="\n",
+                        )
+                        for diff in done_diffs
+                    ),
+                    encoding="utf-8",
+                )
+                await command_context.respond("Załączam raport:", attachment=log)
+            else:
+                await command_context.respond(
+                    "Nie dokonano żadnej podmiany, dlatego nie ma raportu.",
+                )
 
+        def add_submit_buttons(view: miru.View, diff: VideoDiff) -> None:
+            """Add a button for every scope of the diff that can be submitted."""
             for _, scope_selectors in filter(
                 operator.itemgetter(0),
                 (
@@ -604,13 +930,67 @@ class SubstituteCommand:
                     custom_id=f"submit_{with_title:d}_{with_description:d}",
                     label=f"Podmień {scope_description}",
                 )
-                submit_button.callback = functools.partial(  # type: ignore[assignment]
+                submit_button.callback = functools.partial(  # type: ignore[method-assign]
                     on_submit,
                     with_title=with_title,
                     with_description=with_description,
                 )
                 view.add_item(submit_button)
 
+        async def make_message(**kwargs: Any) -> None:
+            nonlocal current_view, current_part
+            message = kwargs.pop("message", None)
+            if message is not None:
+                with metrics.span("discord.delete"):
+                    await message.delete()
+            if current_view is not None:
+                current_view.stop()
+                current_view = None
+
+            if current_diff is None:
+                await end_session()
+                return
+
+            n_diffs = len(source)
+            max_page = n_diffs - 1
+            view = current_view = miru.View(timeout=None)
+
+            previous_button = miru.Button(
+                emoji="⬅️",
+                custom_id="previous",
+                disabled=current_page == 0,
+            )
+            previous_button.callback = on_previous_page  # type: ignore[method-assign]
+            view.add_item(previous_button)
+
+            next_button = miru.Button(
+                emoji="➡️",
+                custom_id="next",
+                disabled=source.done and current_page == max_page,
+            )
+            next_button.callback = on_next_page  # type: ignore[method-assign]
+            view.add_item(next_button)
+
+            parts = create_parts()
+            current_part = min(current_part, len(parts) - 1)
+            if len(parts) > 1:
+                for emoji, custom_id, step, disabled in (
+                    ("🔼", "previous_part", -1, current_part == 0),
+                    ("🔽", "next_part", 1, current_part == len(parts) - 1),
+                ):
+                    button = miru.Button(
+                        emoji=emoji,
+                        custom_id=custom_id,
+                        disabled=disabled,
+                    )
+                    button.callback = functools.partial(  # type: ignore[method-assign]
+                        on_part,
+                        step=step,
+                    )
+                    view.add_item(button)
+
+            add_submit_buttons(view, current_diff)
+
             end_button = miru.Button(
                 emoji="⏹️",
                 label="Zakończ" if done_diffs else "Anuluj",
@@ -619,16 +999,18 @@ class SubstituteCommand:
             end_button.callback = on_end  # type: ignore[method-assign]
             view.add_item(end_button)
 
-            if current_limit > 1:
+            to_submit = min(current_limit, n_diffs)
+            if to_submit > 1 or (to_submit and not source.done):
                 finalize_button = miru.Button(
                     emoji="⚙️",
                     custom_id="finalize",
-                    label=f"Podmień wszystkie ({current_limit})",
+                    label=(
+                        f"Podmień wszystkie ({to_submit}{'' if source.done else '+'})"
+                    ),
                 )
                 finalize_button.callback = on_finalize  # type: ignore[method-assign]
                 view.add_item(finalize_button)
 
-            embeds = create_embeds()
             done = 0
             invoked_by = (
                 (member := command_context.member)
@@ -646,29 +1028,348 @@ class SubstituteCommand:
             content += (
                 f"Zamiana napisów opisanych wyrażeniem `{escape(expression, '`')}` "
                 f"na `{escape(replacement, '`')}`.\n"
-                f"Strona `{current_page + 1}` z `{max_page + 1}`.\n"
-                f"Zmiany zostaną wykonane nie dalej niż dla **{current_limit}** "
+                f"Strona `{current_page + 1}` z `{max_page + 1}`"
+                + (
+                    ""
+                    if source.done
+                    else f" (wyszukiwanie trwa, przejrzano {source.scanned} filmów)"
+                )
+                + (
+                    f", część opisu `{current_part + 1}` z `{len(parts)}`"
+                    if len(parts) > 1
+                    else ""
+                )
+                + ".\n"
+                f"Zmiany zostaną wykonane nie dalej niż dla **{to_submit}** "
                 "filmów spośród podanych.\n"
+                + scope_note
             )
-            left_after = max_page + 1 - current_limit
+            left_after = max_page + 1 - to_submit
             if left_after > 0:
                 content += (
                     f"Potem zostanie {left_after} filmów do podmiany "
                     "w późniejszym terminie.\n"
                 )
-            response = await command_context.respond(
-                content,
-                embeds=embeds,
-                components=view,
-                **kwargs,
+            with metrics.span("discord.respond"):
+                response = await command_context.respond(
+                    content,
+                    embeds=parts[current_part],
+                    components=view,
+                    **kwargs,
+                )
+            await view.start(response)
+
+        bulk_offset = 0
+        bulk_diffs: list[VideoDiff] = []
+        selected: set[str] = set()
+
+        async def load_bulk_page(offset: int) -> None:
+            """Materialize the diffs of a page of the list, skipping stale matches."""
+            nonlocal bulk_offset, bulk_diffs
+            size = self.bulk or 0
+            while True:
+                await source.wait_for(offset + size)
+                if offset >= len(source):
+                    offset = max(len(source) - 1, 0) // size * size
+                refs = source.refs[offset : offset + size]
+                if not refs:
+                    bulk_offset, bulk_diffs = 0, []
+                    return
+                with metrics.span("materialize"):
+                    materialized, dropped = await asyncio.to_thread(
+                        source.materialize,
+                        refs,
+                    )
+                source.discard(dropped)
+                if not dropped:
+                    bulk_offset, bulk_diffs = offset, materialized
+                    return
+
+        def snippet(diff: VideoDiff) -> tuple[str, str]:
+            """The first change the diff makes, short enough for a list."""
+            for old_text, new_text in (
+                (diff.old_description, diff.new_description),
+                (diff.old_title, diff.new_title),
+            ):
+                if old_text != new_text:
+                    excerpts = engine.match_excerpts(
+                        pattern.regex,
+                        rule.replacement,
+                        old_text,
+                        context=BULK_SNIPPET_CONTEXT,
+                    )
+                    if excerpts:
+                        old, new = excerpts[0]
+                        return (
+                            shorten(old, BULK_SNIPPET_WIDTH),
+                            shorten(new, BULK_SNIPPET_WIDTH),
+                        )
+            return "", ""
+
+        async def on_bulk_select(
+            context: miru.ViewContext,
+            select: miru.TextSelect,
+        ) -> None:
+            nonlocal selected
+            session.touch()
+            await context.defer()
+            selected = set(select.values)
+
+        async def on_bulk_approve(context: miru.ViewContext) -> None:
+            nonlocal left_over
+            session.touch()
+            await context.defer()
+            approved = [diff for diff in bulk_diffs if diff.video_id in selected]
+            with metrics.track(invocation):
+                source.discard(
+                    diff.video_id
+                    for diff in bulk_diffs
+                    if diff.video_id not in selected
+                )
+                try:
+                    with metrics.span("validate"):
+                        result = await asyncio.to_thread(
+                            engine.rebase,
+                            account.api,
+                            approved,
+                            rule,
+                        )
+                except googleapiclient.errors.HttpError as e:
+                    await command_context.respond(
+                        f"Nie udało się sprawdzić aktualności filmów: `{e}`",
+                    )
+                    return
+                source.discard(result.dropped)
+                approved = [
+                    diff for diff in approved if diff.video_id not in result.dropped
+                ]
+                for index, diff in enumerate(approved):
+                    if current_limit <= 0:
+                        # The queue checks them again before applying them.
+                        over_limit = approved[index:]
+                        left_over += job_queue.enqueue(
+                            over_limit,
+                            rule,
+                            invoked_by=str(command_context.user.id),
+                            account=account.name,
+                        )
+                        source.discard(diff.video_id for diff in over_limit)
+                        break
+                    if not await apply(diff):
+                        break
+                    source.discard([diff.video_id])
+                await load_bulk_page(bulk_offset)
+                await make_bulk_message(message=context.message)
+
+        async def on_bulk_reject(context: miru.ViewContext) -> None:
+            session.touch()
+            await context.defer()
+            with metrics.track(invocation):
+                source.discard(selected)
+                await load_bulk_page(bulk_offset)
+                await make_bulk_message(message=context.message)
+
+        async def on_bulk_page(context: miru.ViewContext, *, step: int) -> None:
+            session.touch()
+            await context.defer()
+            with metrics.track(invocation):
+                await load_bulk_page(max(bulk_offset + step * (self.bulk or 0), 0))
+                await make_bulk_message(message=context.message)
+
+        async def on_bulk_end(context: miru.ViewContext) -> None:
+            session.touch()
+            await context.defer()
+            source.cancel()
+            bulk_diffs.clear()
+            with metrics.track(invocation):
+                await make_message(message=context.message)
+
+        async def make_bulk_message(**kwargs: Any) -> None:
+            nonlocal current_view, selected
+            if not bulk_diffs:
+                await make_message(**kwargs)
+                return
+            message = kwargs.pop("message", None)
+            if message is not None:
+                with metrics.span("discord.delete"):
+                    await message.delete()
+            if current_view is not None:
+                current_view.stop()
+            view = current_view = miru.View(timeout=None)
+
+            selected = {diff.video_id for diff in bulk_diffs}
+            select = miru.TextSelect(
+                custom_id="select",
+                placeholder="Filmy do podmiany",
+                min_values=0,
+                max_values=len(bulk_diffs),
+                options=[
+                    miru.SelectOption(
+                        label=shorten(f"{index}. {diff.old_title}", 100),
+                        value=diff.video_id,
+                        description=shorten(snippet(diff)[1], 100) or None,
+                        is_default=True,
+                    )
+                    for index, diff in enumerate(bulk_diffs, bulk_offset + 1)
+                ],
+            )
+            select.callback = functools.partial(  # type: ignore[method-assign]
+                on_bulk_select,
+                select=select,
+            )
+            view.add_item(select)
+            for emoji, label, custom_id, callback in (
+                ("✅", "Podmień zaznaczone", "approve", on_bulk_approve),
+                ("❌", "Odrzuć zaznaczone", "reject", on_bulk_reject),
+            ):
+                button = miru.Button(emoji=emoji, label=label, custom_id=custom_id)
+                button.callback = callback  # type: ignore[method-assign]
+                view.add_item(button)
+            for emoji, custom_id, step, disabled in (
+                ("⬅️", "previous", -1, bulk_offset == 0),
+                (
+                    "➡️",
+                    "next",
+                    1,
+                    source.done and bulk_offset + len(bulk_diffs) >= len(source),
+                ),
+            ):
+                button = miru.Button(
+                    emoji=emoji,
+                    custom_id=custom_id,
+                    disabled=disabled,
+                )
+                button.callback = functools.partial(  # type: ignore[method-assign]
+                    on_bulk_page,
+                    step=step,
+                )
+                view.add_item(button)
+            end_button = miru.Button(
+                emoji="⏹️",
+                label="Zakończ" if done_diffs else "Anuluj",
+                custom_id="end",
+            )
+            end_button.callback = on_bulk_end  # type: ignore[method-assign]
+            view.add_item(end_button)
+
+            blocks = []
+            for index, diff in enumerate(bulk_diffs, bulk_offset + 1):
+                (block,) = excerpt_blocks([snippet(diff)])
+                blocks.append(f"{index}. {shorten(diff.old_title, 60)}\n{block}")
+            pages = embeds.pack(blocks)
+            if len(pages) > 1:
+                _LOGGER.warning("Bulk review list does not fit into one message")
+            content = (
+                f"Zamiana napisów opisanych wyrażeniem `{escape(expression, '`')}` "
+                f"na `{escape(replacement, '`')}`.\n"
+                f"Filmy `{bulk_offset + 1}`\N{EN DASH}"
+                f"`{bulk_offset + len(bulk_diffs)}` "
+                f"z `{len(source)}{'' if source.done else '+'}`. "
+                "Niezaznaczone filmy z tej strony zostaną odrzucone przy podmianie "
+                "zaznaczonych.\n"
+                f"Do limitu zostało: **{current_limit}**, nadmiarowe filmy "
+                "zostaną podmienione z kolejki.\n" + scope_note
             )
+            with metrics.span("discord.respond"):
+                response = await command_context.respond(
+                    content,
+                    embeds=[
+                        hikari.Embed(description=description, color=0x0000FF)
+                        for description in pages[0]
+                    ],
+                    components=view,
+                    **kwargs,
+                )
             await view.start(response)
 
         done_diffs: list[VideoDiff] = []
-        if diffs:
-            await make_message(ensure_message=True)
-        else:
+        if self.bulk:
+            await load_bulk_page(0)
+            if bulk_diffs:
+                await make_bulk_message(ensure_message=True)
+                return True
+            await sessions.close(session)
+            await command_context.respond(
+                "Żadne filmy nie podlegają takiej podmianie.",
+            )
+            return False
+        await load_page(0)
+        if current_diff is None:
+            await sessions.close(session)
             await command_context.respond("Żadne filmy nie podlegają takiej podmianie.")
+            return False
+        await make_message(ensure_message=True)
+        return True
+
+
+@plugin.include
+@crescent.command(
+    name="szukaj",
+    description="Wyszukaj filmy w lokalnej kopii kanału i pliku tags.json.",
+    default_member_permissions=hikari.Permissions.ADMINISTRATOR,
+)
+class Search:
+    query: crescent.ClassCommandOption[str] = crescent.option(
+        str,
+        name="zapytanie",
+        description=(
+            "Słowa, które muszą wystąpić w tytule, opisie, lematach lub tagach."
+        ),
+        default="",
+    )
+    hashtags: crescent.ClassCommandOption[str] = crescent.option(
+        str,
+        name="hasztagi",
+        description="Hasztagi, z których przynajmniej jeden musi wystąpić.",
+        default="",
+    )
+    without_hashtags: crescent.ClassCommandOption[str] = crescent.option(
+        str,
+        name="bez_hasztagow",
+        description="Hasztagi, których nie może być w filmie.",
+        default="",
+    )
+    limit: crescent.ClassCommandOption[int] = crescent.option(
+        int,
+        name="limit",
+        description="Maksymalna liczba wyników.",
+        default=25,
+        min_value=1,
+        max_value=100,
+    )
+
+    async def callback(self, command_context: crescent.Context) -> None:
+        """Search videos in the local full-text index."""
+        if not await ensure_proper_channel(command_context):
+            return
+        if not (self.query or self.hashtags or self.without_hashtags):
+            await command_context.respond(
+                "Podaj zapytanie lub hasztagi.",
+                ephemeral=True,
+            )
+            return
+        await command_context.defer()
+        with metrics.span("search"):
+            results = await asyncio.to_thread(
+                search_index.search,
+                self.query,
+                hashtags=re.split(LIST_SEPARATOR_RE, self.hashtags.strip()),
+                without_hashtags=re.split(
+                    LIST_SEPARATOR_RE,
+                    self.without_hashtags.strip(),
+                ),
+                limit=self.limit,
+            )
+        if not results:
+            await command_context.respond("Nie znaleziono żadnych filmów.")
+            return
+        content = f"Znalezione filmy: **{len(results)}**\n"
+        for result in results:
+            line = f"- [{escape(result.title, ']')}](<{result.url}>)\n"
+            if len(content) + len(line) > 2000:
+                break
+            content += line
+        await command_context.respond(content)
 
 
 @plugin.include
@@ -682,7 +1383,49 @@ class AddTags:
         str,
         name="playlista",
         default=None,
-        description="ID playlisty, z której mają być modfikowane filmy.",
+        description=PLAYLIST_OPTION_DESCRIPTION,
+    )
+    generate: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="generuj",
+        description="Wygeneruj tagi dla filmów, których nie ma w pliku tags.json.",
+        default=False,
+    )
+    mode: crescent.ClassCommandOption[str] = crescent.option(
+        str,
+        name="tryb",
+        description="Jak połączyć nowe tagi z obecnymi tagami filmów.",
+        choices=[
+            ("uzupełnij filmy bez tagów", tagging.FILL_EMPTY),
+            ("dodaj do obecnych", tagging.UNION),
+            ("zastąp obecne", tagging.REPLACE),
+            ("usuń podane tagi", tagging.REMOVE),
+        ],
+        default=tagging.FILL_EMPTY,
+    )
+    remove: crescent.ClassCommandOption[str] = crescent.option(
+        str,
+        name="usun",
+        description="Tagi do usunięcia w trybie usuwania, oddzielone przecinkami.",
+        default="",
+    )
+    refresh: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="odswiez",
+        description="Pobierz wszystkie filmy z YouTube zamiast z lokalnej kopii.",
+        default=False,
+    )
+    distributed: crescent.ClassCommandOption[bool] = crescent.option(
+        bool,
+        name="rownolegle",
+        description=DISTRIBUTE_OPTION_DESCRIPTION,
+        default=False,
+    )
+    account: crescent.ClassCommandOption[str | None] = crescent.option(
+        str,
+        name="kanal",
+        description=ACCOUNT_OPTION_DESCRIPTION,
+        default=None,
     )
 
     async def callback(  # noqa: C901
@@ -696,10 +1439,15 @@ class AddTags:
         collected information about the videos from tags.json
         """
         channel: hikari.GuildTextChannel = command_context.channel  # type: ignore[assignment]
+        invocation = metrics.Invocation("dodajtagi")
+        token = metrics.invocation_var.set(invocation)
         try:
             if not await ensure_proper_channel(command_context):
                 return
-            if not youtube_oauth2.valid:
+            account = await select_account(command_context, self.account)
+            if account is None:
+                return
+            if not await credential_manager.ensure_valid():
                 await _authorize_impl(command_context)
             else:
                 await command_context.defer()
@@ -715,52 +1463,125 @@ class AddTags:
                 )
                 return
 
-            playlist_id = self.playlist_id
-
-            if playlist_id is None:
-                playlist_id = app_config.default_playlist_id
-            _LOGGER.info("Using playlist ID: %s", playlist_id)
+            playlist_ids = await resolve_playlist_ids(self.playlist_id, account)
+            _LOGGER.info("Using playlist IDs: %s", ", ".join(playlist_ids))
+            remove = [tag for tag in self.remove.split(",") if tag.strip()]
+            if self.mode == tagging.REMOVE and not remove:
+                await command_context.respond(
+                    "Nie podano tagów do usunięcia.",
+                    ephemeral=True,
+                )
+                return
+            if self.distributed:
+                await distribute(
+                    command_context,
+                    account,
+                    shards.TAGS,
+                    playlist_ids,
+                    summary=self.mode,
+                    mode=self.mode,
+                    remove=remove,
+                    generate=self.generate,
+                )
+                return
 
             diffs: list[VideoDiff] = []
 
-            for item in youtube_api.get_playlist_items(
-                playlist_id,
-                limit=DEFAULT_LIMIT,
-            ):
-                snippet = item["snippet"]
-                video_id = snippet["resourceId"]["videoId"]
-                if video_id in tags:
-                    diff = VideoDiff(
-                        video_id=video_id,
-                        old_title=snippet["title"],
-                        new_title=snippet["title"],
-                        old_description=snippet["description"],
-                        new_description=snippet["description"],
-                        tags=snippet.get("tags") or [],
+            # Every update is saved to the snapshot, so selecting videos from it
+            # makes re-runs that have nothing left to do free of API calls.
+            items = None
+            if not self.refresh and snapshot.scanned_at(playlist_ids) is not None:
+                with metrics.span("snapshot"):
+                    items = await asyncio.to_thread(
+                        snapshot.playlist_records,
+                        playlist_ids,
+                    )
+            if items is None:
+                with metrics.span("fetch"):
+                    items = [
+                        record
+                        async for page in sessions.playlist_pages(
+                            account,
+                            playlist_ids,
+                            snapshot,
+                        )
+                        for record in page
+                    ]
+
+            model = None
+            if self.generate and self.mode != tagging.REMOVE:
+                with metrics.span("tagging.model"):
+                    model = await asyncio.to_thread(tagging.load_model, store, tags)
+
+            def merged_tags(record: VideoRecord) -> list[str] | None:
+                with metrics.span("tagging.plan"):
+                    return tagging.planned_tags(
+                        record,
+                        tags,
+                        self.mode,
+                        model=model,
+                        remove=remove,
+                    )
+
+            for record in items:
+                new_tags = merged_tags(record)
+                if new_tags is not None:
+                    diffs.append(
+                        VideoDiff(
+                            record=record,
+                            new_title=record.title,
+                            new_description=record.description,
+                            tags=new_tags,
+                        ),
                     )
-                    if diff.tags:
-                        continue
-                    diff.tags = tags.get(video_id, {"tags": []})["tags"]
-                    if diff.tags:
-                        diffs.append(diff)
 
             def make_msg() -> str:
-                return f"Liczba filmów bez tagów do uzupełnienia: **{len(diffs)}**\n"
+                return f"Liczba filmów z tagami do zmiany: **{len(diffs)}**\n"
+
+            if not diffs:
+                await command_context.respond(
+                    "Żadne filmy nie wymagają zmiany tagów.",
+                )
+                return
 
             message = await command_context.respond(
                 make_msg(),
                 ensure_message=True,
             )
+            run = JournalRun(
+                "dodajtagi",
+                str(command_context.user.id),
+                self.mode,
+                account=account.name,
+            )
+
+            # Keep titles and descriptions edited since the fetch intact
+            # and merge with the tags the videos have now.
+            with metrics.span("validate"):
+                result = await asyncio.to_thread(engine.rebase, account.api, diffs)
+            dropped = set(result.dropped)
+            for diff in diffs:
+                new_tags = merged_tags(diff.record)
+                if new_tags is None:
+                    dropped.add(diff.video_id)
+                else:
+                    diff.tags = new_tags
+            if dropped:
+                diffs[:] = [diff for diff in diffs if diff.video_id not in dropped]
+                await message.edit(make_msg())
 
             for diff in diffs[:]:
                 try:
-                    youtube_api.update_video_description(
-                        video_id=diff.video_id,
-                        video_title=diff.new_title,
-                        video_category_id=diff.video_category_id,
-                        description=diff.new_description,
-                        tags=diff.tags,
-                    )
+                    with metrics.span("update"):
+                        # Retries back off with sleeps, keep them off the loop.
+                        updated = await asyncio.to_thread(
+                            account.api.update_video_description,
+                            video_id=diff.video_id,
+                            video_title=diff.new_title,
+                            video_category_id=diff.video_category_id,
+                            description=diff.new_description,
+                            tags=diff.tags,
+                        )
                 except googleapiclient.errors.HttpError as e:  # noqa: PERF203
                     pathlib.Path("crash.txt").write_text(
                         "Nie udało się podmienić podpisu filmu.\n"
@@ -770,13 +1591,118 @@ class AddTags:
                     await channel.send(attachment=hikari.File("crash.txt"))
                     break
                 else:
+                    new_record = VideoRecord.from_resource(updated)
+                    snapshot.save([new_record])
+                    journal.record(run, diff.record, new_record)
                     url = f"https://www.youtube.com/watch?v={diff.video_id}"
                     diffs.remove(diff)
-                    await message.edit(make_msg())
+                    with metrics.span("discord.edit"):
+                        await message.edit(make_msg())
                     await channel.send(
-                        f"Uzupełniono tagi w filmie [`{diff.new_title}`]({url}): `{diff.tags}`",
+                        f"Zmieniono tagi w filmie [`{diff.new_title}`]({url}): `{diff.tags}`",
                         reply=message,
                     )
         except Exception:
             pathlib.Path("crash.txt").write_text(traceback.format_exc())
             await channel.send(attachment=hikari.File("crash.txt"))
+        finally:
+            metrics.invocation_var.reset(token)
+            invocation.finish()
+
+
+@plugin.include
+@crescent.command(
+    name="cofnij",
+    description="Cofnij zmiany wprowadzone w filmach przez jeden z przebiegów.",
+    default_member_permissions=hikari.Permissions.ADMINISTRATOR,
+)
+class Revert:
+    run_id: crescent.ClassCommandOption[int | None] = crescent.option(
+        int,
+        name="przebieg",
+        description="Numer przebiegu do cofnięcia. Bez niego wyświetl ostatnie.",
+        default=None,
+        min_value=1,
+    )
+
+    async def callback(self, command_context: crescent.Context) -> None:
+        """Revert the updates made by a run recorded in the journal."""
+        if not await ensure_proper_channel(command_context):
+            return
+        if self.run_id is None:
+            await command_context.defer()
+            runs = await asyncio.to_thread(journal.runs)
+            if not runs:
+                await command_context.respond("Dziennik zmian jest pusty.")
+                return
+            content = "Ostatnie przebiegi (podaj numer w opcji `przebieg`):\n"
+            for run in runs:
+                invoked_by = run["invoked_by"] and f"<@{run['invoked_by']}>"
+                line = (
+                    f"- `{run['id']}` <t:{int(run['started_at'])}:R> "
+                    f"`{run['command']}` ({invoked_by or 'automatycznie'}), "
+                    + (f"kanał `{run['account']}`, " if run["account"] else "")
+                    + f"filmów: **{run['entries']}**"
+                    + (f", `{escape(run['summary'], '`')}`" if run["summary"] else "")
+                    + "\n"
+                )
+                if len(content) + len(line) > 2000:
+                    break
+                content += line
+            await command_context.respond(content)
+            return
+
+        # Runs are reverted on the channel they were made on.
+        name = await asyncio.to_thread(journal.run_account, self.run_id)
+        if name is None:
+            await command_context.respond(
+                f"Nie ma przebiegu o numerze `{self.run_id}`.",
+                ephemeral=True,
+            )
+            return
+        try:
+            account = accounts.get(name)
+        except UnknownAccountError:
+            await command_context.respond(
+                f"Przebieg `{self.run_id}` dotyczy kanału `{name}`, "
+                "którego nie ma już w pliku config.yml.",
+                ephemeral=True,
+            )
+            return
+        account.activate()
+        invocation = metrics.Invocation("cofnij")
+        token = metrics.invocation_var.set(invocation)
+        try:
+            await self.revert(command_context, account, self.run_id)
+        finally:
+            metrics.invocation_var.reset(token)
+            invocation.finish()
+
+    async def revert(
+        self,
+        command_context: crescent.Context,
+        account: Account,
+        run_id: int,
+    ) -> None:
+        if not await credential_manager.ensure_valid():
+            await _authorize_impl(command_context)
+        else:
+            await command_context.defer()
+        try:
+            report = await asyncio.to_thread(
+                journal.revert,
+                account.api,
+                job_queue,
+                run_id,
+                invoked_by=str(command_context.user.id),
+            )
+        except LookupError:
+            await command_context.respond(
+                f"Nie ma przebiegu o numerze `{run_id}`.",
+                ephemeral=True,
+            )
+            return
+        except googleapiclient.errors.HttpError as e:
+            await command_context.respond(f"Nie udało się cofnąć zmian: `{e}`")
+            return
+        await command_context.respond(report.render())
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import dataclasses
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+_LOGGER = logging.getLogger("redesc.metrics")
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS: dict[str, int] = {
+    "list": 1,
+    "update": 50,
+    "insert": 50,
+    "delete": 50,
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    pairs = (*labels, *extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+@dataclasses.dataclass
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = dataclasses.field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(
+                    (*map(str, histogram.buckets), "+Inf"),
+                    histogram.counts,
+                ):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}",
+                    )
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        with self._lock:
+            counters = ", ".join(
+                f"{name}{_format_labels(labels)}={value:g}"
+                for (name, labels), value in sorted(self.counters.items())
+            )
+            phases = ", ".join(
+                f"{dict(labels).get('phase', name)}: "
+                f"n={histogram.count} avg={histogram.total / histogram.count:.3f}s"
+                for (name, labels), histogram in sorted(self.histograms.items())
+                if histogram.count
+            )
+        return f"counters: {counters or '-'}; phases: {phases or '-'}"
+
+
+registry = Registry()
+
+
+@dataclasses.dataclass
+class Invocation:
+    """Per-command statistics, aggregated across all interactions of a session."""
+
+    command: str
+    api_calls: int = 0
+    quota_units: int = 0
+    retries: int = 0
+    phases: dict[str, float] = dataclasses.field(default_factory=dict)
+    started_at: float = dataclasses.field(default_factory=time.perf_counter)
+    finished: bool = False
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock,
+        repr=False,
+        compare=False,
+    )
+
+    def add_phase(self, phase: str, elapsed: float) -> None:
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def add_api_call(self, quota_units: int) -> None:
+        with self._lock:
+            self.api_calls += 1
+            self.quota_units += quota_units
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def finish(self) -> None:
+        """Report the invocation, once, however many ways it can end in."""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        elapsed = time.perf_counter() - self.started_at
+        registry.observe("redesc_command_seconds", elapsed, command=self.command)
+        registry.inc(
+            "redesc_command_quota_units_total",
+            self.quota_units,
+            command=self.command,
+        )
+        _LOGGER.info(
+            "/%s finished in %.2fs: %d API calls, %d quota units, %d retries; %s",
+            self.command,
+            elapsed,
+            self.api_calls,
+            self.quota_units,
+            self.retries,
+            ", ".join(
+                f"{phase}={seconds:.3f}s"
+                for phase, seconds in sorted(self.phases.items())
+            )
+            or "no phases recorded",
+        )
+
+
+invocation_var: ContextVar[Invocation | None] = ContextVar(
+    "invocation_var",
+    default=None,
+)
+
+
+@contextlib.contextmanager
+def track(invocation: Invocation) -> Iterator[Invocation]:
+    """Attribute everything measured in this block to the given invocation."""
+    token = invocation_var.set(invocation)
+    try:
+        yield invocation
+    finally:
+        invocation_var.reset(token)
+
+
+@contextlib.contextmanager
+def span(phase: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        registry.observe("redesc_phase_seconds", elapsed, phase=phase)
+        invocation = invocation_var.get()
+        if invocation is not None:
+            invocation.add_phase(phase, elapsed)
+        _LOGGER.debug("Phase %s took %.3fs", phase, elapsed)
+
+
+def record_api_call(endpoint: str) -> None:
+    quota_units = QUOTA_COSTS.get(endpoint.rpartition(".")[2], 1)
+    registry.inc("redesc_api_calls_total", endpoint=endpoint)
+    registry.inc("redesc_quota_units_total", quota_units, endpoint=endpoint)
+    invocation = invocation_var.get()
+    if invocation is not None:
+        invocation.add_api_call(quota_units)
+
+
+def record_cache_lookup(endpoint: str, result: str) -> None:
+    """Count a response cache lookup: a hit, a miss, or a call shared in flight."""
+    registry.inc("redesc_api_cache_lookups_total", endpoint=endpoint, result=result)
+
+
+def record_retry(endpoint: str) -> None:
+    registry.inc("redesc_api_retries_total", endpoint=endpoint)
+    invocation = invocation_var.get()
+    if invocation is not None:
+        invocation.add_retry()
+
+
+async def log_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        _LOGGER.info("Metrics: %s", registry.summary())
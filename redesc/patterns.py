@@ -0,0 +1,421 @@
+from __future__ import annotations
+
+import dataclasses
+import functools
+import logging
+import re
+from typing import TYPE_CHECKING, Any, Optional
+
+try:
+    from re import _constants as sre_constants  # type: ignore[attr-defined]
+    from re import _parser as sre_parse  # type: ignore[attr-defined]
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+_LOGGER = logging.getLogger("redesc.patterns")
+
+# Shorter literals hardly narrow anything down.
+MIN_LITERAL_LENGTH: int = 3
+PATTERN_CACHE_SIZE: int = 256
+
+# Risk of a pattern backtracking for a time exponential in the length of the text,
+# e.g. `(a+)+`, and polynomial in it, e.g. `\d+\d+`.
+EXPONENTIAL_RISK: int = 100
+POLYNOMIAL_RISK: int = 10
+NESTED_QUANTIFIERS = "nested quantifiers can match the same text"
+OVERLAPPING_ALTERNATIVES = "repeated alternatives can match the same text"
+ADJACENT_QUANTIFIERS = "adjacent quantifiers can match the same text"
+
+REPEATS = frozenset(
+    op
+    for op in (
+        sre_constants.MAX_REPEAT,
+        sre_constants.MIN_REPEAT,
+        getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+    )
+    if op is not None
+)
+POSSESSIVE_REPEAT = getattr(sre_constants, "POSSESSIVE_REPEAT", None)
+ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_constants.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_constants.CATEGORY_WORD: re.compile(r"\w"),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+# Characters standing for every category when telling if two of them overlap.
+SAMPLE_CHARACTERS = "0aZ_ą \t\n.-"
+# Larger ranges are treated as any character.
+MAX_RANGE: int = 256
+
+# Characters (casefolded) and categories a match can start with, None for any.
+FirstSet = Optional[frozenset[Any]]
+NOTHING: FirstSet = frozenset()
+
+
+class PatternError(ValueError):
+    pass
+
+
+class InvalidExpressionError(PatternError):
+    pass
+
+
+class InvalidReplacementError(PatternError):
+    pass
+
+
+class RiskyPatternError(PatternError):
+    def __init__(self, message: str, risk: Risk) -> None:
+        super().__init__(message)
+        self.risk = risk
+
+
+@dataclasses.dataclass(frozen=True)
+class Literals:
+    """Strings of which at least one occurs in every match of a pattern."""
+
+    alternatives: tuple[str, ...]
+    ignore_case: bool = False
+
+    def search(self, text: str) -> bool:
+        if self.ignore_case:
+            text = text.casefold()
+            return any(literal.casefold() in text for literal in self.alternatives)
+        return any(literal in text for literal in self.alternatives)
+
+
+def _best(candidates: list[list[str]]) -> list[str] | None:
+    usable = [
+        alternatives
+        for alternatives in candidates
+        if min(map(len, alternatives)) >= MIN_LITERAL_LENGTH
+    ]
+    if not usable:
+        return None
+    return max(
+        usable,
+        key=lambda alternatives: (min(map(len, alternatives)), -len(alternatives)),
+    )
+
+
+def _required(pattern: sre_parse.SubPattern, flags: list[int]) -> list[str] | None:
+    candidates: list[list[str]] = []
+    run: list[str] = []
+
+    def end_run() -> None:
+        if run:
+            candidates.append(["".join(run)])
+            run.clear()
+
+    for op, av in pattern:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        end_run()
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, _, subpattern = av
+            flags.append(add_flags)
+            nested = _required(subpattern, flags)
+        elif op is sre_constants.BRANCH:
+            branches = [_required(branch, flags) for branch in av[1]]
+            nested = (
+                None
+                if any(branch is None for branch in branches)
+                else [literal for branch in branches for literal in branch or ()]
+            )
+        elif op in REPEATS and av[0] >= 1:
+            nested = _required(av[2], flags)
+        else:
+            nested = None
+        if nested:
+            candidates.append(nested)
+    end_run()
+    return _best(candidates)
+
+
+def required_literals(expression: str) -> Literals | None:
+    """
+    Return literals of which at least one occurs in every match of the expression.
+
+    Return None if there are none long enough to be worth searching for.
+    """
+    return _literals(expression, sre_parse.parse(expression))
+
+
+def _literals(expression: str, parsed: sre_parse.SubPattern) -> Literals | None:
+    flags = [parsed.state.flags]
+    alternatives = _required(parsed, flags)
+    if alternatives is None:
+        _LOGGER.debug("No required literals in %r", expression)
+        return None
+    return Literals(
+        alternatives=tuple(dict.fromkeys(alternatives)),
+        ignore_case=any(flag & re.IGNORECASE for flag in flags),
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class Risk:
+    """How likely a pattern is to backtrack catastrophically, and why."""
+
+    score: int
+    reasons: tuple[str, ...]
+
+
+def _union(first: FirstSet, second: FirstSet) -> FirstSet:
+    if first is None or second is None:
+        return None
+    return first | second
+
+
+def _matches(atom: Any, character: str) -> bool:
+    if isinstance(atom, str):
+        return atom == character.casefold()
+    return CATEGORIES[atom].match(character) is not None
+
+
+def _overlap(first: FirstSet, second: FirstSet) -> bool:
+    if first is None or second is None:
+        # Any character overlaps with anything but nothing.
+        return first != NOTHING and second != NOTHING
+    return any(
+        _matches(atom, character) and _matches(other, character)
+        for atom in first
+        for other in second
+        for character in (
+            SAMPLE_CHARACTERS
+            + "".join(a for a in (atom, other) if isinstance(a, str))
+        )
+    )
+
+
+def _charset(items: Sequence[tuple[Any, Any]]) -> FirstSet:
+    atoms: set[Any] = set()
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            atoms.add(chr(av).casefold())
+        elif op is sre_constants.RANGE and av[1] - av[0] <= MAX_RANGE:
+            atoms.update(chr(code).casefold() for code in range(av[0], av[1] + 1))
+        elif op is sre_constants.CATEGORY and av in CATEGORIES:
+            atoms.add(av)
+        else:
+            return None
+    return frozenset(atoms)
+
+
+def _nullable(pattern: Sequence[tuple[Any, Any]]) -> bool:
+    """Tell if the pattern can match an empty string."""
+    for op, av in pattern:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+            return False
+        if op in (sre_constants.ANY, sre_constants.IN):
+            return False
+        if op is sre_constants.SUBPATTERN and not _nullable(av[-1]):
+            return False
+        if op is ATOMIC_GROUP and not _nullable(av):
+            return False
+        if op is sre_constants.BRANCH and not any(map(_nullable, av[1])):
+            return False
+        if op in REPEATS and av[0] >= 1 and not _nullable(av[2]):
+            return False
+    return True
+
+
+def _first_of_item(op: Any, av: Any) -> FirstSet:
+    if op is sre_constants.LITERAL:
+        return frozenset((chr(av).casefold(),))
+    if op is sre_constants.IN:
+        return _charset(av)
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return NOTHING
+    if op is sre_constants.SUBPATTERN:
+        return _first(av[-1])
+    if op is ATOMIC_GROUP:
+        return _first(av)
+    if op is sre_constants.BRANCH:
+        first = NOTHING
+        for branch in av[1]:
+            first = _union(first, _first(branch))
+        return first
+    if op in REPEATS:
+        return _first(av[2])
+    return None
+
+
+def _first(pattern: Sequence[tuple[Any, Any]]) -> FirstSet:
+    """Return what a match of the pattern can start with."""
+    first = NOTHING
+    for op, av in pattern:
+        first = _union(first, _first_of_item(op, av))
+        if first is None or not _nullable([(op, av)]):
+            return first
+    return first
+
+
+def _is_unbounded(op: Any, av: Any) -> bool:
+    return (
+        op in REPEATS
+        and op is not POSSESSIVE_REPEAT
+        and av[1] == sre_constants.MAXREPEAT
+    )
+
+
+def _scan_repeat(
+    op: Any,
+    av: Any,
+    rest: Sequence[tuple[Any, Any]],
+    reasons: list[tuple[int, str]],
+    follow: FirstSet,
+    *,
+    in_loop: bool,
+) -> None:
+    body = av[2]
+    body_first = _first(body)
+    if not _is_unbounded(op, av):
+        body_follow = follow
+        if av[1] > 1:
+            body_follow = _union(body_follow, body_first)
+        _scan(body, reasons, body_follow, in_loop=in_loop)
+        return
+    if in_loop and _overlap(body_first, follow):
+        reasons.append((EXPONENTIAL_RISK, NESTED_QUANTIFIERS))
+    for next_op, next_av in rest:
+        if _is_unbounded(next_op, next_av) and _overlap(
+            body_first,
+            _first(next_av[2]),
+        ):
+            reasons.append((POLYNOMIAL_RISK, ADJACENT_QUANTIFIERS))
+        if not _nullable([(next_op, next_av)]):
+            break
+    # What comes after the outermost repeat cannot make it retry more.
+    body_follow = _union(body_first, follow if in_loop else NOTHING)
+    _scan(body, reasons, body_follow, in_loop=True)
+
+
+def _scan_branch(
+    branches: Sequence[Sequence[tuple[Any, Any]]],
+    reasons: list[tuple[int, str]],
+    follow: FirstSet,
+    *,
+    in_loop: bool,
+) -> None:
+    if in_loop:
+        firsts = [
+            _union(_first(branch), follow if _nullable(branch) else NOTHING)
+            for branch in branches
+        ]
+        if any(
+            _overlap(first, other)
+            for position, first in enumerate(firsts)
+            for other in firsts[position + 1 :]
+        ):
+            reasons.append((EXPONENTIAL_RISK, OVERLAPPING_ALTERNATIVES))
+    for branch in branches:
+        _scan(branch, reasons, follow, in_loop=in_loop)
+
+
+def _scan(
+    pattern: Sequence[tuple[Any, Any]],
+    reasons: list[tuple[int, str]],
+    loop_follow: FirstSet,
+    *,
+    in_loop: bool,
+) -> None:
+    """
+    Look for ambiguities that make the backtracking matcher retry too much.
+
+    Inside an unbounded repeat, `loop_follow` is what can come after the
+    pattern before the repeat starts its next iteration, including that
+    iteration itself.
+    """
+    items = list(pattern)
+    for index, (op, av) in enumerate(items):
+        rest = items[index + 1 :]
+        follow = _first(rest)
+        if _nullable(rest):
+            follow = _union(follow, loop_follow)
+        if op in REPEATS and op is not POSSESSIVE_REPEAT:
+            _scan_repeat(op, av, rest, reasons, follow, in_loop=in_loop)
+        elif op is sre_constants.SUBPATTERN:
+            _scan(av[-1], reasons, follow, in_loop=in_loop)
+        elif op is sre_constants.BRANCH:
+            _scan_branch(av[1], reasons, follow, in_loop=in_loop)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _scan(av[1], reasons, NOTHING, in_loop=False)
+        # Atomic groups and possessive repeats never backtrack into themselves.
+
+
+def backtracking_risk(expression: str) -> Risk:
+    """Score how likely the expression is to backtrack catastrophically."""
+    return _risk(sre_parse.parse(expression))
+
+
+def _risk(parsed: sre_parse.SubPattern) -> Risk:
+    reasons: list[tuple[int, str]] = []
+    _scan(parsed, reasons, NOTHING, in_loop=False)
+    return Risk(
+        score=sum(score for score, _ in reasons),
+        reasons=tuple(dict.fromkeys(reason for _, reason in reasons)),
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledPattern:
+    """A validated expression and replacement, ready to be applied."""
+
+    regex: re.Pattern[str]
+    replacement: str
+    risk: Risk
+    literals: Literals | None
+
+    def sub(self, text: str) -> str:
+        return self.regex.sub(self.replacement, text)
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(expression: str, replacement: str = "") -> CompiledPattern:
+    """
+    Compile the expression and check that the replacement fits it.
+
+    Raise InvalidExpressionError or InvalidReplacementError otherwise, before
+    any text is matched, instead of on the first match.
+    """
+    try:
+        regex = re.compile(expression)
+    except re.error as exc:
+        raise InvalidExpressionError(str(exc)) from exc
+    try:
+        sre_parse.parse_template(replacement, regex)
+    except (re.error, IndexError) as exc:  # IndexError for unknown group names
+        raise InvalidReplacementError(str(exc)) from exc
+    parsed = sre_parse.parse(expression)
+    return CompiledPattern(
+        regex=regex,
+        replacement=replacement,
+        risk=_risk(parsed),
+        literals=_literals(expression, parsed),
+    )
+
+
+def check_pattern(
+    expression: str,
+    replacement: str = "",
+    *,
+    max_risk: int,
+) -> CompiledPattern:
+    """Compile the pattern, refusing it if it is too likely to backtrack too much."""
+    pattern = compile_pattern(expression, replacement)
+    if pattern.risk.score > max_risk:
+        msg = (
+            f"Backtracking risk {pattern.risk.score} of {expression!r} exceeds "
+            f"{max_risk}: {'; '.join(pattern.risk.reasons)}"
+        )
+        raise RiskyPatternError(msg, pattern.risk)
+    return pattern
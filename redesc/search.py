@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+import pathlib
+import re
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import os
+    import sqlite3
+    from collections.abc import Iterable, Sequence
+
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.search")
+
+HASHTAG_RE = r"#(\w+)"
+WORD_RE = r"\w+"
+
+# Searches with and without words or hashtags to match and hashtags to exclude,
+# at least one of which is given.
+SEARCH_QUERIES = {
+    (True, False): "SELECT video_id, title FROM video_search "
+    "WHERE video_search MATCH ? ORDER BY rank LIMIT ?",
+    (True, True): "SELECT video_id, title FROM video_search "
+    "WHERE video_search MATCH ? AND rowid NOT IN (SELECT rowid FROM video_search "
+    "WHERE video_search MATCH ?) ORDER BY rank LIMIT ?",
+    (False, True): "SELECT video_id, title FROM video_search "
+    "WHERE rowid NOT IN (SELECT rowid FROM video_search "
+    "WHERE video_search MATCH ?) ORDER BY rowid LIMIT ?",
+}
+
+# Every write to the snapshot marks the video as dirty, so the index catches up
+# lazily, before the next search, without the snapshot knowing about it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_entries (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    lemmas TEXT NOT NULL,
+    hashtags TEXT NOT NULL,
+    tags TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_ids (
+    id INTEGER PRIMARY KEY,
+    video_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS search_dirty (
+    video_id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS video_search USING fts5(
+    video_id UNINDEXED,
+    title,
+    description,
+    lemmas,
+    hashtags,
+    tags,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS videos_search_insert AFTER INSERT ON videos BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (new.video_id);
+END;
+CREATE TRIGGER IF NOT EXISTS videos_search_update AFTER UPDATE ON videos BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (new.video_id);
+END;
+CREATE TRIGGER IF NOT EXISTS videos_search_delete AFTER DELETE ON videos BEGIN
+    INSERT OR IGNORE INTO search_dirty (video_id) VALUES (old.video_id);
+END;
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class SearchResult:
+    video_id: str
+    title: str
+
+    @property
+    def url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+
+def _phrase(word: str) -> str:
+    return '"' + word.replace('"', '""') + '"'
+
+
+def _hashtags_query(hashtags: Iterable[str]) -> str:
+    return " OR ".join(
+        f"hashtags : {_phrase(hashtag.lstrip('#'))}" for hashtag in hashtags
+    )
+
+
+class SearchIndex:
+    """
+    Full-text index over the snapshot of the channel and tags.json.
+
+    Requires the snapshot schema (`redesc.snapshot.SCHEMA`) to be in place.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        tags_path: str | os.PathLike[str] = "tags.json",
+    ) -> None:
+        self.store = store
+        self.tags_path = pathlib.Path(tags_path)
+        self.store.ensure_schema(SCHEMA)
+
+    def _meta(self, key: str) -> str | None:
+        rows = self.store.execute(
+            "SELECT value FROM search_meta WHERE key = ?",
+            (key,),
+        )
+        return rows[0]["value"] if rows else None
+
+    def sync_tags(self, connection: sqlite3.Connection) -> None:
+        """Load tags.json into the database if it has changed since last time."""
+        try:
+            mtime = str(self.tags_path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return
+        if self._meta("tags_mtime") == mtime:
+            return
+        tags: dict[str, dict[str, Any]] = json.loads(self.tags_path.read_text())
+        connection.execute("DELETE FROM tag_entries")
+        connection.executemany(
+            "INSERT INTO tag_entries (video_id, title, lemmas, hashtags, tags) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    video_id,
+                    entry.get("title", ""),
+                    entry.get("lemmas", ""),
+                    " ".join(entry.get("hashtags", ())),
+                    json.dumps(entry.get("tags", [])),
+                )
+                for video_id, entry in tags.items()
+            ),
+        )
+        connection.execute(
+            "INSERT OR IGNORE INTO search_dirty (video_id) "
+            "SELECT video_id FROM tag_entries UNION SELECT video_id FROM search_ids",
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO search_meta (key, value) VALUES ('tags_mtime', ?)",
+            (mtime,),
+        )
+        _LOGGER.info("Loaded %d entries from %s", len(tags), self.tags_path)
+
+    def _reindex(self, connection: sqlite3.Connection, video_id: str) -> None:
+        connection.execute(
+            "INSERT OR IGNORE INTO search_ids (video_id) VALUES (?)",
+            (video_id,),
+        )
+        ((rowid,),) = connection.execute(
+            "SELECT id FROM search_ids WHERE video_id = ?",
+            (video_id,),
+        ).fetchall()
+        connection.execute("DELETE FROM video_search WHERE rowid = ?", (rowid,))
+        video = connection.execute(
+            "SELECT title, description, tags FROM videos WHERE video_id = ?",
+            (video_id,),
+        ).fetchone()
+        entry = connection.execute(
+            "SELECT title, lemmas, hashtags, tags FROM tag_entries WHERE video_id = ?",
+            (video_id,),
+        ).fetchone()
+        if video is None and entry is None:
+            connection.execute("DELETE FROM search_ids WHERE id = ?", (rowid,))
+            return
+        description = video["description"] if video else ""
+        hashtags = dict.fromkeys(
+            [
+                *(entry["hashtags"].split() if entry else ()),
+                *re.findall(HASHTAG_RE, description),
+            ],
+        )
+        connection.execute(
+            "INSERT INTO video_search (rowid, video_id, title, description, lemmas, "
+            "hashtags, tags) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                rowid,
+                video_id,
+                (video or entry)["title"],
+                description,
+                entry["lemmas"] if entry else "",
+                " ".join(hashtags),
+                " ".join(json.loads((video or entry)["tags"])),
+            ),
+        )
+
+    def refresh(self) -> int:
+        """Bring the index up to date. Return the number of reindexed videos."""
+        with self.store.transaction() as connection:
+            if self._meta("built") is None:
+                connection.execute(
+                    "INSERT OR IGNORE INTO search_dirty (video_id) "
+                    "SELECT video_id FROM videos",
+                )
+                connection.execute(
+                    "INSERT INTO search_meta (key, value) VALUES ('built', '1')",
+                )
+            self.sync_tags(connection)
+            dirty = [
+                row["video_id"]
+                for row in connection.execute("SELECT video_id FROM search_dirty")
+            ]
+            for video_id in dirty:
+                self._reindex(connection, video_id)
+            connection.execute("DELETE FROM search_dirty")
+        if dirty:
+            _LOGGER.info("Reindexed %d videos", len(dirty))
+        return len(dirty)
+
+    def search(
+        self,
+        query: str = "",
+        *,
+        hashtags: Sequence[str] = (),
+        without_hashtags: Sequence[str] = (),
+        limit: int = 25,
+    ) -> list[SearchResult]:
+        """
+        Find videos matching all words of the query (as prefixes) and any of
+        the hashtags, but none of the excluded hashtags.
+
+        A query without any words, e.g. only punctuation, matches nothing.
+        """
+        words = re.findall(WORD_RE, query)
+        hashtags = [hashtag for hashtag in hashtags if hashtag.strip("#")]
+        without_hashtags = [
+            hashtag for hashtag in without_hashtags if hashtag.strip("#")
+        ]
+        if (query.strip() and not words) or not (
+            words or hashtags or without_hashtags
+        ):
+            return []
+        self.refresh()
+        match = " AND ".join(
+            filter(
+                None,
+                (
+                    " ".join(_phrase(word) + "*" for word in words),
+                    f"({_hashtags_query(hashtags)})" if hashtags else "",
+                ),
+            ),
+        )
+        excluded = _hashtags_query(without_hashtags) if without_hashtags else None
+        rows = self.store.execute(
+            SEARCH_QUERIES[bool(match), excluded is not None],
+            (*filter(None, (match, excluded)), limit),
+        )
+        return [SearchResult(row["video_id"], row["title"]) for row in rows]
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import itertools
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+from redesc import engine
+from redesc.api import DEFAULT_LIMIT
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable, Hashable, Sequence
+
+    from redesc.accounts import Account
+    from redesc.api import VideoRecord
+    from redesc.snapshot import Snapshot
+
+_LOGGER = logging.getLogger("redesc.sessions")
+
+REAP_INTERVAL = 30
+
+
+class SessionLimitError(Exception):
+    """Raised when a user or the whole bot has too many sessions open."""
+
+
+@dataclasses.dataclass
+class Session:
+    id: int
+    user_id: int
+    command: str
+    created_at: float = dataclasses.field(default_factory=time.monotonic)
+    last_active: float = dataclasses.field(default_factory=time.monotonic)
+    closed: bool = False
+    _closers: list[Callable[[], Any]] = dataclasses.field(
+        default_factory=list,
+        repr=False,
+    )
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def on_close(self, closer: Callable[[], Any]) -> None:
+        """Call `closer` when the session ends; coroutines are awaited."""
+        self._closers.append(closer)
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for closer in reversed(self._closers):
+            try:
+                result = closer()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:  # noqa: PERF203
+                _LOGGER.exception("Failed to clean up after session %d", self.id)
+        self._closers.clear()
+
+
+class SharedScan:
+    """
+    A playlist fetch that any number of sessions can follow at the same time.
+
+    Sessions that join late get the pages fetched so far first. The fetch
+    is cancelled once nobody follows it anymore.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], AsyncIterator[list[VideoRecord]]],
+        on_finished: Callable[[SharedScan], None],
+    ) -> None:
+        self._fetch = fetch
+        self._on_finished = on_finished
+        self.pages: list[list[VideoRecord]] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.followers = 0
+        self._condition = asyncio.Condition()
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        try:
+            async for page in self._fetch():
+                self.pages.append(page)
+                async with self._condition:
+                    self._condition.notify_all()
+        except Exception as exc:  # noqa: BLE001
+            self.error = exc
+        finally:
+            self.done = True
+            self._on_finished(self)
+            async with self._condition:
+                self._condition.notify_all()
+
+    def _has_page(self, index: int) -> bool:
+        """Whether the page is there or it will never be."""
+        return index < len(self.pages) or self.done
+
+    async def follow(self) -> AsyncIterator[list[VideoRecord]]:
+        self.followers += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            for index in itertools.count():
+                async with self._condition:
+                    await self._condition.wait_for(
+                        functools.partial(self._has_page, index),
+                    )
+                if index < len(self.pages):
+                    yield self.pages[index]
+                    continue
+                if self.error is not None:
+                    raise self.error
+                return
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done:
+                self._task.cancel()
+                self._on_finished(self)
+
+
+class SessionRegistry:
+    """Active interactive sessions and the playlist fetches they share."""
+
+    def __init__(
+        self,
+        *,
+        max_per_user: int = 1,
+        max_total: int = 3,
+        idle_timeout: float = 900,
+    ) -> None:
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.sessions: dict[int, Session] = {}
+        self.scans: dict[Hashable, SharedScan] = {}
+        self._ids = itertools.count(1)
+
+    def open(self, user_id: int, command: str) -> Session:
+        if len(self.sessions) >= self.max_total:
+            msg = f"Too many sessions open ({len(self.sessions)})"
+            raise SessionLimitError(msg)
+        own = sum(session.user_id == user_id for session in self.sessions.values())
+        if own >= self.max_per_user:
+            msg = f"User {user_id} has too many sessions open ({own})"
+            raise SessionLimitError(msg)
+        session = Session(next(self._ids), user_id, command)
+        self.sessions[session.id] = session
+        _LOGGER.info("Opened session %d of /%s for %s", session.id, command, user_id)
+        return session
+
+    async def close(self, session: Session) -> None:
+        if self.sessions.pop(session.id, None) is not None:
+            _LOGGER.info("Closed session %d", session.id)
+        await session.close()
+
+    def scan(
+        self,
+        key: Hashable,
+        fetch: Callable[[], AsyncIterator[list[VideoRecord]]],
+    ) -> AsyncIterator[list[VideoRecord]]:
+        """Follow the fetch in flight for the key, or start a new one."""
+        scan = self.scans.get(key)
+        if scan is None:
+
+            def finished(scan: SharedScan) -> None:
+                if self.scans.get(key) is scan:
+                    del self.scans[key]
+
+            scan = self.scans[key] = SharedScan(fetch, finished)
+        else:
+            _LOGGER.info("Joining the fetch in flight for %s", key)
+        return scan.follow()
+
+    def playlist_pages(
+        self,
+        account: Account,
+        playlist_ids: Sequence[str],
+        snapshot: Snapshot | None = None,
+    ) -> AsyncIterator[list[VideoRecord]]:
+        """
+        Videos of the playlists, fetched once for everyone who needs them.
+
+        Fetches are shared only within an account, as each one fetches with
+        its own client and quota.
+        """
+        return self.scan(
+            ("playlists", account.name, tuple(sorted(playlist_ids))),
+            lambda: engine.iter_videos(
+                account.api,
+                playlist_ids,
+                limit=DEFAULT_LIMIT,
+                snapshot=snapshot,
+            ),
+        )
+
+    async def reap(self) -> None:
+        """Close sessions idle for longer than the timeout, forever."""
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            deadline = time.monotonic() - self.idle_timeout
+            for session in list(self.sessions.values()):
+                if session.last_active < deadline:
+                    _LOGGER.info("Session %d timed out", session.id)
+                    with contextlib.suppress(Exception):
+                        await self.close(session)
@@ -1,30 +1,100 @@
 from __future__ import annotations
 
 import datetime
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 from configzen import ConfigField, ConfigMeta, ConfigModel, field_validator
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
+from pydantic import BaseModel
 
+from redesc.accounts import DEFAULT_ACCOUNT, Account, AccountRegistry
 from redesc.api import YouTubeAPI
 from redesc.common import (
+    accounts,
+    accounts_var,
     app_config,
     app_config_var,
+    credential_manager,
+    credential_manager_var,
+    job_queue_var,
+    journal_var,
     running_app,
+    search_index_var,
+    sessions_var,
+    shard_store_var,
+    snapshot_var,
+    store,
+    store_var,
+    youtube_api,
     youtube_api_var,
+    youtube_oauth2,
     youtube_oauth2_var,
 )
+from redesc.credentials import CredentialManager
+from redesc.jobs import JobQueue
+from redesc.journal import Journal
+from redesc.search import SearchIndex
+from redesc.sessions import SessionRegistry
+from redesc.shards import ShardStore
+from redesc.snapshot import Snapshot
+from redesc.store import Store
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 load_dotenv()
 
 
+class StandingRule(BaseModel):
+    """A substitution applied automatically to every new upload."""
+
+    name: str
+    expression: str
+    replacement: str
+    titles: bool = False
+    descriptions: bool = True
+
+
+class AccountConfig(BaseModel):
+    """Another YouTube channel managed by the same bot."""
+
+    name: str
+    default_playlist_id: str
+    # The same as of the main account, if not given.
+    youtube_api_key: Optional[str] = None  # noqa: UP007
+    oauth2_file: Optional[str] = None  # noqa: UP007
+    worker_quota_budget: int = 8000
+
+    @property
+    def oauth2_path(self) -> str:
+        return self.oauth2_file or f"oauth2-{self.name}.json"
+
+
 class AppConfig(ConfigModel):
     """App config model."""
 
     default_playlist_id: str
     youtube_api_key: str
     permitted_discord_channel_id: int
+    metrics_log_interval: int = 300
+    database_path: str = "redesc.db"
+    standing_rules: list[StandingRule] = []  # noqa: RUF012
+    standing_rules_interval: int = 900
+    standing_rules_max_updates: int = 10
+    max_sessions: int = 3
+    max_sessions_per_user: int = 1
+    session_idle_timeout: int = 900
+    api_cache_ttl: int = 60
+    api_cache_size: int = 512
+    diff_context: int = 40
+    # Patterns scoring more are refused, see redesc.patterns.backtracking_risk.
+    max_pattern_risk: int = 50
+    control_api_host: str = "127.0.0.1"
+    control_api_port: int = 0
+    control_api_token: Optional[str] = ConfigField(None, exclude=True)  # noqa: UP007
+    worker_shard_size: int = 200
+    worker_quota_budget: int = 8000
+    accounts: list[AccountConfig] = []  # noqa: RUF012
     token: str = ConfigField(exclude=True)
 
     class Config(ConfigMeta):
@@ -45,6 +115,8 @@ class YouTubeOAuth2(ConfigModel):
     scopes: list[str] = ["https://www.googleapis.com/auth/youtube.force-ssl"]  # noqa: RUF012
 
     def get_credentials(self) -> Credentials:
+        from google.oauth2.credentials import Credentials
+
         return Credentials(
             token=self.token,
             refresh_token=self.refresh_token,
@@ -52,13 +124,14 @@ class YouTubeOAuth2(ConfigModel):
             client_id=self.client_id,
             client_secret=self.client_secret,
             scopes=self.scopes,
+            expiry=self.expiry,
         )
 
     @property
     def valid(self) -> bool:
         if self.expiry is None:
             return False
-        return self.expiry > datetime.datetime.utcnow() and self.get_credentials().valid
+        return self.expiry > datetime.datetime.utcnow() and self.token is not None
 
     @field_validator("expiry")
     def _normalize_expiry_datetime(
@@ -75,8 +148,63 @@ class YouTubeOAuth2(ConfigModel):
         extra = "allow"  # type: ignore[assignment]
 
 
+def load_account(config: AccountConfig) -> Account:
+    oauth2 = YouTubeOAuth2.load(config.oauth2_path)
+    credentials = CredentialManager(oauth2)
+    return Account(
+        name=config.name,
+        default_playlist_id=config.default_playlist_id,
+        api=YouTubeAPI(
+            api_key=config.youtube_api_key or app_config.youtube_api_key,
+            credential_manager=credentials,
+            cache_ttl=app_config.api_cache_ttl,
+            cache_size=app_config.api_cache_size,
+        ),
+        credentials=credentials,
+        oauth2=oauth2,
+        quota_budget=config.worker_quota_budget,
+    )
+
+
 if running_app:
     app_config_var.set(AppConfig.load())
-    youtube_api_var.set(YouTubeAPI(api_key=app_config.youtube_api_key))
-
-youtube_oauth2_var.set(YouTubeOAuth2.load())
+    youtube_oauth2_var.set(YouTubeOAuth2.load())
+    credential_manager_var.set(CredentialManager(youtube_oauth2))
+    youtube_api_var.set(
+        YouTubeAPI(
+            api_key=app_config.youtube_api_key,
+            credential_manager=credential_manager,
+            cache_ttl=app_config.api_cache_ttl,
+            cache_size=app_config.api_cache_size,
+        ),
+    )
+    # Commands switch between them by activating one in their own context.
+    accounts_var.set(
+        AccountRegistry(
+            [
+                Account(
+                    name=DEFAULT_ACCOUNT,
+                    default_playlist_id=app_config.default_playlist_id,
+                    api=youtube_api,
+                    credentials=credential_manager,
+                    oauth2=youtube_oauth2,
+                    quota_budget=app_config.worker_quota_budget,
+                ),
+                *map(load_account, app_config.accounts),
+            ],
+        ),
+    )
+    accounts.get().activate()
+    store_var.set(Store(app_config.database_path))
+    job_queue_var.set(JobQueue(store))
+    journal_var.set(Journal(store))
+    snapshot_var.set(Snapshot(store))
+    search_index_var.set(SearchIndex(store))
+    shard_store_var.set(ShardStore(store, budgets=accounts.quota_budgets))
+    sessions_var.set(
+        SessionRegistry(
+            max_per_user=app_config.max_sessions_per_user,
+            max_total=app_config.max_sessions,
+            idle_timeout=app_config.session_idle_timeout,
+        ),
+    )
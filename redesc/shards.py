@@ -0,0 +1,555 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import datetime
+import itertools
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+import googleapiclient.errors
+
+from redesc import engine, metrics, tagging
+from redesc.accounts import DEFAULT_ACCOUNT
+from redesc.api import (
+    DEFAULT_LIMIT,
+    MAX_IDS_PER_REQUEST,
+    VideoRecord,
+    is_quota_exceeded,
+)
+from redesc.jobs import QUOTA_TIMEZONE, Rule, next_quota_reset
+from redesc.journal import JournalRun
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Awaitable, Callable, Iterable, Mapping, Sequence
+
+    from redesc.api import YouTubeAPI
+    from redesc.engine import VideoDiff
+    from redesc.journal import Journal
+    from redesc.snapshot import Snapshot
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.shards")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    expression TEXT,
+    replacement TEXT,
+    with_title INTEGER NOT NULL DEFAULT 1,
+    with_description INTEGER NOT NULL DEFAULT 1,
+    mode TEXT,
+    remove TEXT NOT NULL DEFAULT '[]',
+    generate INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    invoked_by TEXT,
+    journal_run_id INTEGER,
+    account TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    reported INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES shard_runs (id),
+    video_ids TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    not_before REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    matched INTEGER NOT NULL DEFAULT 0,
+    applied INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shards_state ON shards (state, not_before, id);
+CREATE INDEX IF NOT EXISTS shards_run ON shards (run_id, state);
+CREATE TABLE IF NOT EXISTS quota_usage (
+    account TEXT NOT NULL,
+    day TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    PRIMARY KEY (account, day)
+) WITHOUT ROWID;
+"""
+
+SUBSTITUTE = "podmien"
+TAGS = "dodajtagi"
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_SHARD_SIZE = 200
+# Shards claimed longer ago are given to another worker, as theirs has likely died.
+DEFAULT_LEASE = 900
+# The default daily quota of a project is 10000 units, leave some to the bot.
+DEFAULT_DAILY_QUOTA = 8000
+REPORT_INTERVAL = 30
+REPORT_LIMIT = 2000
+
+
+def quota_day(now: datetime.datetime | None = None) -> str:
+    """The day the YouTube API quota is counted for, in its own timezone."""
+    if now is None:
+        now = datetime.datetime.now(tz=QUOTA_TIMEZONE)
+    return now.astimezone(QUOTA_TIMEZONE).date().isoformat()
+
+
+@dataclasses.dataclass
+class ShardRun:
+    """A substitution or tag change split between worker processes."""
+
+    id: int
+    kind: str
+    rule: Rule | None = None
+    mode: str | None = None
+    remove: list[str] = dataclasses.field(default_factory=list)
+    generate: bool = False
+    summary: str = ""
+    invoked_by: str | None = None
+    journal_run_id: int | None = None
+    account: str = DEFAULT_ACCOUNT
+
+    def diff(
+        self,
+        record: VideoRecord,
+        entries: Mapping[str, Mapping[str, Any]] | None = None,
+        model: tagging.TagModel | None = None,
+    ) -> VideoDiff | None:
+        if self.rule is not None:
+            return engine.diff_from_record(record, self.rule)
+        new_tags = tagging.planned_tags(
+            record,
+            entries or {},
+            self.mode or tagging.FILL_EMPTY,
+            model=model,
+            remove=self.remove,
+        )
+        if new_tags is None:
+            return None
+        return engine.VideoDiff(
+            record=record,
+            new_title=record.title,
+            new_description=record.description,
+            tags=new_tags,
+        )
+
+
+@dataclasses.dataclass
+class Shard:
+    id: int
+    run: ShardRun
+    video_ids: list[str]
+
+
+@dataclasses.dataclass
+class ShardResult:
+    matched: int = 0
+    applied: int = 0
+    failed: int = 0
+    # Videos not processed because the quota has run out.
+    left: list[str] = dataclasses.field(default_factory=list)
+    error: str | None = None
+
+
+@dataclasses.dataclass
+class RunProgress:
+    run_id: int
+    kind: str
+    summary: str
+    account: str = DEFAULT_ACCOUNT
+    shards: int = 0
+    pending: int = 0
+    failed_shards: int = 0
+    matched: int = 0
+    applied: int = 0
+    failed: int = 0
+    errors: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return not self.pending
+
+    def render(self) -> str:
+        lines = [
+            f"Zakończono rozproszony przebieg `{self.run_id}` (/{self.kind} "
+            f"{self.summary}"
+            + (f", kanał {self.account}" if self.account != DEFAULT_ACCOUNT else "")
+            + ").",
+            f"Pasujące filmy: **{self.matched}**, zmienione: **{self.applied}**"
+            + (f", nieudane: **{self.failed}**" if self.failed else "")
+            + ".",
+        ]
+        if self.failed_shards:
+            lines.append(f"Części zakończone błędem: **{self.failed_shards}**.")
+        lines.extend(f"- `{error}`" for error in self.errors)
+        content = ""
+        for index, line in enumerate(lines):
+            more = f"…i {len(lines) - index} więcej."
+            if len(content) + len(line) + len(more) + 2 > REPORT_LIMIT:
+                content += more
+                break
+            content += line + "\n"
+        return content
+
+
+def _run(row: sqlite3.Row) -> ShardRun:
+    return ShardRun(
+        id=row["id"],
+        kind=row["kind"],
+        rule=(
+            None
+            if row["expression"] is None
+            else Rule(
+                expression=row["expression"],
+                replacement=row["replacement"],
+                with_title=bool(row["with_title"]),
+                with_description=bool(row["with_description"]),
+            )
+        ),
+        mode=row["mode"],
+        remove=json.loads(row["remove"]),
+        generate=bool(row["generate"]),
+        summary=row["summary"],
+        invoked_by=row["invoked_by"],
+        journal_run_id=row["journal_run_id"],
+        account=row["account"],
+    )
+
+
+class ShardStore:
+    """
+    Runs split into shards of video IDs, claimed by worker processes.
+
+    The database is shared by the bot and the workers, which also count the
+    quota they use in it, so that together they stay within the daily budget
+    of every account.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        *,
+        daily_quota: int = DEFAULT_DAILY_QUOTA,
+        budgets: Mapping[str, int] | None = None,
+        lease: float = DEFAULT_LEASE,
+    ) -> None:
+        self.store = store
+        self.daily_quota = daily_quota
+        self.budgets = dict(budgets or {})
+        self.lease = lease
+        self.store.ensure_schema(SCHEMA)
+
+    def create_run(
+        self,
+        kind: str,
+        video_ids: Sequence[str],
+        *,
+        rule: Rule | None = None,
+        mode: str | None = None,
+        remove: Sequence[str] = (),
+        generate: bool = False,
+        summary: str = "",
+        invoked_by: str | None = None,
+        journal_run_id: int | None = None,
+        account: str = DEFAULT_ACCOUNT,
+        shard_size: int = DEFAULT_SHARD_SIZE,
+    ) -> int:
+        with self.store.transaction() as connection:
+            run_id = connection.execute(
+                "INSERT INTO shard_runs (kind, expression, replacement, with_title, "
+                "with_description, mode, remove, generate, summary, invoked_by, "
+                "journal_run_id, account, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    kind,
+                    None if rule is None else rule.expression,
+                    None if rule is None else rule.replacement,
+                    rule is None or rule.with_title,
+                    rule is None or rule.with_description,
+                    mode,
+                    json.dumps(list(remove)),
+                    generate,
+                    summary,
+                    invoked_by,
+                    journal_run_id,
+                    account,
+                    time.time(),
+                ),
+            ).lastrowid
+            if run_id is None:
+                msg = "The run was not inserted"
+                raise RuntimeError(msg)
+            connection.executemany(
+                "INSERT INTO shards (run_id, video_ids) VALUES (?, ?)",
+                [
+                    (run_id, json.dumps(list(video_ids[start : start + shard_size])))
+                    for start in range(0, len(video_ids), shard_size)
+                ],
+            )
+        _LOGGER.info(
+            "Created run %d of %d videos in shards of %d",
+            run_id,
+            len(video_ids),
+            shard_size,
+        )
+        return run_id
+
+    def claim(self, worker: str) -> Shard | None:
+        """Take the oldest shard that is due, if any."""
+        now = time.time()
+        with self.store.transaction() as connection:
+            row = connection.execute(
+                "SELECT * FROM shards WHERE (state = ? AND not_before <= ?) "
+                "OR (state = ? AND claimed_at < ?) ORDER BY id LIMIT 1",
+                (PENDING, now, CLAIMED, now - self.lease),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["state"] == CLAIMED:
+                _LOGGER.warning(
+                    "Shard %d claimed by %s has expired",
+                    row["id"],
+                    row["worker"],
+                )
+            connection.execute(
+                "UPDATE shards SET state = ?, worker = ?, claimed_at = ? WHERE id = ?",
+                (CLAIMED, worker, now, row["id"]),
+            )
+            run = connection.execute(
+                "SELECT * FROM shard_runs WHERE id = ?",
+                (row["run_id"],),
+            ).fetchone()
+        return Shard(row["id"], _run(run), json.loads(row["video_ids"]))
+
+    def release(self, shard: Shard, delay: float = 0) -> None:
+        """Give the shard back, to be claimed again after the delay."""
+        self.store.execute(
+            "UPDATE shards SET state = ?, worker = NULL, not_before = ? WHERE id = ?",
+            (PENDING, time.time() + delay, shard.id),
+        )
+
+    def finish(self, shard: Shard, result: ShardResult) -> None:
+        """
+        Save the result of a shard.
+
+        Videos left because of the quota go to a new shard, due after
+        the quota resets.
+        """
+        with self.store.transaction() as connection:
+            connection.execute(
+                "UPDATE shards SET state = ?, matched = ?, applied = ?, failed = ?, "
+                "error = ? WHERE id = ?",
+                (
+                    DONE if result.error is None else FAILED,
+                    result.matched,
+                    result.applied,
+                    result.failed,
+                    result.error,
+                    shard.id,
+                ),
+            )
+            if result.left:
+                connection.execute(
+                    "INSERT INTO shards (run_id, video_ids, not_before) "
+                    "VALUES (?, ?, ?)",
+                    (
+                        shard.run.id,
+                        json.dumps(result.left),
+                        next_quota_reset().timestamp(),
+                    ),
+                )
+
+    def budget(self, account: str = DEFAULT_ACCOUNT) -> int:
+        return self.budgets.get(account, self.daily_quota)
+
+    def reserve_quota(self, units: int, account: str = DEFAULT_ACCOUNT) -> bool:
+        """Count units against today's budget, unless that would exceed it."""
+        day = quota_day()
+        with self.store.transaction() as connection:
+            row = connection.execute(
+                "SELECT units FROM quota_usage WHERE account = ? AND day = ?",
+                (account, day),
+            ).fetchone()
+            if (0 if row is None else row["units"]) + units > self.budget(account):
+                return False
+            connection.execute(
+                "INSERT INTO quota_usage (account, day, units) VALUES (?, ?, ?) "
+                "ON CONFLICT (account, day) DO UPDATE "
+                "SET units = units + excluded.units",
+                (account, day, units),
+            )
+        return True
+
+    def exhaust_quota(self, account: str = DEFAULT_ACCOUNT) -> None:
+        """Use up today's budget, when the API itself says the quota is gone."""
+        self.store.execute(
+            "INSERT INTO quota_usage (account, day, units) VALUES (?, ?, ?) "
+            "ON CONFLICT (account, day) DO UPDATE "
+            "SET units = MAX(units, excluded.units)",
+            (account, quota_day(), self.budget(account)),
+        )
+
+    def quota_used(self, account: str = DEFAULT_ACCOUNT) -> int:
+        rows = self.store.execute(
+            "SELECT units FROM quota_usage WHERE account = ? AND day = ?",
+            (account, quota_day()),
+        )
+        return int(rows[0]["units"]) if rows else 0
+
+    def progress(self, run_id: int) -> RunProgress:
+        (run,) = self.store.execute("SELECT * FROM shard_runs WHERE id = ?", (run_id,))
+        rows = self.store.execute(
+            "SELECT state, matched, applied, failed, error FROM shards "
+            "WHERE run_id = ?",
+            (run_id,),
+        )
+        progress = RunProgress(
+            run_id,
+            run["kind"],
+            run["summary"],
+            run["account"],
+            shards=len(rows),
+        )
+        for row in rows:
+            progress.pending += row["state"] in (PENDING, CLAIMED)
+            progress.failed_shards += row["state"] == FAILED
+            progress.matched += row["matched"]
+            progress.applied += row["applied"]
+            progress.failed += row["failed"]
+            if row["error"] is not None:
+                progress.errors.append(row["error"])
+        return progress
+
+    def take_finished(self) -> list[RunProgress]:
+        """Return the runs that have finished since the last call."""
+        finished = []
+        for row in self.store.execute(
+            "SELECT id FROM shard_runs WHERE NOT reported ORDER BY id",
+        ):
+            progress = self.progress(row["id"])
+            if progress.finished:
+                self.store.execute(
+                    "UPDATE shard_runs SET reported = 1 WHERE id = ?",
+                    (row["id"],),
+                )
+                finished.append(progress)
+        return finished
+
+
+def collect_video_ids(
+    api: YouTubeAPI,
+    playlist_ids: Iterable[str],
+    snapshot: Snapshot | None = None,
+) -> list[str]:
+    """List the videos of the playlists, each once. Blocking, cheap on quota."""
+    video_ids: dict[str, None] = {}
+    for playlist_id in dict.fromkeys(playlist_ids):
+        collected = [
+            video_id
+            for page in api.iter_playlist_video_ids(
+                playlist_id,
+                limit=DEFAULT_LIMIT,
+            )
+            for video_id in page
+        ]
+        if snapshot is not None:
+            snapshot.save_playlist(playlist_id, collected)
+        video_ids.update(dict.fromkeys(collected))
+    return list(video_ids)
+
+
+def process(  # noqa: C901
+    shard: Shard,
+    api: YouTubeAPI,
+    shard_store: ShardStore,
+    *,
+    journal: Journal | None = None,
+    snapshot: Snapshot | None = None,
+    entries: Mapping[str, Mapping[str, Any]] | None = None,
+    model: tagging.TagModel | None = None,
+) -> ShardResult:
+    """
+    Apply the run to the videos of a shard. Blocking.
+
+    Pass the API client of the account of the run.
+
+    Diffs are computed from freshly fetched videos, so a shard processed
+    again after its worker died skips what has already been applied.
+    """
+    result = ShardResult()
+    account = shard.run.account
+    run = JournalRun(
+        shard.run.kind,
+        shard.run.invoked_by,
+        shard.run.summary,
+        id=shard.run.journal_run_id,
+        account=account,
+    )
+    video_ids = iter(shard.video_ids)
+    while chunk := list(itertools.islice(video_ids, MAX_IDS_PER_REQUEST)):
+        # Videos of the chunk not done yet, given back when the quota runs out.
+        pending = chunk
+        try:
+            if not shard_store.reserve_quota(metrics.QUOTA_COSTS["list"], account):
+                result.left = [*pending, *video_ids]
+                return result
+            records = api.get_videos(chunk, fresh=True)
+            if snapshot is not None:
+                snapshot.save(records)
+            for index, record in enumerate(records):
+                pending = [record.video_id for record in records[index:]]
+                with metrics.span("diff"):
+                    diff = shard.run.diff(record, entries, model)
+                if diff is None:
+                    continue
+                units = metrics.QUOTA_COSTS["update"]
+                if not shard_store.reserve_quota(units, account):
+                    result.left = [*pending, *video_ids]
+                    return result
+                try:
+                    with metrics.span("update"):
+                        updated = api.update_video_description(
+                            video_id=diff.video_id,
+                            video_title=diff.new_title,
+                            video_category_id=diff.video_category_id,
+                            description=diff.new_description,
+                            tags=diff.tags,
+                        )
+                except googleapiclient.errors.HttpError as exc:
+                    if is_quota_exceeded(exc):
+                        raise
+                    _LOGGER.exception("Failed to update %s", diff.video_id)
+                    result.matched += 1
+                    result.failed += 1
+                    continue
+                result.matched += 1
+                new_record = VideoRecord.from_resource(updated)
+                if snapshot is not None:
+                    snapshot.save([new_record])
+                if journal is not None:
+                    journal.record(run, record, new_record)
+                result.applied += 1
+        except googleapiclient.errors.HttpError as exc:
+            if not is_quota_exceeded(exc):
+                raise
+            shard_store.exhaust_quota(account)
+            result.left = [*pending, *video_ids]
+            return result
+    return result
+
+
+async def report_finished(
+    shard_store: ShardStore,
+    notify: Callable[[str], Awaitable[object]],
+    interval: float = REPORT_INTERVAL,
+) -> None:
+    """Tell the channel about runs finished by the workers, forever."""
+    while True:
+        for progress in await asyncio.to_thread(shard_store.take_finished):
+            await notify(progress.render())
+        await asyncio.sleep(interval)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from redesc.api import VideoRecord
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Iterable, Iterator, Sequence
+
+    from redesc.patterns import Literals
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.snapshot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    category_id TEXT,
+    etag TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlist_videos (
+    playlist_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, video_id)
+) WITHOUT ROWID;
+"""
+
+
+def _record(row: sqlite3.Row) -> VideoRecord:
+    return VideoRecord(
+        video_id=row["video_id"],
+        title=row["title"],
+        description=row["description"],
+        tags=tuple(json.loads(row["tags"])),
+        category_id=row["category_id"],
+        etag=row["etag"],
+    )
+
+
+class Snapshot:
+    """
+    Local copy of the channel's videos, as of the last time they were fetched.
+
+    It is never used to edit videos, only to tell which ones are worth fetching.
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+        self.store.ensure_schema(SCHEMA)
+
+    def save(self, records: Iterable[VideoRecord]) -> None:
+        fetched_at = time.time()
+        with self.store.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO videos (video_id, title, description, tags, "
+                "category_id, etag, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        record.video_id,
+                        record.title,
+                        record.description,
+                        json.dumps(record.tags),
+                        record.category_id,
+                        record.etag,
+                        fetched_at,
+                    )
+                    for record in records
+                ),
+            )
+
+    def save_playlist(self, playlist_id: str, video_ids: Iterable[str]) -> None:
+        """Replace the remembered contents of a playlist after a complete scan."""
+        with self.store.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO playlists (playlist_id, scanned_at) "
+                "VALUES (?, ?)",
+                (playlist_id, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM playlist_videos WHERE playlist_id = ?",
+                (playlist_id,),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO playlist_videos (playlist_id, video_id) "
+                "VALUES (?, ?)",
+                ((playlist_id, video_id) for video_id in video_ids),
+            )
+
+    def scanned_at(self, playlist_ids: Sequence[str]) -> float | None:
+        """
+        Return when the least recently scanned of the playlists was scanned.
+
+        Return None if any of them has never been scanned.
+        """
+        rows = self.store.execute(
+            # IDs are passed as a single JSON array, however many there are.
+            "SELECT scanned_at FROM playlists WHERE playlist_id IN "
+            "(SELECT value FROM json_each(?))",
+            (json.dumps(list(playlist_ids)),),
+        )
+        if not playlist_ids or len(rows) < len(set(playlist_ids)):
+            return None
+        return min(float(row["scanned_at"]) for row in rows)
+
+    def get(self, video_ids: Iterable[str]) -> list[VideoRecord]:
+        rows = self.store.execute(
+            "SELECT * FROM videos WHERE video_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(video_ids)),),
+        )
+        return list(map(_record, rows))
+
+    def iter_records(self, batch_size: int = 500) -> Iterator[VideoRecord]:
+        """Yield all remembered videos, fetching a batch of rows at a time."""
+        last_video_id = ""
+        while rows := self.store.execute(
+            "SELECT * FROM videos WHERE video_id > ? ORDER BY video_id LIMIT ?",
+            (last_video_id, batch_size),
+        ):
+            yield from map(_record, rows)
+            last_video_id = rows[-1]["video_id"]
+
+    def playlist_records(self, playlist_ids: Sequence[str]) -> list[VideoRecord]:
+        """Return the remembered videos of the playlists, each video once."""
+        rows = self.store.execute(
+            "SELECT * FROM videos WHERE video_id IN (SELECT video_id FROM "
+            "playlist_videos WHERE playlist_id IN (SELECT value FROM json_each(?)))",
+            (json.dumps(list(playlist_ids)),),
+        )
+        return list(map(_record, rows))
+
+    def candidates(
+        self,
+        playlist_ids: Sequence[str],
+        literals: Literals,
+        *,
+        with_title: bool = True,
+        with_description: bool = True,
+    ) -> list[str] | None:
+        """
+        Return IDs of the playlists' videos that contain any of the literals.
+
+        Return None if the playlists are not in the snapshot yet.
+        """
+        if self.scanned_at(playlist_ids) is None:
+            return None
+        rows = self.store.execute(
+            "SELECT DISTINCT v.video_id, v.title, v.description FROM videos v "
+            "JOIN playlist_videos p ON p.video_id = v.video_id "
+            "WHERE p.playlist_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(playlist_ids)),),
+        )
+        video_ids = [
+            row["video_id"]
+            for row in rows
+            if (with_title and literals.search(row["title"]))
+            or (with_description and literals.search(row["description"]))
+        ]
+        _LOGGER.info(
+            "%d of %d snapshot videos contain any of %r",
+            len(video_ids),
+            len(rows),
+            literals.alternatives,
+        )
+        return video_ids
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import time
+from typing import TYPE_CHECKING
+
+import googleapiclient.errors
+
+from redesc import engine, metrics, patterns
+from redesc.api import VideoRecord, is_quota_exceeded
+from redesc.journal import JournalRun
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Sequence
+
+    from redesc.api import YouTubeAPI
+    from redesc.jobs import Rule
+    from redesc.journal import Journal
+    from redesc.snapshot import Snapshot
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.standing")
+
+# Videos are checked once per set of rules, so changing the rules in the config
+# makes the newest videos get checked against them again.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS standing_checked (
+    video_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (video_id, fingerprint)
+) WITHOUT ROWID;
+"""
+
+DIGEST_LIMIT = 2000
+
+
+@dataclasses.dataclass
+class CycleReport:
+    applied: list[tuple[VideoRecord, list[str]]] = dataclasses.field(
+        default_factory=list,
+    )
+    failed: list[tuple[str, str]] = dataclasses.field(default_factory=list)
+    deferred: int = 0
+    quota_exceeded: bool = False
+
+    def render(self) -> str | None:
+        """Render the digest message, or return None if there is nothing to say."""
+        if not (self.applied or self.failed or self.quota_exceeded):
+            return None
+        lines = [f"Reguły stałe: zaktualizowano nowe filmy: **{len(self.applied)}**."]
+        lines.extend(
+            f"- [{record.title}](<https://www.youtube.com/watch?v={record.video_id}>)"
+            f": {', '.join(names)}"
+            for record, names in self.applied
+        )
+        lines.extend(
+            f"- Nie udało się zaktualizować filmu `{video_id}`: `{error}`"
+            for video_id, error in self.failed
+        )
+        if self.deferred:
+            lines.append(f"Odłożono do następnego sprawdzenia: **{self.deferred}**.")
+        if self.quota_exceeded:
+            lines.append("Wyczerpano limit API.")
+        content = ""
+        for index, line in enumerate(lines):
+            more = f"…i {len(lines) - index} więcej."
+            if len(content) + len(line) + len(more) + 2 > DIGEST_LIMIT:
+                content += more
+                break
+            content += line + "\n"
+        return content
+
+
+class StandingRules:
+    """Substitutions applied to every new upload, without anyone asking."""
+
+    def __init__(
+        self,
+        store: Store,
+        api: YouTubeAPI,
+        rules: Sequence[tuple[str, Rule]],
+        playlist_id: str,
+        *,
+        max_updates: int = 10,
+        snapshot: Snapshot | None = None,
+        journal: Journal | None = None,
+    ) -> None:
+        self.store = store
+        self.api = api
+        self.rules = rules
+        self.playlist_id = playlist_id
+        self.max_updates = max_updates
+        self.snapshot = snapshot
+        self.journal = journal
+        self.fingerprint = hashlib.blake2b(
+            json.dumps(
+                [[name, *dataclasses.astuple(rule)] for name, rule in rules],
+            ).encode(),
+            digest_size=8,
+        ).hexdigest()
+        self._etag: str | None = None
+        self._video_ids: list[str] = []
+        self.store.ensure_schema(SCHEMA)
+
+    def unchecked(self, video_ids: Sequence[str]) -> list[str]:
+        if not video_ids:
+            return []
+        rows = self.store.execute(
+            "SELECT video_id FROM standing_checked WHERE fingerprint = ? "
+            "AND video_id IN (SELECT value FROM json_each(?))",
+            (self.fingerprint, json.dumps(list(video_ids))),
+        )
+        checked = {row["video_id"] for row in rows}
+        return [video_id for video_id in video_ids if video_id not in checked]
+
+    def mark_checked(self, video_id: str) -> None:
+        self.store.execute(
+            "INSERT OR REPLACE INTO standing_checked (video_id, fingerprint, "
+            "checked_at) VALUES (?, ?, ?)",
+            (video_id, self.fingerprint, time.time()),
+        )
+
+    def apply_all(self, record: VideoRecord) -> tuple[str, str, list[str]]:
+        """Apply all the rules in order. Return the new texts and matched rules."""
+        title, description = record.title, record.description
+        matched = []
+        for name, rule in self.rules:
+            new_title, new_description = engine.apply_rule(rule, title, description)
+            if (new_title, new_description) != (title, description):
+                matched.append(name)
+                title, description = new_title, new_description
+        return title, description, matched
+
+    def count_matching(self, records: Sequence[VideoRecord]) -> int:
+        return sum(bool(self.apply_all(record)[2]) for record in records)
+
+    def poll(self) -> list[VideoRecord]:
+        """Return the newest uploads that have not been checked against the rules."""
+        with metrics.span("standing.poll"):
+            page = self.api.get_newest_playlist_video_ids(
+                self.playlist_id,
+                etag=self._etag,
+            )
+        if page is not None:
+            self._etag, self._video_ids = page
+        video_ids = self.unchecked(self._video_ids)
+        if not video_ids:
+            return []
+        records = self.api.get_videos(video_ids)
+        fetched = {record.video_id for record in records}
+        for video_id in video_ids:
+            if video_id not in fetched:  # private or deleted
+                self.mark_checked(video_id)
+        return records
+
+    def update(
+        self,
+        record: VideoRecord,
+        title: str,
+        description: str,
+        run: JournalRun,
+    ) -> VideoRecord:
+        with metrics.span("standing.update"):
+            updated = self.api.update_video_description(
+                video_id=record.video_id,
+                video_title=title,
+                video_category_id=record.category_id,
+                description=description,
+                tags=list(record.tags),
+            )
+        new_record = VideoRecord.from_resource(updated)
+        if self.snapshot is not None:
+            self.snapshot.save([new_record])
+        if self.journal is not None:
+            self.journal.record(run, record, new_record)
+        return new_record
+
+    def run_cycle(self) -> CycleReport:
+        """
+        Check the newest uploads against the rules and apply them.
+
+        Blocking. Costs a single API call when nothing has been uploaded
+        and no videos are waiting for the budget.
+        """
+        report = CycleReport()
+        run = JournalRun("reguły stałe")
+        try:
+            records = self.poll()
+        except googleapiclient.errors.HttpError as exc:
+            if not is_quota_exceeded(exc):
+                raise
+            report.quota_exceeded = True
+            return report
+        for index, record in enumerate(records):
+            title, description, matched = self.apply_all(record)
+            if not matched:
+                self.mark_checked(record.video_id)
+                continue
+            if len(report.applied) >= self.max_updates:
+                report.deferred = self.count_matching(records[index:])
+                break
+            try:
+                new_record = self.update(record, title, description, run)
+            except googleapiclient.errors.HttpError as exc:
+                if is_quota_exceeded(exc):
+                    report.quota_exceeded = True
+                    report.deferred = self.count_matching(records[index:])
+                    break
+                _LOGGER.exception(
+                    "Failed to apply standing rules to %s",
+                    record.video_id,
+                )
+                report.failed.append((record.video_id, str(exc)))
+            else:
+                report.applied.append((new_record, matched))
+            self.mark_checked(record.video_id)
+        return report
+
+
+def compile_rules(
+    rules: Sequence[tuple[str, Rule]],
+    *,
+    max_risk: int,
+) -> list[tuple[str, Rule]]:
+    """Drop invalid or risky rules, so that one typo does not stop the rest."""
+    valid = []
+    for name, rule in rules:
+        try:
+            patterns.check_pattern(rule.expression, rule.replacement, max_risk=max_risk)
+        except patterns.PatternError:  # noqa: PERF203
+            _LOGGER.exception("Invalid pattern in standing rule %r", name)
+        else:
+            valid.append((name, rule))
+    return valid
+
+
+async def run_standing_rules(
+    standing: StandingRules,
+    notify: Callable[[str], Awaitable[object]],
+    interval: float,
+) -> None:
+    """Run a cycle every `interval` seconds, forever."""
+    while True:
+        invocation = metrics.Invocation("standing")
+        try:
+            with metrics.track(invocation):
+                report = await asyncio.to_thread(standing.run_cycle)
+        except Exception:
+            _LOGGER.exception("Standing rules cycle failed")
+        else:
+            invocation.finish()
+            digest = report.render()
+            if digest is not None:
+                try:
+                    await notify(digest)
+                except Exception:
+                    # The videos are updated already, only the digest is lost.
+                    _LOGGER.exception("Failed to report the standing rules cycle")
+        await asyncio.sleep(interval)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import os
+    from collections.abc import Iterator
+
+_LOGGER = logging.getLogger("redesc.store")
+
+
+class Store:
+    """SQLite database shared by the bot's persistent components."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        _LOGGER.debug("Opened store at %s", path)
+
+    def ensure_schema(self, script: str) -> None:
+        with self._lock:
+            self.connection.executescript(script)
+
+    def ensure_columns(self, table: str, columns: dict[str, str]) -> None:
+        """Add columns missing from a table created by an older version."""
+        with self._lock:
+            existing = {
+                row["name"]
+                for row in self.connection.execute(f"PRAGMA table_info({table})")
+            }
+            for name, definition in columns.items():
+                if name not in existing:
+                    _LOGGER.info("Adding column %s to %s", name, table)
+                    self.connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {name} {definition}",
+                    )
+
+    def execute(self, sql: str, parameters: Any = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import math
+import operator
+import re
+from typing import TYPE_CHECKING, Any
+
+from redesc.api import fix_tags
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterable, Mapping, Sequence
+
+    from redesc.api import VideoRecord
+    from redesc.store import Store
+
+_LOGGER = logging.getLogger("redesc.tagging")
+
+WORD_RE = r"\w+"
+HASHTAG_RE = r"#(\w+)"
+# A crude stemmer, but Polish inflection mostly changes word endings
+# and it lets "wielomianach" in a title match "wielomian" in a tag.
+STEM_LENGTH: int = 6
+# Tags seen only once are more likely typos or one-off topics than a pattern.
+MIN_TAG_SUPPORT: int = 2
+
+FILL_EMPTY = "fill-empty"
+UNION = "union"
+REPLACE = "replace"
+REMOVE = "remove"
+MERGE_MODES = (FILL_EMPTY, UNION, REPLACE, REMOVE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_model (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    state TEXT NOT NULL
+);
+"""
+
+
+def stem(word: str) -> str:
+    return word.lower()[:STEM_LENGTH]
+
+
+def title_features(title: str) -> set[str]:
+    return {stem(word) for word in re.findall(WORD_RE, title) if len(word) > 1}
+
+
+def video_features(title: str, description: str = "") -> set[str]:
+    """Features of a video that has not been through the offline lemmatizer."""
+    return title_features(title) | {
+        f"#{hashtag.lower()}" for hashtag in re.findall(HASHTAG_RE, description)
+    }
+
+
+def entry_features(entry: Mapping[str, Any]) -> set[str]:
+    """Features of a tags.json entry."""
+    return (
+        title_features(entry.get("title", ""))
+        # Lemmas come with part of speech markers, like "nowy:A".
+        | {stem(lemma.partition(":")[0]) for lemma in entry.get("lemmas", "").split()}
+        | {f"#{hashtag.lower()}" for hashtag in entry.get("hashtags", ())}
+    )
+
+
+def dedupe_tags(tags: Iterable[str]) -> list[str]:
+    """Drop empty tags and repeated ones, ignoring case and surrounding spaces."""
+    seen: set[str] = set()
+    unique = []
+    for tag in tags:
+        key = tag.strip().casefold()
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(tag.strip())
+    return unique
+
+
+def merge_tags(
+    current: Sequence[str],
+    proposed: Sequence[str],
+    mode: str,
+    *,
+    remove: Collection[str] = (),
+) -> list[str]:
+    """
+    Combine the video's current tags with the proposed ones.
+
+    New tags are packed into the tag budget, but the current ones are
+    never cut off to make room for them.
+    """
+    if mode == FILL_EMPTY:
+        if current:
+            return list(current)
+        merged = dedupe_tags(proposed)
+    elif mode == UNION:
+        current = dedupe_tags(current)
+        if len(fix_tags(current)) < len(current):
+            return list(current)
+        merged = dedupe_tags([*current, *proposed])
+    elif mode == REPLACE:
+        merged = dedupe_tags(proposed)
+    elif mode == REMOVE:
+        removed = {tag.strip().casefold() for tag in remove}
+        return [tag for tag in current if tag.strip().casefold() not in removed]
+    else:
+        msg = f"Unknown tag merge mode: {mode!r}"
+        raise ValueError(msg)
+    return fix_tags(merged)
+
+
+def planned_tags(
+    record: VideoRecord,
+    entries: Mapping[str, Mapping[str, Any]],
+    mode: str,
+    *,
+    model: TagModel | None = None,
+    remove: Collection[str] = (),
+) -> list[str] | None:
+    """
+    Return the video's new tags, or None if they stay the same.
+
+    Tags come from the video's entry in tags.json or, if there is none,
+    from the model.
+    """
+    if record.video_id in entries:
+        proposed = entries[record.video_id]["tags"]
+    elif model is not None and not (mode == FILL_EMPTY and record.tags):
+        proposed = model.generate(record.title, record.description)
+    elif mode == REMOVE:
+        proposed = []
+    else:
+        return None
+    new_tags = merge_tags(record.tags, proposed, mode, remove=remove)
+    if new_tags == list(record.tags) or (not new_tags and mode != REMOVE):
+        return None
+    return new_tags
+
+
+class TagModel:
+    """
+    Channel-wide model of which tags go with which title words and hashtags.
+
+    Entries are only ever added, so the model can be kept up to date with
+    tags.json by feeding it the entries it has not seen yet.
+    """
+
+    def __init__(self) -> None:
+        self.video_ids: set[str] = set()
+        self.feature_counts: collections.Counter[str] = collections.Counter()
+        self.tag_counts: collections.Counter[str] = collections.Counter()
+        self.cooccurrences: dict[str, collections.Counter[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    @classmethod
+    def build(cls, entries: Mapping[str, Mapping[str, Any]]) -> TagModel:
+        model = cls()
+        model.update(entries)
+        return model
+
+    def add(self, video_id: str, features: Iterable[str], tags: Iterable[str]) -> bool:
+        if video_id in self.video_ids:
+            return False
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return False
+        self.video_ids.add(video_id)
+        self.tag_counts.update(tags)
+        for feature in set(features):
+            self.feature_counts[feature] += 1
+            self.cooccurrences.setdefault(feature, collections.Counter()).update(tags)
+        return True
+
+    def update(self, entries: Mapping[str, Mapping[str, Any]]) -> int:
+        """Add the entries the model has not seen yet. Return how many were added."""
+        return sum(
+            self.add(video_id, entry_features(entry), entry.get("tags", ()))
+            for video_id, entry in entries.items()
+            if video_id not in self.video_ids
+        )
+
+    def rank(self, features: Iterable[str]) -> list[tuple[str, float]]:
+        """Rank tags by how well they go with the features, best first."""
+        features = set(features)
+        scores: collections.defaultdict[str, float] = collections.defaultdict(float)
+        for feature in features:
+            count = self.feature_counts.get(feature)
+            if not count:
+                continue
+            # Rare features say more about a video than ones present everywhere.
+            weight = self._idf(count)
+            for tag, together in self.cooccurrences[feature].items():
+                scores[tag] += weight * together / count
+        for tag in scores:
+            # Same for tags, but a tag made of the title's own words is a safe bet.
+            scores[tag] *= self._idf(self.tag_counts[tag])
+            if {stem(word) for word in tag.split()} <= features:
+                scores[tag] *= 2
+        return [
+            (tag, score)
+            for tag, score in sorted(
+                scores.items(),
+                key=operator.itemgetter(1),
+                reverse=True,
+            )
+            if self.tag_counts[tag] >= MIN_TAG_SUPPORT
+        ]
+
+    def _idf(self, count: int) -> float:
+        return math.log((len(self.video_ids) + 1) / (count + 1)) + 1
+
+    def generate(self, title: str, description: str = "") -> list[str]:
+        """Return the best tags for a video that fit into the tag budget."""
+        ranked = self.rank(video_features(title, description))
+        return fix_tags([tag for tag, _ in ranked])
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {
+                "video_ids": sorted(self.video_ids),
+                "feature_counts": self.feature_counts,
+                "tag_counts": self.tag_counts,
+                "cooccurrences": self.cooccurrences,
+            },
+        )
+
+    @classmethod
+    def loads(cls, state: str) -> TagModel:
+        data = json.loads(state)
+        model = cls()
+        model.video_ids = set(data["video_ids"])
+        model.feature_counts.update(data["feature_counts"])
+        model.tag_counts.update(data["tag_counts"])
+        model.cooccurrences = {
+            feature: collections.Counter(tags)
+            for feature, tags in data["cooccurrences"].items()
+        }
+        return model
+
+
+_models: dict[Store, TagModel] = {}
+
+
+def load_model(store: Store, entries: Mapping[str, Mapping[str, Any]]) -> TagModel:
+    """Load the saved model and catch it up with the entries it has not seen."""
+    model = _models.get(store)
+    saved = model is not None
+    if model is None:
+        store.ensure_schema(SCHEMA)
+        rows = store.execute("SELECT state FROM tag_model WHERE id = 1")
+        saved = bool(rows)
+        model = _models[store] = (
+            TagModel.loads(rows[0]["state"]) if rows else TagModel()
+        )
+    added = model.update(entries)
+    if added or not saved:
+        store.execute(
+            "INSERT OR REPLACE INTO tag_model (id, state) VALUES (1, ?)",
+            (model.dumps(),),
+        )
+        _LOGGER.info("Added %d entries to the tag model (%d total)", added, len(model))
+    return model
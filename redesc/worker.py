@@ -0,0 +1,164 @@
+"""Worker process applying the runs the bot splits into shards."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import socket
+from typing import TYPE_CHECKING, Any
+
+from redesc import metrics, shards, tagging
+from redesc.accounts import UnknownAccountError
+from redesc.common import (
+    accounts,
+    journal,
+    running_app_var,
+    shard_store,
+    snapshot,
+    store,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+
+    from redesc.accounts import Account
+
+_LOGGER = logging.getLogger("redesc.worker")
+
+running_app_var.set(True)  # noqa: FBT003
+__import__("redesc.setup")
+
+POLL_INTERVAL = 5
+# How long shards wait when their account cannot be used right now.
+RETRY_DELAY = 600
+
+
+def load_tagging(
+    run: shards.ShardRun,
+) -> tuple[Mapping[str, Mapping[str, Any]], tagging.TagModel | None]:
+    entries = json.loads(pathlib.Path("tags.json").read_text())
+    model = None
+    if run.generate and run.mode != tagging.REMOVE:
+        with metrics.span("tagging.model"):
+            model = tagging.load_model(store, entries)
+    return entries, model
+
+
+async def usable_account(shard: shards.Shard) -> Account | None:
+    """The account of the shard, or None to postpone it."""
+    try:
+        account = accounts.get(shard.run.account)
+    except UnknownAccountError:
+        _LOGGER.exception("Shard %d is of an unknown account", shard.id)
+        return None
+    if not await account.credentials.ensure_valid():
+        _LOGGER.error(
+            "Account %r needs to be authorized again, postponing shard %d",
+            account.label,
+            shard.id,
+        )
+        return None
+    return account
+
+
+async def process(
+    shard: shards.Shard,
+    account: Account,
+    tagging_cache: dict[int, tuple[Mapping[str, Mapping[str, Any]], Any]],
+) -> shards.ShardResult:
+    """Apply the shard in a thread, turning a failure into its result."""
+    invocation = metrics.Invocation(f"worker.{shard.run.kind}")
+    try:
+        entries = model = None
+        if shard.run.kind == shards.TAGS:
+            if shard.run.id not in tagging_cache:
+                tagging_cache[shard.run.id] = await asyncio.to_thread(
+                    load_tagging,
+                    shard.run,
+                )
+            entries, model = tagging_cache[shard.run.id]
+        with metrics.track(invocation):
+            result = await asyncio.to_thread(
+                shards.process,
+                shard,
+                account.api,
+                shard_store,
+                journal=journal,
+                snapshot=snapshot,
+                entries=entries,
+                model=model,
+            )
+    except Exception as exc:
+        _LOGGER.exception("Shard %d failed", shard.id)
+        result = shards.ShardResult(error=str(exc))
+    invocation.finish()
+    return result
+
+
+async def work(name: str, *, once: bool = False) -> None:
+    """Process shards as they come, or until there are none left if `once`."""
+    refreshers = [
+        asyncio.create_task(account.credentials.run()) for account in accounts
+    ]
+    # Tag runs need tags.json and the model, loaded once per run.
+    tagging_cache: dict[int, tuple[Mapping[str, Mapping[str, Any]], Any]] = {}
+    try:
+        while True:
+            shard = await asyncio.to_thread(shard_store.claim, name)
+            if shard is None:
+                if once:
+                    return
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            account = await usable_account(shard)
+            if account is None:
+                await asyncio.to_thread(shard_store.release, shard, RETRY_DELAY)
+                continue
+            _LOGGER.info(
+                "Processing shard %d of run %d (%d videos)",
+                shard.id,
+                shard.run.id,
+                len(shard.video_ids),
+            )
+            result = await process(shard, account, tagging_cache)
+            await asyncio.to_thread(shard_store.finish, shard, result)
+            if result.left:
+                _LOGGER.info(
+                    "Quota budget used up, %d videos of shard %d postponed",
+                    len(result.left),
+                    shard.id,
+                )
+    finally:
+        for refresher in refreshers:
+            refresher.cancel()
+        await asyncio.gather(*refreshers, return_exceptions=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m redesc.worker")
+    parser.add_argument(
+        "--name",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="name of the worker, shown in the logs and the database",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="exit when there are no shards left instead of waiting for more",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s {args.name} %(name)s %(levelname)s: %(message)s",
+    )
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(work(args.name, once=args.once))
+
+
+if __name__ == "__main__":
+    main()
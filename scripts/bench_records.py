@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Measure memory retained by fetched videos: raw API resources vs `VideoRecord`s.
+
+Usage:
+$ python scripts/bench_records.py [--videos 10000]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import string
+import tracemalloc
+from typing import Any, Callable
+
+from redesc.api import VideoRecord
+
+TAG_POOL = [
+    "matematyka",
+    "matura 2024",
+    "wielomiany",
+    "funkcja kwadratowa",
+    "apocomitamatma",
+    "patomatma",
+    "zadania matematyczne",
+    "matematyka 2 liceum",
+    "geometria",
+    "trygonometria",
+]
+
+
+def _text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices(string.ascii_letters + " \n", k=length))
+
+
+def _thumbnail(video_id: str, name: str, width: int, height: int) -> dict[str, Any]:
+    return {
+        "url": f"https://i.ytimg.com/vi/{video_id}/{name}.jpg",
+        "width": width,
+        "height": height,
+    }
+
+
+def synthetic_resource(rng: random.Random, index: int) -> dict[str, Any]:
+    """Build a `videos.list(part="snippet")` item shaped like the real ones."""
+    video_id = f"{index:011d}"
+    title = _text(rng, 80)
+    description = _text(rng, rng.randint(500, 3000))
+    return {
+        "kind": "youtube#video",
+        "etag": _text(rng, 27),
+        "id": video_id,
+        "snippet": {
+            "publishedAt": "2023-01-01T00:00:00Z",
+            "channelId": "UC_jo5X2WkG7BS1jflbxTBPg",
+            "title": title,
+            "description": description,
+            "thumbnails": {
+                name: _thumbnail(video_id, name, width, height)
+                for name, width, height in (
+                    ("default", 120, 90),
+                    ("medium", 320, 180),
+                    ("high", 480, 360),
+                    ("standard", 640, 480),
+                    ("maxres", 1280, 720),
+                )
+            },
+            "channelTitle": "a po co mi ta matma",
+            # Every resource decoded from JSON gets its own copies of the tags.
+            "tags": ["".join(tag) for tag in rng.sample(TAG_POOL, k=8)],
+            "categoryId": "".join("27"),
+            "liveBroadcastContent": "none",
+            "defaultLanguage": "pl",
+            "localized": {"title": title, "description": description},
+            "defaultAudioLanguage": "pl",
+        },
+    }
+
+
+def retained(build: Callable[[], list[Any]]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    data = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--videos", type=int, default=10000)
+    args = parser.parse_args()
+
+    def raw() -> list[dict[str, Any]]:
+        rng = random.Random(0)
+        return [synthetic_resource(rng, index) for index in range(args.videos)]
+
+    def records() -> list[VideoRecord]:
+        rng = random.Random(0)
+        return [
+            VideoRecord.from_resource(synthetic_resource(rng, index))
+            for index in range(args.videos)
+        ]
+
+    raw_bytes = retained(raw)
+    record_bytes = retained(records)
+    print(f"videos:        {args.videos}")
+    print(f"raw resources: {raw_bytes / 2**20:8.2f} MiB")
+    print(f"VideoRecords:  {record_bytes / 2**20:8.2f} MiB")
+    print(f"reduction:     {1 - record_bytes / raw_bytes:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
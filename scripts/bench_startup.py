@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Measure how long the bot's modules take to import, using `python -X importtime`.
+
+Fails if the import takes longer than the threshold or if any of the modules
+that are supposed to be imported lazily is imported at startup.
+
+Usage:
+$ python scripts/bench_startup.py [--module redesc.main] [--threshold-ms 1500]
+"""
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+
+LAZY_MODULES = (
+    "googleapiclient.discovery",
+    "google_auth_oauthlib",
+    "google.oauth2.credentials",
+    "oauthlib",
+)
+
+
+def import_times(module: str) -> list[tuple[int, int, str]]:
+    """Return (self us, cumulative us, module name) of every imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="redesc.main")
+    parser.add_argument("--threshold-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    # Top-level imports are the ones with no indentation after the separator.
+    total_us = sum(
+        cumulative for _, cumulative, name in times if not name.startswith("  ")
+    )
+    print(f"{args.module}: {total_us / 1000:.1f} ms, {len(times)} modules")
+    print("slowest (self time):")
+    for self_us, _, name in sorted(times, reverse=True)[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name.strip()}")
+
+    failures = []
+    eager = sorted(
+        {
+            name.strip()
+            for _, _, name in times
+            if name.strip().startswith(LAZY_MODULES)
+        },
+    )
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if total_us / 1000 > args.threshold_ms:
+        failures.append(
+            f"{total_us / 1000:.1f} ms exceeds the threshold of {args.threshold_ms} ms",
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(bool(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Measure how long it takes to build the tag model from tags.json and use it,
+and how well the generated tags match the offline ones.
+
+Every `--holdout`-th entry (in the order of video IDs) is left out of the model
+and tags are generated for it from its title and hashtags, as they would be
+for a new upload. Precision and recall are summed over all held-out entries.
+
+Usage:
+$ python scripts/bench_tagging.py [--tags tags.json] [--repeat 20] [--holdout 5]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import statistics
+import time
+from typing import Any, Callable
+
+from redesc.tagging import TagModel
+
+
+def timed(
+    function: Callable[[Any], Any],
+    repeat: int,
+    setup: Callable[[], Any] = lambda: None,
+) -> list[float]:
+    """Time calls of the function with what `setup` returns, setup excluded."""
+    timings = []
+    for _ in range(repeat):
+        argument = setup()
+        started_at = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    print(
+        f"{name:<22} median {statistics.median(timings) * 1000:8.2f} ms, "
+        f"min {min(timings) * 1000:8.2f} ms",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tags", type=pathlib.Path, default=pathlib.Path("tags.json"))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--holdout", type=int, default=5)
+    args = parser.parse_args()
+
+    entries: dict[str, dict[str, Any]] = json.loads(args.tags.read_text())
+    *old, (new_id, new_entry) = entries.items()
+    model = TagModel.build(dict(old))
+    state = model.dumps()
+
+    print(f"entries:               {len(entries)}")
+    report("full build", timed(lambda _: TagModel.build(entries), args.repeat))
+    report(
+        "load + 1 new entry",
+        timed(lambda _: TagModel.loads(state).update({new_id: new_entry}), args.repeat),
+    )
+    report(
+        "1 new entry in memory",
+        timed(
+            lambda loaded: loaded.update({new_id: new_entry}),
+            args.repeat,
+            setup=lambda: TagModel.loads(state),
+        ),
+    )
+    report(
+        "generate for a title",
+        timed(lambda _: model.generate(new_entry["title"]), args.repeat),
+    )
+    precision, recall, held_out = evaluate(entries, args.holdout)
+    print(
+        f"held out {held_out} entries: "
+        f"precision {precision:.2f}, recall {recall:.2f}",
+    )
+
+
+def evaluate(
+    entries: dict[str, dict[str, Any]],
+    holdout: int,
+) -> tuple[float, float, int]:
+    """Return precision and recall of tags generated for held-out entries."""
+    video_ids = sorted(entries)
+    held_out = set(video_ids[::holdout])
+    model = TagModel.build(
+        {
+            video_id: entry
+            for video_id, entry in entries.items()
+            if video_id not in held_out
+        },
+    )
+    generated_count = expected_count = hits = 0
+    for video_id in held_out:
+        entry = entries[video_id]
+        description = " ".join(f"#{hashtag}" for hashtag in entry.get("hashtags", ()))
+        generated = set(model.generate(entry["title"], description))
+        expected = set(entry.get("tags", ()))
+        generated_count += len(generated)
+        expected_count += len(expected)
+        hits += len(generated & expected)
+    return (
+        hits / generated_count if generated_count else 0.0,
+        hits / expected_count if expected_count else 0.0,
+        len(held_out),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Record YouTube API sessions to cassettes and replay them without network access.
+
+Recording runs a scenario against the real API with the bot's config and
+credentials, and saves every request and response (without the API key and
+tokens) together with the result. Replaying runs the same scenario through
+`YouTubeAPI` served from the cassette, fails if the code now makes requests
+that were not recorded or returns a different result, and reports the API
+calls and the time spent per endpoint.
+
+Scenarios:
+  playlist PLAYLIST_ID [LIMIT]  get_playlist_items (paging by 50, limit 10)
+  newest PLAYLIST_ID            get_newest_playlist_video_ids
+  channel                       get_channel_playlist_ids
+  update VIDEO_ID               rewrite a video with its current snippet (50 units)
+
+Usage:
+$ python scripts/replay_api.py record cassettes/playlist.json playlist PL... 120
+$ python scripts/replay_api.py replay cassettes/playlist.json [--speed 0] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import sys
+import time
+from typing import Any, Callable
+
+from redesc import metrics
+from redesc.api import YouTubeAPI
+from redesc.cassette import (
+    Cassette,
+    CassetteMismatchError,
+    ReplayCredentialManager,
+    ReplayHttp,
+    recording_http_factory,
+    replay_http_factory,
+)
+
+
+def playlist(api: YouTubeAPI, playlist_id: str, limit: str = "10") -> Any:
+    return [
+        record.video_id
+        for record in api.get_playlist_items(playlist_id, limit=int(limit))
+    ]
+
+
+def newest(api: YouTubeAPI, playlist_id: str) -> Any:
+    return api.get_newest_playlist_video_ids(playlist_id)
+
+
+def channel(api: YouTubeAPI) -> Any:
+    return api.get_channel_playlist_ids()
+
+
+def update(api: YouTubeAPI, video_id: str) -> Any:
+    (record,) = api.get_videos([video_id], fresh=True)
+    response = api.update_video_description(
+        video_id,
+        record.description,
+        list(record.tags),
+        record.title,
+        record.category_id,
+    )
+    return response["snippet"]["description"] == record.description
+
+
+SCENARIOS: dict[str, Callable[..., Any]] = {
+    "playlist": playlist,
+    "newest": newest,
+    "channel": channel,
+    "update": update,
+}
+
+
+def endpoint_report() -> list[str]:
+    """API calls and time spent per endpoint, as measured by redesc.metrics."""
+    calls = {
+        dict(labels)["endpoint"]: value
+        for (name, labels), value in metrics.registry.counters.items()
+        if name == "redesc_api_calls_total"
+    }
+    seconds = {
+        dict(labels)["phase"].removeprefix("api."): histogram.total
+        for (name, labels), histogram in metrics.registry.histograms.items()
+        if name == "redesc_phase_seconds"
+    }
+    return [
+        f"  {endpoint}: {calls[endpoint]:g} calls, {seconds.get(endpoint, 0):.3f}s"
+        for endpoint in sorted(calls)
+    ]
+
+
+def record(args: argparse.Namespace) -> int:
+    from redesc.common import accounts, running_app_var
+
+    running_app_var.set(True)  # noqa: FBT003
+    __import__("redesc.setup")
+    account = accounts.get(args.account)
+    cassette = Cassette()
+    api = YouTubeAPI(
+        api_key=account.api.api_key,
+        credential_manager=account.credentials,
+        http_factory=recording_http_factory(cassette),
+    )
+    result = SCENARIOS[args.scenario](api, *args.arguments)
+    cassette.metadata = {
+        "scenario": args.scenario,
+        "arguments": args.arguments,
+        "result": result,
+        "recorded_at": time.time(),
+    }
+    path = pathlib.Path(args.cassette)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cassette.save(path)
+    print(f"recorded {len(cassette.interactions)} requests to {path}")
+    print("\n".join(endpoint_report()))
+    return 0
+
+
+def replay(args: argparse.Namespace) -> int:
+    cassette = Cassette.load(args.cassette)
+    scenario = cassette.metadata["scenario"]
+    arguments = cassette.metadata["arguments"]
+    failures = []
+    started_at = time.perf_counter()
+    for _ in range(args.repeat):
+        http = ReplayHttp(cassette, speed=args.speed)
+        api = YouTubeAPI(
+            api_key="replay",
+            credential_manager=ReplayCredentialManager(),  # type: ignore[arg-type]
+            http_factory=replay_http_factory(http),
+        )
+        try:
+            result = SCENARIOS[scenario](api, *arguments)
+        except CassetteMismatchError as exc:
+            failures.append(str(exc))
+            break
+        # Compared as saved, e.g. with tuples turned into lists.
+        if json.loads(json.dumps(result)) != cassette.metadata["result"]:
+            failures.append(f"result differs: {result!r}")
+        if http.unused:
+            failures.append(f"{len(http.unused)} recorded requests were not made")
+        if failures:
+            break
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"{scenario} {' '.join(arguments)}: {args.repeat} runs in {elapsed:.3f}s "
+        f"({elapsed / args.repeat:.3f}s per run)",
+    )
+    print("\n".join(endpoint_report()))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return bool(failures)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("cassette")
+    record_parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    record_parser.add_argument("arguments", nargs="*")
+    record_parser.add_argument("--account", help="channel from config.yml")
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("cassette")
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="divide the recorded latency by this, 0 to answer at once",
+    )
+    replay_parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(record(args) if args.command == "record" else replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from redesc.jobs import JobQueue
+from redesc.store import Store
+
+if TYPE_CHECKING:
+    import pathlib
+
+
+@pytest.fixture()
+def store(tmp_path: pathlib.Path) -> Store:
+    return Store(tmp_path / "redesc.db")
+
+
+@pytest.fixture()
+def queue(store: Store) -> JobQueue:
+    return JobQueue(store)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, cast
+
+import googleapiclient.errors
+import httplib2
+
+from redesc.api import VideoRecord
+
+if TYPE_CHECKING:
+    from redesc.api import YouTubeAPI
+
+
+def http_error(status: int, content: bytes = b"") -> googleapiclient.errors.HttpError:
+    return googleapiclient.errors.HttpError(
+        httplib2.Response({"status": status}),
+        content,
+    )
+
+
+def record(video_id: str, description: str = "foo") -> VideoRecord:
+    return VideoRecord(video_id, "title", description, ("tag",), "22", None)
+
+
+class FakeAPI:
+    """Videos kept in memory, with the calls of YouTubeAPI that update them."""
+
+    def __init__(self, *records: VideoRecord) -> None:
+        self.videos = {record.video_id: record for record in records}
+        self.errors: dict[str, Exception] = {}
+        self.rebase_error: Exception | None = None
+        self.updated: list[str] = []
+
+    @property
+    def api(self) -> YouTubeAPI:
+        return cast("YouTubeAPI", self)
+
+    def get_videos(self, video_ids: Any, *, fresh: bool = False) -> list[VideoRecord]:
+        assert fresh
+        if self.rebase_error is not None:
+            raise self.rebase_error
+        return [
+            self.videos[video_id] for video_id in video_ids if video_id in self.videos
+        ]
+
+    def update_video_description(
+        self,
+        video_id: str,
+        description: str,
+        tags: list[str],
+        video_title: str,
+        video_category_id: str | None,
+    ) -> dict[str, Any]:
+        if video_id in self.errors:
+            raise self.errors[video_id]
+        self.updated.append(video_id)
+        record = self.videos[video_id] = VideoRecord(
+            video_id,
+            video_title,
+            description,
+            tuple(tags),
+            video_category_id,
+            None,
+        )
+        return {
+            "id": video_id,
+            "snippet": {
+                "title": record.title,
+                "description": record.description,
+                "tags": list(record.tags),
+            },
+        }
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from redesc.cache import ResponseCache
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self) -> int:
+        self.calls += 1
+        return self.calls
+
+
+def test_hit() -> None:
+    cache = ResponseCache()
+    call = Counter()
+    assert cache.get("key", call, name="test") == 1
+    assert cache.get("key", call, name="test") == 1
+    assert call.calls == 1
+    assert len(cache) == 1
+
+
+def test_fresh_replaces_the_entry() -> None:
+    cache = ResponseCache()
+    call = Counter()
+    cache.get("key", call, name="test")
+    assert cache.get("key", call, name="test", fresh=True) == 2
+    assert cache.get("key", call, name="test") == 2
+
+
+def test_expired_entries_are_fetched_again() -> None:
+    cache = ResponseCache(ttl=-1)
+    call = Counter()
+    cache.get("key", call, name="test")
+    assert cache.get("key", call, name="test") == 2
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted() -> None:
+    cache = ResponseCache(max_entries=2)
+    for key in ("a", "b", "a", "c"):
+        cache.get(key, Counter(), name="test")
+    call = Counter()
+    cache.get("a", call, name="test")
+    cache.get("b", call, name="test")
+    assert call.calls == 1  # only "b" was evicted
+
+
+def test_invalidate() -> None:
+    cache = ResponseCache()
+    call = Counter()
+    cache.get("a", call, name="test", tags=["video1"])
+    cache.get("b", call, name="test", tags=["video2"])
+    cache.invalidate(["video1"])
+    assert cache.get("a", call, name="test") == 3
+    assert cache.get("b", call, name="test") == 2
+
+
+def test_errors_are_not_cached() -> None:
+    cache = ResponseCache()
+
+    def fail() -> int:
+        raise ValueError
+
+    with pytest.raises(ValueError):  # noqa: PT011
+        cache.get("key", fail, name="test")
+    assert cache.get("key", Counter(), name="test") == 1
+
+
+def test_concurrent_calls_are_coalesced() -> None:
+    cache = ResponseCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow() -> str:
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "value"
+
+    with ThreadPoolExecutor(4) as executor:
+        first = executor.submit(cache.get, "key", slow, name="test")
+        started.wait()
+        others = [
+            executor.submit(cache.get, "key", slow, name="test") for _ in range(3)
+        ]
+        release.set()
+        assert first.result() == "value"
+        assert [future.result() for future in others] == ["value"] * 3
+    assert len(calls) == 1
+
+
+def test_responses_racing_an_invalidation_are_not_cached() -> None:
+    cache = ResponseCache()
+    call = Counter()
+
+    def invalidating() -> int:
+        cache.invalidate(["video"])
+        return call()
+
+    cache.get("key", invalidating, name="test", tags=["video"])
+    assert cache.get("key", call, name="test") == 2
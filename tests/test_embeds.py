@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from redesc.embeds import (
+    CODE_BLOCK_CLOSE,
+    CODE_BLOCK_OPEN,
+    EMBED_DESCRIPTION_LIMIT,
+    MESSAGE_EMBED_COUNT_LIMIT,
+    MESSAGE_EMBEDS_LIMIT,
+    escape_code,
+    pack,
+    split_block,
+)
+
+
+def check_limits(pages: list[list[str]], reserved: int = 0) -> None:
+    for page in pages:
+        assert 0 < len(page) <= MESSAGE_EMBED_COUNT_LIMIT
+        assert sum(map(len, page)) <= MESSAGE_EMBEDS_LIMIT - reserved
+        for description in page:
+            assert len(description) <= EMBED_DESCRIPTION_LIMIT
+            assert description.count(CODE_BLOCK_OPEN) == 1
+            assert description.endswith(CODE_BLOCK_CLOSE)
+
+
+def code(description: str) -> str:
+    """The code block of an embed, without the head."""
+    start = description.index(CODE_BLOCK_OPEN) + len(CODE_BLOCK_OPEN)
+    return description[start : -len(CODE_BLOCK_CLOSE)]
+
+
+def test_escape_code() -> None:
+    assert escape_code("a `b` ```") == "a \\`b\\` \\`\\`\\`"
+
+
+def test_split_block_prefers_line_breaks() -> None:
+    assert split_block("aaa\nbbb\nccc", 8) == ["aaa\nbbb", "ccc"]
+
+
+def test_split_block_keeps_escapes_whole() -> None:
+    pieces = split_block("ab\\`cd", 3)
+    assert pieces == ["ab", "\\`c", "d"]
+    assert "".join(pieces) == "ab\\`cd"
+
+
+def test_empty() -> None:
+    assert pack([]) == [[CODE_BLOCK_OPEN + CODE_BLOCK_CLOSE]]
+    assert pack([], head="head") == [["head" + CODE_BLOCK_OPEN + CODE_BLOCK_CLOSE]]
+
+
+def test_small_blocks_share_an_embed() -> None:
+    (page,) = pack(["- a", "+ b"], head="**1/1**\n")
+    assert page == [f"**1/1**\n{CODE_BLOCK_OPEN}- a\n\n+ b{CODE_BLOCK_CLOSE}"]
+
+
+def test_blocks_are_escaped() -> None:
+    ((description,),) = pack(["```"])
+    assert code(description) == "\\`\\`\\`"
+
+
+@pytest.mark.parametrize("reserved", [0, 100, 2000])
+def test_limits(reserved: int) -> None:
+    generator = random.Random(reserved)
+    blocks = [
+        "\n".join(
+            "x" * generator.randint(0, 200) for _ in range(generator.randint(1, 30))
+        )
+        for _ in range(100)
+    ]
+    pages = pack(blocks, head="head\n", reserved=reserved)
+    check_limits(pages, reserved)
+    assert len(pages) > 1
+    # Every block is there, whole and in order.
+    assert "\n\n".join(
+        code(description) for page in pages for description in page
+    ).replace("\n", "") == "".join(blocks).replace("\n", "")
+
+
+def test_long_blocks_are_split_not_cut() -> None:
+    block = "`" * (EMBED_DESCRIPTION_LIMIT * 3)
+    pages = pack([block])
+    check_limits(pages)
+    joined = "".join(code(description) for page in pages for description in page)
+    assert joined == escape_code(block)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+from typing import TYPE_CHECKING
+
+import pytest
+
+from redesc import jobs
+from redesc.accounts import DEFAULT_ACCOUNT
+from redesc.engine import VideoDiff
+from redesc.journal import Journal
+from tests.fakes import FakeAPI, http_error, record
+
+if TYPE_CHECKING:
+    from redesc.store import Store
+
+RULE = jobs.Rule("foo", "bar")
+PAST = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def diff(video_id: str) -> VideoDiff:
+    return VideoDiff(record(video_id), "title", "bar", ["tag"])
+
+
+def drain(
+    queue: jobs.JobQueue,
+    api: FakeAPI,
+    journal: Journal | None = None,
+) -> jobs.DrainResult:
+    return asyncio.run(jobs.drain(queue, api.api, journal))
+
+
+def test_enqueue_and_pending(queue: jobs.JobQueue) -> None:
+    assert queue.enqueue([diff("a"), diff("b")], RULE, not_before=PAST) == 2
+    queue.enqueue([diff("c")], RULE)  # until the next quota reset
+    queue.enqueue([diff("d")], RULE, not_before=PAST, account="other")
+    pending = queue.pending()
+    assert [update.diff.video_id for update in pending] == ["a", "b"]
+    assert pending[0].rule == RULE
+    assert pending[0].description == "bar"
+    assert queue.count() == 4
+    assert queue.count("other") == 1
+    assert queue.next_due("other") == PAST.timestamp()
+    queue.mark(pending[0].id, jobs.DONE)
+    assert [update.diff.video_id for update in queue.pending()] == ["b"]
+
+
+def test_next_due_empty(queue: jobs.JobQueue) -> None:
+    assert queue.next_due() is None
+
+
+def test_columns_are_migrated(store: Store) -> None:
+    # The table as created before diffs kept their etags.
+    store.ensure_schema(
+        "CREATE TABLE pending_updates (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "video_id TEXT NOT NULL, old_title TEXT NOT NULL, new_title TEXT NOT NULL, "
+        "old_description TEXT NOT NULL, new_description TEXT NOT NULL, "
+        "tags TEXT NOT NULL, video_category_id TEXT, with_title INTEGER NOT NULL, "
+        "with_description INTEGER NOT NULL, expression TEXT NOT NULL, "
+        "replacement TEXT NOT NULL, invoked_by TEXT, created_at TEXT NOT NULL, "
+        "not_before REAL NOT NULL DEFAULT 0, "
+        "state TEXT NOT NULL DEFAULT 'pending', error TEXT)",
+    )
+    queue = jobs.JobQueue(store)
+    queue.enqueue([diff("a")], RULE, not_before=PAST)
+    (update,) = queue.pending()
+    assert update.diff.etag is None
+    assert update.account == DEFAULT_ACCOUNT
+
+
+def test_next_quota_reset() -> None:
+    now = datetime.datetime(2023, 6, 1, 23, 30, tzinfo=jobs.QUOTA_TIMEZONE)
+    assert jobs.next_quota_reset(now) == datetime.datetime(
+        2023, 6, 2, tzinfo=jobs.QUOTA_TIMEZONE,
+    )
+
+
+def test_drain(queue: jobs.JobQueue, store: Store) -> None:
+    api = FakeAPI(record("a"), record("b"), record("c", description="baz"))
+    queue.enqueue(
+        [diff("a"), diff("b"), diff("c"), diff("gone")],
+        RULE,
+        not_before=PAST,
+    )
+    api.errors["b"] = http_error(500)
+    journal = Journal(store)
+    assert drain(queue, api, journal) == jobs.DrainResult(applied=1, failed=1)
+    assert api.updated == ["a"]
+    states = {
+        row["video_id"]: row["state"]
+        for row in store.execute("SELECT video_id, state FROM pending_updates")
+    }
+    assert states == {
+        "a": jobs.DONE,
+        "b": jobs.FAILED,
+        # Edited since, so the rule no longer applies to it.
+        "c": jobs.STALE,
+        "gone": jobs.STALE,
+    }
+
+
+def test_drain_keeps_going_after_unexpected_errors(queue: jobs.JobQueue) -> None:
+    api = FakeAPI(record("a"), record("b"))
+    api.errors["a"] = IndexError("list index out of range")
+    queue.enqueue([diff("a"), diff("b")], RULE, not_before=PAST)
+    assert drain(queue, api) == jobs.DrainResult(applied=1, failed=1)
+    assert api.updated == ["b"]
+
+
+def test_drain_marks_updates_failed_when_rebase_fails(queue: jobs.JobQueue) -> None:
+    api = FakeAPI(record("a"))
+    api.rebase_error = http_error(404)
+    queue.enqueue([diff("a")], RULE, not_before=PAST)
+    assert drain(queue, api) == jobs.DrainResult(failed=1)
+    assert queue.count() == 0
+
+
+def test_drain_stops_when_quota_is_exceeded(queue: jobs.JobQueue) -> None:
+    api = FakeAPI(record("a"), record("b"))
+    api.errors["b"] = http_error(403, b'{"reason": "quotaExceeded"}')
+    queue.enqueue([diff("a"), diff("b")], RULE, not_before=PAST)
+    assert drain(queue, api) == jobs.DrainResult(applied=1, exhausted=True)
+    # Left for after the quota reset.
+    assert [update.diff.video_id for update in queue.pending()] == ["b"]
+
+
+def test_scheduler_applies_updates_when_woken_up(queue: jobs.JobQueue) -> None:
+    api = FakeAPI(record("a"))
+    messages: list[str] = []
+
+    async def notify(message: str) -> None:
+        messages.append(message)
+
+    async def main() -> None:
+        scheduler = asyncio.create_task(
+            jobs.run_scheduler(queue, api.api, notify),
+        )
+        await asyncio.sleep(0)
+        queue.enqueue([diff("a")], RULE, not_before=PAST)
+        for _ in range(100):
+            if messages:
+                break
+            await asyncio.sleep(0.01)
+        scheduler.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await scheduler
+
+    asyncio.run(main())
+    assert messages == ["Kolejka: podmieniono: **1**."]
+    assert api.updated == ["a"]
+
+
+def test_scheduler_survives_failed_notifications(queue: jobs.JobQueue) -> None:
+    api = FakeAPI(record("a"), record("b"))
+    messages: list[str] = []
+
+    async def notify(message: str) -> None:
+        messages.append(message)
+        if len(messages) == 1:
+            raise ConnectionError
+
+    async def main() -> None:
+        scheduler = asyncio.create_task(
+            jobs.run_scheduler(queue, api.api, notify),
+        )
+        await asyncio.sleep(0)
+        for count, video_id in enumerate("ab", start=1):
+            queue.enqueue([diff(video_id)], RULE, not_before=PAST)
+            for _ in range(100):
+                if len(messages) == count:
+                    break
+                await asyncio.sleep(0.01)
+        assert not scheduler.done()
+        scheduler.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await scheduler
+
+    asyncio.run(main())
+    assert api.updated == ["a", "b"]
+    assert len(messages) == 2
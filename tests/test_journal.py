@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+import pytest
+
+from redesc import jobs
+from redesc.api import VideoRecord
+from redesc.journal import Journal, JournalRun
+from tests.fakes import FakeAPI, http_error, record
+
+if TYPE_CHECKING:
+    from redesc.store import Store
+
+
+def edited(before: VideoRecord, description: str) -> VideoRecord:
+    return VideoRecord(
+        before.video_id,
+        before.title,
+        description,
+        before.tags,
+        before.category_id,
+        None,
+    )
+
+
+@pytest.fixture()
+def journal(store: Store) -> Journal:
+    return Journal(store)
+
+
+def test_record_and_entries(journal: Journal) -> None:
+    run = JournalRun("podmien", "user", "foo → bar", account="other")
+    journal.record(run, record("a"), edited(record("a"), "bar"))
+    assert run.id is not None
+    (entry,) = journal.entries(run.id)
+    assert (entry.before.description, entry.after.description) == ("foo", "bar")
+    assert entry.invoked_by == "user"
+    assert journal.run_account(run.id) == "other"
+    assert journal.run_account(run.id + 1) is None
+    assert [row["entries"] for row in journal.runs()] == [1]
+
+
+def test_revert_unknown_run(journal: Journal, queue: jobs.JobQueue) -> None:
+    with pytest.raises(LookupError):
+        journal.revert(FakeAPI().api, queue, 1)
+
+
+def test_revert_is_queued_and_applied_by_the_scheduler(
+    journal: Journal,
+    queue: jobs.JobQueue,
+) -> None:
+    run = JournalRun("podmien")
+    for video_id in "abcd":
+        journal.record(run, record(video_id), edited(record(video_id), "bar"))
+    # Updated twice in the run: both updates are undone at once.
+    journal.record(run, edited(record("a"), "bar"), edited(record("a"), "baz"))
+    assert run.id is not None
+    api = FakeAPI(
+        edited(record("a"), "baz"),
+        edited(record("b"), "bar"),
+        record("c"),  # reverted already
+        edited(record("d"), "edited by hand"),
+    )
+
+    report = journal.revert(api.api, queue, run.id, invoked_by="user")
+
+    assert (report.queued, report.already_reverted, report.changed) == (2, 1, ["d"])
+    assert not api.updated
+    # Edited after the revert was queued, so it no longer applies.
+    api.videos["b"] = edited(record("b"), "edited by hand")
+    result = asyncio.run(jobs.drain(queue, api.api, journal))
+    assert result == jobs.DrainResult(reverted=1)
+    assert api.updated == ["a"]
+    assert api.videos["a"].description == "foo"
+    (revert_run,) = (row for row in journal.runs() if row["command"] == "cofnij")
+    (entry,) = journal.entries(revert_run["id"])
+    assert (entry.before.description, entry.after.description) == ("baz", "foo")
+    assert entry.invoked_by == "user"
+
+
+def test_reverts_of_different_runs_are_journaled_apart(
+    journal: Journal,
+    queue: jobs.JobQueue,
+) -> None:
+    api = FakeAPI()
+    run_ids = []
+    for video_id in "ab":
+        run = JournalRun("podmien")
+        journal.record(run, record(video_id), edited(record(video_id), "bar"))
+        assert run.id is not None
+        run_ids.append(run.id)
+        api.videos[video_id] = edited(record(video_id), "bar")
+    for run_id, user in zip(run_ids, ("first", "second")):
+        journal.revert(api.api, queue, run_id, invoked_by=user)
+
+    result = asyncio.run(jobs.drain(queue, api.api, journal))
+
+    assert result == jobs.DrainResult(reverted=2)
+    reverts = {
+        row["summary"]: row["invoked_by"]
+        for row in journal.runs()
+        if row["command"] == "cofnij"
+    }
+    assert reverts == {
+        f"przebieg {run_ids[0]}": "first",
+        f"przebieg {run_ids[1]}": "second",
+    }
+
+
+def test_revert_stops_checking_when_quota_is_exceeded(
+    journal: Journal,
+    queue: jobs.JobQueue,
+) -> None:
+    run = JournalRun("podmien")
+    journal.record(run, record("a"), edited(record("a"), "bar"))
+    assert run.id is not None
+    api = FakeAPI()
+    api.rebase_error = http_error(403, b"quotaExceeded")
+    report = journal.revert(api.api, queue, run.id)
+    assert report.quota_exceeded
+    assert (report.queued, report.left) == (0, 1)
+    assert "nie sprawdzono: **1**" in report.render()
+
+
+def test_reverts_queued_from_a_thread_wake_the_scheduler_up(
+    journal: Journal,
+    queue: jobs.JobQueue,
+) -> None:
+    run = JournalRun("podmien")
+    journal.record(run, record("a"), edited(record("a"), "bar"))
+    assert run.id is not None
+    run_id = run.id
+    api = FakeAPI(edited(record("a"), "bar"))
+    messages: list[str] = []
+
+    async def notify(message: str) -> None:
+        messages.append(message)
+
+    async def main() -> None:
+        scheduler = asyncio.create_task(
+            jobs.run_scheduler(queue, api.api, notify, journal),
+        )
+        await asyncio.sleep(0)
+        await asyncio.to_thread(journal.revert, api.api, queue, run_id)
+        for _ in range(100):
+            if messages:
+                break
+            await asyncio.sleep(0.01)
+        scheduler.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await scheduler
+
+    asyncio.run(main())
+    assert messages == ["Kolejka: cofnięto: **1**."]
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import pytest
+
+from redesc import patterns
+
+
+@pytest.mark.parametrize(
+    ("expression", "alternatives"),
+    [
+        ("foo", ("foo",)),
+        (r"x\d+youtube", ("youtube",)),
+        ("(?:https?://)?youtube", ("youtube",)),
+        ("(?:spam|eggs)+!", ("spam", "eggs")),
+    ],
+)
+def test_required_literals(expression: str, alternatives: tuple[str, ...]) -> None:
+    literals = patterns.required_literals(expression)
+    assert literals is not None
+    assert literals.alternatives == alternatives
+
+
+@pytest.mark.parametrize("expression", [r"\d+", "ab?", "(?:foo)?", "foo|x"])
+def test_no_required_literals(expression: str) -> None:
+    assert patterns.required_literals(expression) is None
+
+
+def test_literals_ignore_case() -> None:
+    literals = patterns.required_literals("(?i)youtube")
+    assert literals is not None
+    assert literals.search("Zobacz na YouTube")
+    assert not literals.search("Zobacz na Vimeo")
+
+
+@pytest.mark.parametrize(
+    ("expression", "reason"),
+    [
+        ("(a+)+b", patterns.NESTED_QUANTIFIERS),
+        (r"(\s*,\s*)+$", patterns.NESTED_QUANTIFIERS),
+        ("(.|a)*b", patterns.OVERLAPPING_ALTERNATIVES),
+        (r"\d+\d+x", patterns.ADJACENT_QUANTIFIERS),
+    ],
+)
+def test_risky(expression: str, reason: str) -> None:
+    risk = patterns.backtracking_risk(expression)
+    assert reason in risk.reasons
+    assert risk.score > 0
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["foo", "(a|b)*c", "x(y|z)*w", "[a-z]+[0-9]+", r"\w+\s+\w+", "a{2,5}b"],
+)
+def test_safe(expression: str) -> None:
+    assert patterns.backtracking_risk(expression) == patterns.Risk(0, ())
+
+
+def test_exponential_outweighs_polynomial() -> None:
+    exponential = patterns.backtracking_risk("(a+)+b").score
+    polynomial = patterns.backtracking_risk(r"\d+\d+x").score
+    assert exponential > polynomial
+
+
+def test_compile_pattern_is_cached() -> None:
+    pattern = patterns.compile_pattern("foo", "bar")
+    assert patterns.compile_pattern("foo", "bar") is pattern
+    assert pattern.sub("a foo") == "a bar"
+    assert pattern.literals == patterns.Literals(("foo",))
+
+
+@pytest.mark.parametrize(
+    ("expression", "replacement", "error"),
+    [
+        ("(", "", patterns.InvalidExpressionError),
+        ("foo", r"\1", patterns.InvalidReplacementError),
+        ("(?P<a>foo)", r"\g<b>", patterns.InvalidReplacementError),
+    ],
+)
+def test_invalid(
+    expression: str,
+    replacement: str,
+    error: type[patterns.PatternError],
+) -> None:
+    with pytest.raises(error):
+        patterns.compile_pattern(expression, replacement)
+
+
+def test_check_pattern() -> None:
+    assert patterns.check_pattern("(a+)+b", max_risk=patterns.EXPONENTIAL_RISK)
+    with pytest.raises(patterns.RiskyPatternError) as info:
+        patterns.check_pattern("(a+)+b", max_risk=patterns.POLYNOMIAL_RISK)
+    assert info.value.risk.score == patterns.EXPONENTIAL_RISK
+    assert patterns.NESTED_QUANTIFIERS in str(info.value)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from redesc.api import VideoRecord
+from redesc.search import SearchIndex
+from redesc.snapshot import Snapshot
+
+if TYPE_CHECKING:
+    import pathlib
+    from collections.abc import Sequence
+
+    from redesc.store import Store
+
+
+@pytest.fixture()
+def index(store: Store, tmp_path: pathlib.Path) -> SearchIndex:
+    Snapshot(store).save(
+        [
+            VideoRecord("a", "Koncert w Krakowie", "#muzyka", ("live",), "10", None),
+            VideoRecord("b", "Wywiad", "rozmowa #podcast", (), "22", None),
+        ],
+    )
+    return SearchIndex(store, tmp_path / "tags.json")
+
+
+def video_ids(
+    index: SearchIndex,
+    query: str = "",
+    *,
+    hashtags: Sequence[str] = (),
+    without_hashtags: Sequence[str] = (),
+) -> list[str]:
+    return [
+        result.video_id
+        for result in index.search(
+            query,
+            hashtags=hashtags,
+            without_hashtags=without_hashtags,
+        )
+    ]
+
+
+def test_words_match_as_prefixes(index: SearchIndex) -> None:
+    assert video_ids(index, "krak") == ["a"]
+    assert video_ids(index, "koncert wywiad") == []
+
+
+def test_hashtags(index: SearchIndex) -> None:
+    assert video_ids(index, hashtags=["#podcast", "#nic"]) == ["b"]
+    assert video_ids(index, without_hashtags=["#podcast"]) == ["a"]
+
+
+@pytest.mark.parametrize("query", ["!!!", "-", "  "])
+def test_query_without_words_matches_nothing(index: SearchIndex, query: str) -> None:
+    assert video_ids(index, query) == []
+    assert video_ids(index, query, hashtags=["#"]) == []
+
+
+def test_query_without_words_ignores_excluded_hashtags(index: SearchIndex) -> None:
+    assert video_ids(index, "!!!", without_hashtags=["#podcast"]) == []
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import pathlib
+from typing import TYPE_CHECKING, cast
+
+import pytest
+
+from redesc import shards
+from redesc.api import YouTubeAPI
+from redesc.cassette import (
+    Cassette,
+    ReplayCredentialManager,
+    ReplayHttp,
+    replay_http_factory,
+)
+from redesc.jobs import Rule
+from redesc.journal import Journal
+
+if TYPE_CHECKING:
+    from redesc.credentials import CredentialManager
+    from redesc.store import Store
+
+CASSETTES = pathlib.Path(__file__).parent / "cassettes"
+# The videos of all the cassettes: vid1 and vid3 match, vid2 does not.
+VIDEO_IDS = ["vid1", "vid2", "vid3"]
+
+
+@pytest.fixture()
+def shard_store(store: Store) -> shards.ShardStore:
+    return shards.ShardStore(store, daily_quota=1000)
+
+
+def replay(name: str) -> tuple[YouTubeAPI, ReplayHttp]:
+    http = ReplayHttp(Cassette.load(CASSETTES / f"{name}.json"), speed=0)
+    api = YouTubeAPI(
+        api_key="replay",
+        credential_manager=cast("CredentialManager", ReplayCredentialManager()),
+        http_factory=replay_http_factory(http),
+    )
+    return api, http
+
+
+def claim_run(shard_store: shards.ShardStore) -> shards.Shard:
+    shard_store.create_run(
+        shards.SUBSTITUTE,
+        VIDEO_IDS,
+        rule=Rule("foo", "baz"),
+        summary="foo → baz",
+        invoked_by="user",
+    )
+    shard = shard_store.claim("test")
+    assert shard is not None
+    return shard
+
+
+def test_create_run_splits_into_shards(shard_store: shards.ShardStore) -> None:
+    run_id = shard_store.create_run(shards.TAGS, VIDEO_IDS, shard_size=2)
+    first = shard_store.claim("a")
+    second = shard_store.claim("b")
+    assert first is not None
+    assert second is not None
+    assert (first.video_ids, second.video_ids) == (["vid1", "vid2"], ["vid3"])
+    assert first.run.id == run_id
+    assert first.run.rule is None
+    assert shard_store.claim("c") is None
+
+
+def test_expired_shard_is_claimed_again(store: Store) -> None:
+    shard_store = shards.ShardStore(store, lease=-1)
+    shard_store.create_run(shards.TAGS, VIDEO_IDS)
+    first = shard_store.claim("a")
+    second = shard_store.claim("b")
+    assert first is not None
+    assert second is not None
+    assert first.id == second.id
+
+
+def test_process_replayed(
+    store: Store,
+    shard_store: shards.ShardStore,
+) -> None:
+    journal = Journal(store)
+    shard = claim_run(shard_store)
+    api, http = replay("shard")
+    result = shards.process(shard, api, shard_store, journal=journal)
+    # vid3 is rejected by the API and counted as failed, not retried.
+    assert (result.matched, result.applied, result.failed) == (2, 1, 1)
+    assert result.left == []
+    assert not http.unused
+    assert shard_store.quota_used() == 1 + 2 * 50
+    (run,) = journal.runs()
+    (entry,) = journal.entries(run["id"])
+    assert entry.before.description == "foo i bar"
+    assert entry.after.description == "baz i bar"
+    assert entry.invoked_by == "user"
+
+
+def test_process_quota_exceeded_by_api(shard_store: shards.ShardStore) -> None:
+    shard = claim_run(shard_store)
+    api, http = replay("shard_quota")
+    result = shards.process(shard, api, shard_store)
+    assert result.applied == 0
+    assert result.left == VIDEO_IDS
+    assert not http.unused
+    # The whole budget is used up, so other workers stop as well.
+    assert shard_store.quota_used() == shard_store.budget()
+    assert not shard_store.reserve_quota(1)
+
+
+def test_process_quota_exceeded_midway(
+    store: Store,
+    shard_store: shards.ShardStore,
+) -> None:
+    journal = Journal(store)
+    shard = claim_run(shard_store)
+    api, http = replay("shard_quota_midway")
+    result = shards.process(shard, api, shard_store, journal=journal)
+    # vid1 is already updated: only the rest of the chunk is given back,
+    # so that the substitution is not applied to it twice.
+    assert (result.matched, result.applied) == (1, 1)
+    assert result.left == ["vid3"]
+    assert not http.unused
+    (run,) = journal.runs()
+    assert [entry.before.video_id for entry in journal.entries(run["id"])] == [
+        "vid1",
+    ]
+
+
+def test_process_within_budget(store: Store) -> None:
+    shard_store = shards.ShardStore(store, daily_quota=0)
+    shard = claim_run(shard_store)
+    api, http = replay("shard")
+    result = shards.process(shard, api, shard_store)
+    assert result.left == VIDEO_IDS
+    # Not a single request is made without the quota for it.
+    assert len(http.unused) == len(Cassette.load(CASSETTES / "shard.json").interactions)
+
+
+def test_finish_postpones_left_videos(shard_store: shards.ShardStore) -> None:
+    shard = claim_run(shard_store)
+    shard_store.finish(shard, shards.ShardResult(matched=1, left=["vid3"]))
+    # Due only after the quota resets.
+    assert shard_store.claim("test") is None
+    progress = shard_store.progress(shard.run.id)
+    assert (progress.shards, progress.pending, progress.matched) == (2, 1, 1)
+    assert shard_store.take_finished() == []
+    (row,) = shard_store.store.execute(
+        "SELECT video_ids FROM shards WHERE state = ?",
+        (shards.PENDING,),
+    )
+    assert json.loads(row["video_ids"]) == ["vid3"]
+
+
+def test_take_finished_reports_once(shard_store: shards.ShardStore) -> None:
+    shard = claim_run(shard_store)
+    shard_store.finish(shard, shards.ShardResult(error="boom"))
+    (progress,) = shard_store.take_finished()
+    assert progress.failed_shards == 1
+    assert progress.errors == ["boom"]
+    assert "`boom`" in progress.render()
+    assert shard_store.take_finished() == []
+
+
+def test_budgets_per_account(shard_store: shards.ShardStore) -> None:
+    shard_store.budgets["other"] = 10
+    assert shard_store.reserve_quota(10, "other")
+    assert not shard_store.reserve_quota(1, "other")
+    assert shard_store.reserve_quota(1000)
+    assert shard_store.quota_used("other") == 10
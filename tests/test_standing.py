@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, cast
+
+import pytest
+
+from redesc import standing
+
+if TYPE_CHECKING:
+    from redesc.standing import StandingRules
+
+
+class FakeReport:
+    def render(self) -> str:
+        return "digest"
+
+
+class FakeStanding:
+    def __init__(self) -> None:
+        self.cycles = 0
+
+    def run_cycle(self) -> FakeReport:
+        self.cycles += 1
+        return FakeReport()
+
+
+def test_failed_digest_does_not_stop_the_loop() -> None:
+    fake = FakeStanding()
+    messages: list[str] = []
+
+    async def notify(message: str) -> None:
+        messages.append(message)
+        raise ConnectionError
+
+    async def main() -> None:
+        loop = asyncio.create_task(
+            standing.run_standing_rules(
+                cast("StandingRules", fake),
+                notify,
+                interval=0,
+            ),
+        )
+        for _ in range(100):
+            if len(messages) >= 2:
+                break
+            await asyncio.sleep(0.01)
+        assert not loop.done()
+        loop.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await loop
+
+    asyncio.run(main())
+    assert messages[:2] == ["digest", "digest"]
+    assert fake.cycles >= 2